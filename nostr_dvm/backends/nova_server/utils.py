@@ -8,7 +8,9 @@ import requests
 import PIL.Image as Image
 from moviepy.video.io.VideoFileClip import VideoFileClip
 
+from nostr_dvm.utils.cancel_utils import cancellable_sleep, JobCancelled
 from nostr_dvm.utils.output_utils import upload_media_to_hoster
+from nostr_dvm.utils.trace_utils import traced
 
 """
 This file contains basic calling functions for ML tasks that are outsourced to nova server. It is an Open-Source backend
@@ -16,6 +18,10 @@ that enables running models locally based on preefined modules, by accepting a r
 Modules are deployed in in separate virtual environments so dependencies won't conflict. 
 """
 
+# connect and read timeout of calls to the server, results can be large
+SERVER_TIMEOUT = (10, 60)
+FETCH_TIMEOUT = (10, 300)
+
 """
 send_request_to_n_server(request_form, address)
 Function to send a request_form to the server, containing all the information we parsed from the Nostr event and added
@@ -23,11 +29,12 @@ in the module that is calling the server
 
 """
 
+@traced("send_request_to_server")
 def send_request_to_server(request_form, address):
     print("Sending job to Server")
     url = ('http://' + address + '/process')
     headers = {'Content-type': 'application/x-www-form-urlencoded'}
-    response = requests.post(url, headers=headers, data=request_form)
+    response = requests.post(url, headers=headers, data=request_form, timeout=SERVER_TIMEOUT)
     return response.text
 
 
@@ -36,7 +43,7 @@ def send_file_to_server(filepath, address):
     url = ('http://' + address + '/upload')
     try:
         fp = open(filepath, 'rb')
-        response = requests.post(url, files={'file': fp})
+        response = requests.post(url, files={'file': fp}, timeout=FETCH_TIMEOUT)
         result = response.content.decode('utf-8')
     except Exception as e:
         print(e)
@@ -44,14 +51,27 @@ def send_file_to_server(filepath, address):
 
     return result
 
+def cancel_server_job(jobID, address):
+    print("Cancelling job on Server")
+    url = 'http://' + address + '/cancel'
+    headers = {'Content-type': 'application/x-www-form-urlencoded'}
+    try:
+        requests.post(url, headers=headers, data={"jobID": jobID}, timeout=SERVER_TIMEOUT)
+    except Exception as e:
+        print("Couldn't cancel job on server: " + str(e))
+
+
 """
 check_n_server_status(request_form, address)
 Function that requests the status of the current process with the jobID (we use the Nostr event as jobID).
 When the Job is successfully finished we grab the result and depending on the type return the output
-We throw an exception on error
+We throw an exception on error. If the DVM job is cancelled, we ask the server to cancel its job and stop polling.
+The status is polled from a ThreadPool in the modules, which doesn't copy context variables, so they run it in a copy
+of the job's context to keep its cancel token and trace span.
 """
 
 
+@traced("check_server_status")
 def check_server_status(jobID, address) -> str | pd.DataFrame:
     headers = {'Content-type': 'application/x-www-form-urlencoded'}
     url_status = 'http://' + address + '/job_status'
@@ -63,8 +83,8 @@ def check_server_status(jobID, address) -> str | pd.DataFrame:
     status = 0
     length = 0
     while status != 2 and status != 3:
-        response_status = requests.post(url_status, headers=headers, data=data)
-        response_log = requests.post(url_log, headers=headers, data=data)
+        response_status = requests.post(url_status, headers=headers, data=data, timeout=SERVER_TIMEOUT)
+        response_log = requests.post(url_log, headers=headers, data=data, timeout=SERVER_TIMEOUT)
         status = int(json.loads(response_status.text)['status'])
         log_content = str(json.loads(response_log.text)['message']).replace("ERROR", "").replace("INFO", "")
         log = log_content[length:]
@@ -72,14 +92,19 @@ def check_server_status(jobID, address) -> str | pd.DataFrame:
         if log != "":
             print(log)
         # WAITING = 0, RUNNING = 1, FINISHED = 2, ERROR = 3
-        time.sleep(1.0)
+        if status != 2 and status != 3:
+            try:
+                cancellable_sleep(1.0)
+            except JobCancelled:
+                cancel_server_job(jobID, address)
+                raise
 
     if status == 2:
         try:
             url_fetch = 'http://' + address + '/fetch_result'
             print("Fetching Results from Server...")
             data = {"jobID": jobID, "delete_after_download": True}
-            response = requests.post(url_fetch, headers=headers, data=data)
+            response = requests.post(url_fetch, headers=headers, data=data, timeout=FETCH_TIMEOUT)
             content_type = response.headers['content-type']
             print("Content-type: " + str(content_type))
             if content_type == "image/jpeg":
@@ -9,10 +9,12 @@ from nostr_sdk import (Keys, Client, Timestamp, Filter, nip04_decrypt, HandleNot
                        UnsignedEvent, nip59_extract_rumor)
 
 from nostr_dvm.utils.admin_utils import admin_make_database_updates
+from nostr_dvm.utils.dedup_utils import SeenEvents
 from nostr_dvm.utils.database_utils import get_or_add_user, update_user_balance, create_sql_table, update_sql_table
 from nostr_dvm.utils.definitions import EventDefinitions
 from nostr_dvm.utils.nip89_utils import nip89_fetch_events_pubkey, NIP89Config
 from nostr_dvm.utils.nostr_utils import send_event
+from nostr_dvm.utils.relay_hub_utils import get_relay_hub
 from nostr_dvm.utils.output_utils import PostProcessFunctionType, post_process_list_to_users, \
     post_process_list_to_events
 from nostr_dvm.utils.zap_utils import parse_zap_event_tags, pay_bolt11_ln_bits, zaprequest
@@ -36,12 +38,19 @@ class Bot:
         skip_disconnected_relays = True
         opts = (Options().wait_for_send(wait_for_send).send_timeout(timedelta(seconds=self.dvm_config.RELAY_TIMEOUT))
                 .skip_disconnected_relays(skip_disconnected_relays))
-        signer = NostrSigner.keys(self.keys)
-        self.client = Client.with_opts(signer, opts)
+        if self.dvm_config.SHARED_RELAY_HUB:
+            self.client = get_relay_hub(opts).client_for(self.NAME, self.keys.public_key().to_hex())
+            # everything the bot subscribes to is addressed to it
+            self.client.route()
+        else:
+            signer = NostrSigner.keys(self.keys)
+            self.client = Client.with_opts(signer, opts)
 
         pk = self.keys.public_key()
 
         self.job_list = []
+        self.seen_events = SeenEvents(max_size=self.dvm_config.DEDUP_MAX_EVENTS,
+                                      window_seconds=self.dvm_config.DEDUP_WINDOW_SECONDS)
 
         print("Nostr BOT public key: " + str(pk.to_bech32()) + " Hex: " + str(pk.to_hex()) + " Name: " + self.NAME +
               " Supported DVM tasks: " +
@@ -69,8 +78,13 @@ class Bot:
             client = self.client
             dvm_config = self.dvm_config
             keys = self.keys
+            seen_events = self.seen_events
 
             def handle(self, relay_url, subscription_id, nostr_event):
+                # the same event arrives from several relays, only handle it once
+                if self.seen_events.is_duplicate(nostr_event.id().to_hex()):
+                    return
+
                 if (EventDefinitions.KIND_NIP90_EXTRACT_TEXT.as_u64() + 1000 <= nostr_event.kind().as_u64()
                         <= EventDefinitions.KIND_NIP90_GENERIC.as_u64() + 1000):
                     handle_nip90_response_event(nostr_event)
@@ -631,6 +645,9 @@ class Bot:
             return None
 
         self.client.handle_notifications(NotificationHandler())
+        if self.dvm_config.ASYNC_RUNTIME:
+            # nothing to do periodically, notifications are handled by the client
+            return
 
         try:
             while True:
@@ -1,26 +1,42 @@
 import json
 import os
-import subprocess
 from datetime import timedelta
 from sys import platform
 
 from nostr_sdk import PublicKey, Keys, Client, Tag, Event, EventBuilder, Filter, HandleNotification, Timestamp, \
-    init_logger, LogLevel, Options, nip04_encrypt, NostrSigner, Kind, SubscribeAutoCloseOptions
+    init_logger, LogLevel, Options, NostrSigner, Kind, SubscribeAutoCloseOptions, EventId
 
 import time
 
 from nostr_dvm.utils.definitions import EventDefinitions, RequiredJobToWatch, JobToWatch
+from nostr_dvm.utils.crypto_utils import CryptoContext, get_crypto_context
 from nostr_dvm.utils.dvmconfig import DVMConfig
 from nostr_dvm.utils.admin_utils import admin_make_database_updates, AdminConfig
 from nostr_dvm.utils.backend_utils import get_amount_per_task, check_task_is_supported, get_task
+from nostr_dvm.utils.cache_utils import ResultCache, SingleFlight, build_cache_key
+from nostr_dvm.utils.cancel_utils import cancel_scope, current_cancel_token, JobCancelled, Watchdog, run_abandonable
+from nostr_dvm.utils.dedup_utils import SeenEvents
 from nostr_dvm.utils.database_utils import create_sql_table, get_or_add_user, update_user_balance, update_sql_table, \
     update_user_subscription
+from nostr_dvm.utils.feedback_utils import FeedbackPublisher
+from nostr_dvm.utils.job_store_utils import JobStore
+from nostr_dvm.utils.job_utils import JobRegistry, HeldJobs, job_id
 from nostr_dvm.utils.mediasource_utils import input_data_file_duration
+from nostr_dvm.utils.metrics_utils import timed, count, observe, start_metrics
 from nostr_dvm.utils.nip88_utils import nip88_has_active_subscription
-from nostr_dvm.utils.nostr_utils import get_event_by_id, get_referenced_event_by_id, send_event, check_and_decrypt_tags
+from nostr_dvm.utils.nostr_utils import get_event_by_id, get_referenced_event_by_id, send_event, check_and_decrypt_tags, \
+    parse_event_id, request_relays, close_idle_relays
 from nostr_dvm.utils.output_utils import build_status_reaction
-from nostr_dvm.utils.zap_utils import check_bolt11_ln_bits_is_paid, create_bolt11_ln_bits, parse_zap_event_tags, \
-    parse_amount_from_bolt11_invoice, zaprequest, pay_bolt11_ln_bits, create_bolt11_lud16
+from nostr_dvm.utils.payment_utils import InvoiceSettlementPoller, InvoiceProvisioner
+from nostr_dvm.utils.ratelimit_utils import RateLimiter
+from nostr_dvm.utils.relay_hub_utils import get_relay_hub
+from nostr_dvm.utils.runtime_utils import get_runtime, call_process
+from nostr_dvm.utils.stream_utils import streaming
+from nostr_dvm.utils.trace_utils import configure_tracing, job_span
+from nostr_dvm.utils.worker_utils import JobExecutor, run_process_in_pool, run_venv_process, VenvWorkerPool, \
+    PRIORITY_SUBSCRIBER, PRIORITY_PAID, PRIORITY_WHITELISTED, PRIORITY_FREE
+from nostr_dvm.utils.zap_utils import parse_zap_event_tags, parse_amount_from_bolt11_invoice, zaprequest, \
+    pay_bolt11_ln_bits
 from nostr_dvm.utils.cashu_utils import redeem_cashu
 
 
@@ -28,24 +44,71 @@ class DVM:
     dvm_config: DVMConfig
     admin_config: AdminConfig
     keys: Keys
+    crypto: CryptoContext
     client: Client
-    job_list: list
-    jobs_on_hold_list: list
+    job_registry: JobRegistry
+    jobs_on_hold: HeldJobs
+    executor: JobExecutor
+    invoice_poller: InvoiceSettlementPoller
+    invoice_provisioner: InvoiceProvisioner
+    job_store: JobStore
+    seen_events: SeenEvents
+    rate_limiter: RateLimiter
+    venv_workers: VenvWorkerPool
+    result_cache: ResultCache
+    in_flight: SingleFlight
+    feedback: FeedbackPublisher
+    watchdog: Watchdog
 
     def __init__(self, dvm_config, admin_config=None):
         self.dvm_config = dvm_config
         self.admin_config = admin_config
-        self.keys = Keys.parse(dvm_config.PRIVATE_KEY)
+        # parsed keys and shared secrets with customers, for encrypted requests
+        self.crypto = get_crypto_context(dvm_config.PRIVATE_KEY)
+        self.keys = self.crypto.keys
         wait_for_send = False
         skip_disconnected_relays = True
         opts = (Options().wait_for_send(wait_for_send).send_timeout(timedelta(seconds=self.dvm_config.RELAY_TIMEOUT))
                 .skip_disconnected_relays(skip_disconnected_relays))
 
-        signer = NostrSigner.keys(self.keys)
-        self.client = Client.with_opts(signer, opts)
-
-        self.job_list = []
-        self.jobs_on_hold_list = []
+        if self.dvm_config.SHARED_RELAY_HUB:
+            self.client = get_relay_hub(opts).client_for(self.dvm_config.NIP89.NAME, self.keys.public_key().to_hex())
+        else:
+            signer = NostrSigner.keys(self.keys)
+            self.client = Client.with_opts(signer, opts)
+
+        self.job_registry = JobRegistry()
+        self.jobs_on_hold = HeldJobs()
+        self.job_input_subscriptions = {}
+        self.seen_events = SeenEvents(max_size=self.dvm_config.DEDUP_MAX_EVENTS,
+                                      window_seconds=self.dvm_config.DEDUP_WINDOW_SECONDS)
+        self.rate_limiter = RateLimiter(user_rate=self.dvm_config.RATE_LIMIT_PER_USER,
+                                        user_burst=self.dvm_config.RATE_LIMIT_USER_BURST,
+                                        global_rate=self.dvm_config.RATE_LIMIT_GLOBAL,
+                                        global_burst=self.dvm_config.RATE_LIMIT_GLOBAL_BURST)
+        self.executor = JobExecutor(self.dvm_config.NIP89.NAME, max_workers=self.dvm_config.MAX_WORKERS,
+                                    max_queue=self.dvm_config.MAX_QUEUED_JOBS,
+                                    task_limits=self.dvm_config.TASK_CONCURRENCY_LIMITS,
+                                    user_weights=self.dvm_config.USER_WEIGHTS)
+        self.invoice_poller = None
+        cache_db = None
+        if self.dvm_config.RESULT_CACHE_ON_DISK:
+            cache_db = self.dvm_config.DB.replace(".db", "_cache.db")
+        self.result_cache = ResultCache(max_entries=self.dvm_config.RESULT_CACHE_SIZE, db=cache_db)
+        self.in_flight = SingleFlight()
+        self.feedback = FeedbackPublisher(self.dvm_config.NIP89.NAME, window=self.dvm_config.FEEDBACK_COALESCE_SECONDS,
+                                          min_interval=self.dvm_config.FEEDBACK_MIN_INTERVAL)
+        self.watchdog = Watchdog(self.dvm_config.NIP89.NAME)
+        self.venv_workers = None
+        if self.dvm_config.USE_OWN_VENV and self.dvm_config.SCRIPT != "" and self.dvm_config.VENV_WORKERS > 0:
+            self.venv_workers = VenvWorkerPool(venv_python(self.dvm_config.SCRIPT), self.dvm_config.SCRIPT,
+                                               self.dvm_config.IDENTIFIER, size=self.dvm_config.VENV_WORKERS)
+        self.job_store = None
+        if self.dvm_config.JOB_STORE:
+            self.job_store = JobStore(self.dvm_config.DB.replace(".db", "_jobs.db"))
+        start_metrics(port=self.dvm_config.METRICS_PORT, log_seconds=self.dvm_config.METRICS_LOG_SECONDS)
+        configure_tracing(self.dvm_config.TRACE_SAMPLE_RATE, file=self.dvm_config.TRACE_FILE,
+                          collector_url=self.dvm_config.TRACE_COLLECTOR_URL)
         pk = self.keys.public_key()
 
         print("Nostr DVM public key: " + str(pk.to_bech32()) + " Hex: " + str(pk.to_hex()) + " Supported DVM tasks: " +
@@ -62,7 +125,16 @@ class DVM:
                 kinds.append(dvm.KIND)
         dvm_filter = (Filter().kinds(kinds).since(Timestamp.now()))
 
-        self.client.subscribe([dvm_filter, zap_filter], None)
+        if self.dvm_config.SHARED_RELAY_HUB:
+            # results are addressed to the customer, we need them to release chained jobs
+            self.client.route(kinds=kinds + [EventDefinitions.KIND_ZAP],
+                              any_p_kinds=EventDefinitions.ANY_RESULT + [EventDefinitions.KIND_DELETE])
+        filters = [dvm_filter, zap_filter]
+        if self.dvm_config.JOB_CANCELLATION:
+            # deletions are matched against our queued and running jobs when they come in, so the subscription
+            # doesn't change with the jobs
+            filters.append(Filter().kind(EventDefinitions.KIND_DELETE).since(Timestamp.now()))
+        self.client.subscribe(filters, None)
 
         create_sql_table(self.dvm_config.DB)
         admin_make_database_updates(adminconfig=self.admin_config, dvmconfig=self.dvm_config, client=self.client)
@@ -71,20 +143,74 @@ class DVM:
             client = self.client
             dvm_config = self.dvm_config
             keys = self.keys
+            seen_events = self.seen_events
+            result_kinds = {kind.as_u64() for kind in EventDefinitions.ANY_RESULT}
+            # generic requests name their task in a param, any of our tasks might be asked for
+            served_kinds = ({dvm.KIND.as_u64() for dvm in self.dvm_config.SUPPORTED_DVMS} |
+                            {EventDefinitions.KIND_NIP90_GENERIC.as_u64()})
+            first_job_kind = EventDefinitions.KIND_NIP90_EXTRACT_TEXT.as_u64()
+            last_job_kind = EventDefinitions.KIND_NIP90_GENERIC.as_u64()
+            zap_kind = EventDefinitions.KIND_ZAP.as_u64()
+            delete_kind = EventDefinitions.KIND_DELETE.as_u64()
 
             def handle(self, relay_url, subscription_id, nostr_event: Event):
+                # the same event arrives from several relays, only handle it once
+                if self.seen_events.is_duplicate(nostr_event.id().to_hex()):
+                    count("duplicate_events", self.dvm_config.NIP89.NAME)
+                    return
 
-                if EventDefinitions.KIND_NIP90_EXTRACT_TEXT.as_u64() <= nostr_event.kind().as_u64() <= EventDefinitions.KIND_NIP90_GENERIC.as_u64():
-                    handle_nip90_job_event(nostr_event)
-                elif nostr_event.kind().as_u64() == EventDefinitions.KIND_ZAP.as_u64():
+                kind = nostr_event.kind().as_u64()
+                if self.first_job_kind <= kind <= self.last_job_kind:
+                    if not self.is_for_us(nostr_event, kind):
+                        count("dropped_requests", self.dvm_config.NIP89.NAME)
+                        return
+                    count("requests", self.dvm_config.NIP89.NAME)
+                    # admission check before any decryption or other expensive work is done for the request
+                    if not admit_request(nostr_event):
+                        return
+                    with job_span(nostr_event.id().to_hex(), "handle_nip90_job_event", relay=relay_url, kind=kind):
+                        handle_nip90_job_event(nostr_event)
+                elif kind == self.zap_kind:
                     handle_zap(nostr_event)
+                elif kind in self.result_kinds:
+                    release_held_jobs(nostr_event)
+                elif kind == self.delete_kind:
+                    handle_deletion(nostr_event)
+
+            def is_for_us(self, nostr_event, kind):
+                # Pre-filter before any decryption, json or relay work: drop kinds we don't serve and requests that
+                # are addressed to another DVM. The p tag of encrypted requests is not encrypted.
+                if kind not in self.served_kinds:
+                    return False
+                p_tag_str = ""
+                for tag in nostr_event.tags():
+                    values = tag.as_vec()
+                    if values[0] == "p" and len(values) > 1:
+                        p_tag_str = values[1]
+                return p_tag_str == "" or p_tag_str == self.dvm_config.PUBLIC_KEY
 
             def handle_msg(self, relay_url, msg):
                 return
 
-        def handle_nip90_job_event(nip90_event):
+        def admit_request(nostr_event):
+            allowed, notify = self.rate_limiter.check(nostr_event.author().to_hex())
+            if allowed:
+                return True
+            print("[" + self.dvm_config.NIP89.NAME + "] Rate limited request by " + nostr_event.author().to_hex())
+            count("rate_limited_requests", self.dvm_config.NIP89.NAME)
+            if notify:
+                # the reaction is encrypted for encrypted requests, so the request doesn't need to be decrypted
+                task = next((dvm.TASK for dvm in self.dvm_config.SUPPORTED_DVMS
+                             if dvm.KIND.as_u64() == nostr_event.kind().as_u64()), "")
+                send_job_status_reaction(nostr_event, "rate-limited", True, 0, client=self.client,
+                                         dvm_config=self.dvm_config, task=task)
+            return False
+
+        def handle_nip90_job_event(nip90_event, inputs_ready=False):
+            original_event = nip90_event
             # decrypted encrypted events
-            nip90_event = check_and_decrypt_tags(nip90_event, self.dvm_config)
+            with timed("decrypt", self.dvm_config.NIP89.NAME):
+                nip90_event = check_and_decrypt_tags(nip90_event, self.dvm_config)
             # if event is encrypted, but we can't decrypt it (e.g. because its directed to someone else), return
             if nip90_event is None:
                 return
@@ -104,15 +230,19 @@ class DVM:
                 print("[" + self.dvm_config.NIP89.NAME + "] No public request, also not addressed to me.")
                 return
 
-
             # check if task is supported by the current DVM
-            task_supported, task = check_task_is_supported(nip90_event, client=self.client,
-                                                           config=self.dvm_config)
+            with timed("task_detection", self.dvm_config.NIP89.NAME):
+                task_supported, task = check_task_is_supported(nip90_event, client=self.client,
+                                                               config=self.dvm_config)
             # if task is supported, continue, else do nothing.
             if task_supported:
+                # chained jobs wait until the jobs they take as input have a result
+                if not inputs_ready and hold_if_inputs_missing(original_event, nip90_event):
+                    return
                 # fetch or add user contacting the DVM from/to local database
-                user = get_or_add_user(self.dvm_config.DB, nip90_event.author().to_hex(), client=self.client,
-                                       config=self.dvm_config, skip_meta=False)
+                with timed("user_lookup", self.dvm_config.NIP89.NAME, task):
+                    user = get_or_add_user(self.dvm_config.DB, nip90_event.author().to_hex(), client=self.client,
+                                           config=self.dvm_config, skip_meta=False)
                 # if user is blacklisted for some reason, send an error reaction and return
                 if user.isblacklisted:
                     send_job_status_reaction(nip90_event, "error", client=self.client, dvm_config=self.dvm_config)
@@ -120,8 +250,9 @@ class DVM:
                     return
 
                 print("[" + self.dvm_config.NIP89.NAME + "] Received new Request: " + task + " from " + user.name)
-                duration = input_data_file_duration(nip90_event, dvm_config=self.dvm_config, client=self.client)
-                amount = get_amount_per_task(task, self.dvm_config, duration)
+                with timed("pricing", self.dvm_config.NIP89.NAME, task):
+                    duration = input_data_file_duration(nip90_event, dvm_config=self.dvm_config, client=self.client)
+                    amount = get_amount_per_task(task, self.dvm_config, duration)
                 if amount is None:
                     return
 
@@ -196,7 +327,13 @@ class DVM:
                     #  when we reimburse users on error make sure to not send anything if it was free
                     if user.iswhitelisted or task_is_free:
                         amount = 0
-                    do_work(nip90_event, amount)
+                    if cashu_redeemed:
+                        priority = PRIORITY_PAID
+                    elif user.iswhitelisted:
+                        priority = PRIORITY_WHITELISTED
+                    else:
+                        priority = PRIORITY_FREE
+                    submit_work(nip90_event, amount, task, priority)
                 # if task is directed to us via p tag and user has balance or is subscribed, do the job and update balance
                 elif (p_tag_str == self.dvm_config.PUBLIC_KEY and (
                         user.balance >= int(
@@ -220,7 +357,8 @@ class DVM:
                     send_job_status_reaction(nip90_event, "processing", True, 0,
                                              client=self.client, dvm_config=self.dvm_config)
 
-                    do_work(nip90_event, amount)
+                    submit_work(nip90_event, amount, task,
+                                PRIORITY_SUBSCRIBER if user_has_active_subscription else PRIORITY_PAID)
 
                 # else send a payment required event to user
                 elif p_tag_str == "" or p_tag_str == self.dvm_config.PUBLIC_KEY:
@@ -311,23 +449,21 @@ class DVM:
                                     print("[" + self.dvm_config.NIP89.NAME + "]  Payment-request fulfilled...")
                                     send_job_status_reaction(job_event, "processing", client=self.client,
                                                              dvm_config=self.dvm_config, user=user)
-                                    indices = [i for i, x in enumerate(self.job_list) if
-                                               x.event == job_event]
-                                    index = -1
-                                    if len(indices) > 0:
-                                        index = indices[0]
-                                    if index > -1:
-                                        if self.job_list[index].is_processed:
-                                            self.job_list[index].is_paid = True
-                                            check_and_return_event(self.job_list[index].result, job_event)
-                                        elif not (self.job_list[index]).is_processed:
+                                    job = self.job_registry.get(job_event)
+                                    if job is not None:
+                                        if job.is_processed:
+                                            self.job_registry.set_paid(job)
+                                            check_and_return_event(job.result, job_event)
+                                        elif not job.is_processed:
                                             # If payment-required appears before processing
-                                            self.job_list.pop(index)
+                                            self.job_registry.remove(job_event)
+                                            if self.invoice_poller is not None:
+                                                self.invoice_poller.unwatch(job.payment_hash)
                                             print("Starting work...")
-                                            do_work(job_event, invoice_amount)
+                                            submit_work(job_event, invoice_amount, task, PRIORITY_PAID)
                                     else:
                                         print("Job not in List, but starting work...")
-                                        do_work(job_event, invoice_amount)
+                                        submit_work(job_event, invoice_amount, task, PRIORITY_PAID)
 
                                 else:
                                     send_job_status_reaction(job_event, "payment-rejected",
@@ -356,59 +492,107 @@ class DVM:
             except Exception as e:
                 print("[" + self.dvm_config.NIP89.NAME + "] Error during content decryption: " + str(e))
 
-        def check_event_has_not_unfinished_job_input(nevent, append, client, dvmconfig):
-            task_supported, task = check_task_is_supported(nevent, client, config=dvmconfig)
-            if not task_supported:
+        def hold_if_inputs_missing(original_event, nevent):
+            missing = set()
+            for tag in nevent.tags():
+                if tag.as_vec()[0] == 'i' and len(tag.as_vec()) > 2 and tag.as_vec()[2] == "job":
+                    evt = get_referenced_event_by_id(event_id=tag.as_vec()[1], client=self.client,
+                                                     kinds=EventDefinitions.ANY_RESULT,
+                                                     dvm_config=self.dvm_config)
+                    if evt is None:
+                        missing.add(parse_event_id(tag.as_vec()[1]).to_hex())
+            if len(missing) == 0:
                 return False
 
-            for tag in nevent.tags():
-                if tag.as_vec()[0] == 'i':
-                    if len(tag.as_vec()) < 3:
-                        print("Job Event missing/malformed i tag, skipping..")
-                        return False
-                    else:
-                        input = tag.as_vec()[1]
-                        input_type = tag.as_vec()[2]
-                        if input_type == "job":
-                            evt = get_referenced_event_by_id(event_id=input, client=client,
-                                                             kinds=EventDefinitions.ANY_RESULT,
-                                                             dvm_config=dvmconfig)
-                            if evt is None:
-                                if append:
-                                    job_ = RequiredJobToWatch(event=nevent, timestamp=Timestamp.now().as_secs())
-                                    self.jobs_on_hold_list.append(job_)
-                                    send_job_status_reaction(nevent, "chain-scheduled", True, 0,
-                                                             client=client, dvm_config=dvmconfig)
-
-                                return False
-            else:
-                return True
+            # the original event is kept, so encrypted jobs are decrypted again when they are released
+            held = RequiredJobToWatch(event=original_event, timestamp=Timestamp.now().as_secs(), awaiting=missing)
+            for awaited in self.jobs_on_hold.hold(held):
+                # no since(), so a result that was published while we checked is delivered as well
+                result_filter = Filter().kinds(EventDefinitions.ANY_RESULT).event(EventId.from_hex(awaited))
+                self.job_input_subscriptions[awaited] = self.client.subscribe([result_filter], None)
+            send_job_status_reaction(nevent, "chain-scheduled", True, 0, client=self.client,
+                                     dvm_config=self.dvm_config)
+            return True
+
+        def release_held_jobs(result_event):
+            for tag in result_event.tags():
+                if tag.as_vec()[0] == 'e':
+                    awaited = tag.as_vec()[1]
+                    ready = self.jobs_on_hold.release(awaited)
+                    unsubscribe_job_input(awaited)
+                    for held in ready:
+                        print("[" + self.dvm_config.NIP89.NAME + "] Input for chained job " + job_id(held.event) +
+                              " is ready")
+                        handle_nip90_job_event(held.event, inputs_ready=True)
+
+        def unsubscribe_job_input(awaited):
+            subscription_id = self.job_input_subscriptions.pop(awaited, None)
+            if subscription_id is not None:
+                try:
+                    self.client.unsubscribe(subscription_id)
+                except Exception as e:
+                    print(e)
+
+        def handle_deletion(deletion_event):
+            # the customer deleted the request, queued or running work for it is stopped
+            author = deletion_event.author().to_hex()
+            for tag in deletion_event.tags():
+                if tag.as_vec()[0] != 'e' or len(tag.as_vec()) < 2:
+                    continue
+                token, job = self.job_registry.cancel(tag.as_vec()[1], author, "Request was deleted")
+                if token is not None:
+                    print("[" + self.dvm_config.NIP89.NAME + "] Request " + tag.as_vec()[1] +
+                          " was deleted, cancelling job")
+                if job is not None:
+                    print("[" + self.dvm_config.NIP89.NAME + "] Request " + tag.as_vec()[1] +
+                          " was deleted, dropping unpaid job")
+                    if self.invoice_poller is not None:
+                        self.invoice_poller.unwatch(job.payment_hash)
+                    record_job(job.event, "cancelled")
+
+        def job_cancelled(job_event, amount, started, task=""):
+            token = current_cancel_token()
+            self.feedback.drop_pending(job_event.id().to_hex())
+            if token.timed_out:
+                # the backend is stuck, the work was abandoned and the customer gets the sats back
+                print("[" + self.dvm_config.NIP89.NAME + "] Job " + job_event.id().to_hex() + ": " + token.reason)
+                record_job(job_event, "timeout")
+                count("jobs_timed_out", self.dvm_config.NIP89.NAME, task)
+                send_job_status_reaction(job_event, "error", content=token.reason, dvm_config=self.dvm_config,
+                                         task=task or None)
+                zap_back(job_event, amount)
+                return
+            print("[" + self.dvm_config.NIP89.NAME + "] Job " + job_event.id().to_hex() + " was cancelled")
+            record_job(job_event, "cancelled")
+            count("jobs_cancelled", self.dvm_config.NIP89.NAME, task)
+            # nothing was done for jobs that were cancelled before they started, so the sats go back
+            if not started:
+                zap_back(job_event, amount)
 
         def check_and_return_event(data, original_event: Event):
             amount = 0
-            for x in self.job_list:
-                if x.event == original_event:
-                    is_paid = x.is_paid
-                    amount = x.amount
-                    x.result = data
-                    x.is_processed = True
-                    if self.dvm_config.SHOW_RESULT_BEFORE_PAYMENT and not is_paid:
-                        send_nostr_reply_event(data, original_event.as_json())
-                        send_job_status_reaction(original_event, "success", amount,
-                                                 dvm_config=self.dvm_config,
-                                                 )  # or payment-required, or both?
-                    elif not self.dvm_config.SHOW_RESULT_BEFORE_PAYMENT and not is_paid:
-                        send_job_status_reaction(original_event, "success", amount,
-                                                 dvm_config=self.dvm_config,
-                                                 )  # or payment-required, or both?
-
-                    if self.dvm_config.SHOW_RESULT_BEFORE_PAYMENT and is_paid:
-                        self.job_list.remove(x)
-                    elif not self.dvm_config.SHOW_RESULT_BEFORE_PAYMENT and is_paid:
-                        self.job_list.remove(x)
-                        send_nostr_reply_event(data, original_event.as_json())
-                    break
-
+            x = self.job_registry.get(original_event)
+            if x is not None:
+                is_paid = x.is_paid
+                amount = x.amount
+                x.result = data
+                x.is_processed = True
+                if self.dvm_config.SHOW_RESULT_BEFORE_PAYMENT and not is_paid:
+                    send_nostr_reply_event(data, original_event.as_json())
+                    send_job_status_reaction(original_event, "success", amount,
+                                             dvm_config=self.dvm_config,
+                                             )  # or payment-required, or both?
+                elif not self.dvm_config.SHOW_RESULT_BEFORE_PAYMENT and not is_paid:
+                    send_job_status_reaction(original_event, "success", amount,
+                                             dvm_config=self.dvm_config,
+                                             )  # or payment-required, or both?
+
+                if self.dvm_config.SHOW_RESULT_BEFORE_PAYMENT and is_paid:
+                    self.job_registry.remove(original_event)
+                elif not self.dvm_config.SHOW_RESULT_BEFORE_PAYMENT and is_paid:
+                    self.job_registry.remove(original_event)
+                    send_nostr_reply_event(data, original_event.as_json())
+            else:
                 task = get_task(original_event, self.client, self.dvm_config)
                 for dvm in self.dvm_config.SUPPORTED_DVMS:
                     if task == dvm.TASK:
@@ -423,20 +607,7 @@ class DVM:
                                                      content="Error in Post-processing: " + str(e),
                                                      dvm_config=self.dvm_config,
                                                      )
-                            if amount > 0 and self.dvm_config.LNBITS_ADMIN_KEY != "":
-                                user = get_or_add_user(self.dvm_config.DB, original_event.author().to_hex(),
-                                                       client=self.client, config=self.dvm_config)
-                                print(user.lud16 + " " + str(amount))
-                                bolt11 = zaprequest(user.lud16, amount, "Couldn't finish job, returning sats",
-                                                    original_event, "",
-                                                    self.keys, self.dvm_config.RELAY_LIST, zaptype="private")
-                                if bolt11 is None:
-                                    print("Receiver has no Lightning address, can't zap back.")
-                                    return
-                                try:
-                                    payment_hash = pay_bolt11_ln_bits(bolt11, self.dvm_config)
-                                except Exception as e:
-                                    print(e)
+                            zap_back(original_event, amount)
 
         def send_nostr_reply_event(content, original_event_as_str):
             original_event = Event.from_json(original_event_as_str)
@@ -462,21 +633,25 @@ class DVM:
 
             if encrypted:
                 print(content)
-                content = nip04_encrypt(self.keys.secret_key(), PublicKey.from_hex(original_event.author().to_hex()),
-                                        content)
+                content = self.crypto.encrypt(original_event.author(), content)
 
             reply_event = EventBuilder(Kind(original_event.kind().as_u64() + 1000), str(content), reply_tags).to_event(
                 self.keys)
 
-            send_event(reply_event, client=self.client, dvm_config=self.dvm_config)
+            # progress updates that are still queued are outdated now, partial results and other statuses go out first
+            self.feedback.flush(original_event.id().to_hex())
+            with job_span(original_event.id().to_hex(), "send_nostr_reply_event"):
+                send_event(reply_event, client=self.client, dvm_config=self.dvm_config,
+                           relays=request_relays(original_event))
             print("[" + self.dvm_config.NIP89.NAME + "] " + str(
                 original_event.kind().as_u64() + 1000) + " Job Response event sent: " + reply_event.as_json())
 
         def send_job_status_reaction(original_event, status, is_paid=True, amount=0, client=None,
                                      content=None,
-                                     dvm_config=None, user=None):
+                                     dvm_config=None, user=None, task=None):
 
-            task = get_task(original_event, client=client, dvm_config=dvm_config)
+            if task is None:
+                task = get_task(original_event, client=client, dvm_config=dvm_config)
             alt_description, reaction = build_status_reaction(status, task, amount, content, dvm_config)
 
             e_tag = Tag.parse(["e", original_event.id().to_hex()])
@@ -502,76 +677,86 @@ class DVM:
 
 
             if status == "success" or status == "error":  #
-                for x in self.job_list:
-                    if x.event == original_event:
-                        is_paid = x.is_paid
-                        amount = x.amount
-                        break
-
-            bolt11 = ""
-            payment_hash = ""
-            expires = original_event.created_at().as_secs() + (60 * 60 * 24)
-            if status == "payment-required" or (
-                    status == "processing" and not is_paid):
-                if dvm_config.LNBITS_INVOICE_KEY != "":
-                    try:
-                        bolt11, payment_hash = create_bolt11_ln_bits(amount, dvm_config)
-                    except Exception as e:
-                        print(e)
-                        try:
-                            bolt11, payment_hash = create_bolt11_lud16(dvm_config.LN_ADDRESS,
-                                                                       amount)
-                        except Exception as e:
-                            print(e)
-                            bolt11 = None
-                elif dvm_config.LN_ADDRESS != "":
-                    try:
-                        bolt11, payment_hash = create_bolt11_lud16(dvm_config.LN_ADDRESS, amount)
-                    except Exception as e:
-                        print(e)
-                        bolt11 = None
+                x = self.job_registry.get(original_event)
+                if x is not None:
+                    is_paid = x.is_paid
+                    amount = x.amount
 
-            if not any(x.event == original_event for x in self.job_list):
-                self.job_list.append(
+            expires = original_event.created_at().as_secs() + (60 * 60 * 24)
+            # rate limited requests are not jobs, so they are not watched, partial results belong to a running job
+            job = None
+            if status != "rate-limited" and status != "partial":
+                job = self.job_registry.add(
                     JobToWatch(event=original_event,
                                timestamp=original_event.created_at().as_secs(),
                                amount=amount,
                                is_paid=is_paid,
-                               status=status, result="", is_processed=False, bolt11=bolt11,
-                               payment_hash=payment_hash,
+                               status=status, result="", is_processed=False, bolt11="",
+                               payment_hash="",
                                expires=expires))
-                # print(str(self.job_list))
-            if (status == "payment-required" or status == "payment-rejected" or (
-                    status == "processing" and not is_paid)
-                    or (status == "success" and not is_paid)):
-
-                if dvm_config.LNBITS_INVOICE_KEY != "" and bolt11 is not None:
-                    amount_tag = Tag.parse(["amount", str(amount * 1000), bolt11])
-                else:
-                    amount_tag = Tag.parse(["amount", str(amount * 1000)])  # to millisats
-                reply_tags.append(amount_tag)
 
-            if encrypted:
-                content_tag = Tag.parse(["content", reaction])
-                reply_tags.append(content_tag)
-                str_tags = []
-                for element in reply_tags:
-                    str_tags.append(element.as_vec())
+            def publish(bolt11, payment_hash):
+                if job is not None and self.job_registry.set_invoice(job, bolt11, payment_hash):
+                    record_job(original_event, "payment-required", amount=amount, is_paid=False, bolt11=bolt11,
+                               payment_hash=payment_hash, expires=expires)
+                    if self.invoice_poller is not None:
+                        self.invoice_poller.watch(payment_hash)
+                has_invoice = False
+                tags = list(reply_tags)
+                if (status == "payment-required" or status == "payment-rejected" or (
+                        status == "processing" and not is_paid)
+                        or (status == "success" and not is_paid)):
+
+                    if dvm_config.LNBITS_INVOICE_KEY != "" and bolt11 is not None:
+                        amount_tag = Tag.parse(["amount", str(amount * 1000), bolt11])
+                    else:
+                        amount_tag = Tag.parse(["amount", str(amount * 1000)])  # to millisats
+                    tags.append(amount_tag)
+                    has_invoice = True
+
+                self.feedback.publish(original_event.id().to_hex(), status, lambda: deliver(tags),
+                                      has_invoice=has_invoice)
+
+            def deliver(event_tags):
+                # signed when it is sent, superseded updates are never built
+                tags = event_tags
+                if encrypted:
+                    content_tag = Tag.parse(["content", reaction])
+                    str_tags = []
+                    for element in event_tags + [content_tag]:
+                        str_tags.append(element.as_vec())
+
+                    content = json.dumps(str_tags)
+                    content = self.crypto.encrypt(original_event.author(), content)
+                    tags = encryption_tags
 
-                content = json.dumps(str_tags)
-                content = nip04_encrypt(self.keys.secret_key(), PublicKey.from_hex(original_event.author().to_hex()),
-                                        content)
-                reply_tags = encryption_tags
+                else:
+                    content = reaction
+
+                reaction_event = EventBuilder(EventDefinitions.KIND_FEEDBACK, str(content), tags).to_event(self.keys)
+                send_event(reaction_event, client=self.client, dvm_config=self.dvm_config,
+                           relays=request_relays(original_event))
+                print("[" + self.dvm_config.NIP89.NAME + "]" + ": Sent Kind " + str(
+                    EventDefinitions.KIND_FEEDBACK.as_u64()) + " Reaction: " + status + " " + reaction_event.as_json())
+
+            if status == "payment-required" or (status == "processing" and not is_paid):
+                # pooled invoices are there right away, others are created in the background and the reaction is sent
+                # when the invoice is ready, so we don't wait on the lightning backend here
+                invoice_start = time.perf_counter()
+                invoice = self.invoice_provisioner.invoice(amount)
+
+                def invoice_ready(future):
+                    observe("invoice", time.perf_counter() - invoice_start, self.dvm_config.NIP89.NAME, task)
+                    try:
+                        bolt11, payment_hash = future.result()
+                    except Exception as e:
+                        print(e)
+                        bolt11, payment_hash = None, ""
+                    publish(bolt11, payment_hash)
 
+                invoice.add_done_callback(invoice_ready)
             else:
-                content = reaction
-
-            keys = Keys.parse(dvm_config.PRIVATE_KEY)
-            reaction_event = EventBuilder(EventDefinitions.KIND_FEEDBACK, str(content), reply_tags).to_event(keys)
-            send_event(reaction_event, client=self.client, dvm_config=self.dvm_config)
-            print("[" + self.dvm_config.NIP89.NAME + "]" + ": Sent Kind " + str(
-                EventDefinitions.KIND_FEEDBACK.as_u64()) + " Reaction: " + status + " " + reaction_event.as_json())
-            return reaction_event.as_json()
+                publish("", "")
 
         def do_work(job_event, amount):
             if ((
@@ -584,99 +769,263 @@ class DVM:
                     result = ""
                     try:
                         if task == dvm.TASK:
-
-                            request_form = dvm.create_request_from_nostr_event(job_event, self.client, self.dvm_config)
-
+                            cache_key = None
+                            if dvm.CACHE_TTL > 0:
+                                cache_key = build_cache_key(task, job_event)
+                                cached = self.result_cache.get(cache_key)
+                                if cached is not None:
+                                    print("[" + self.dvm_config.NIP89.NAME + "] Answering " + task + " from cache")
+                                    count("cache_hits", self.dvm_config.NIP89.NAME, task)
+                                    send_nostr_reply_event(cached, job_event.as_json())
+                                    record_job(job_event, "finished")
+                                    continue
+
+                            def send_partial(text):
+                                send_job_status_reaction(job_event, "partial", content=text,
+                                                         dvm_config=self.dvm_config, task=task)
+
+                            timeout = dvm.TIMEOUT_SECONDS or self.dvm_config.JOB_TIMEOUT_SECONDS
+
+                            def process():
+                                if timeout <= 0:
+                                    # without a budget cancelling is cooperative, the job keeps its worker until
+                                    # process() returns
+                                    return run_process(dvm, job_event)
+                                # work that doesn't stop when the job is cancelled or times out is abandoned
+                                return run_abandonable(lambda: run_process(dvm, job_event),
+                                                       self.dvm_config.NIP89.NAME + "-process")
+
+                            unwatch = self.watchdog.watch(current_cancel_token(), timeout)
+                            try:
+                                with timed("process", self.dvm_config.NIP89.NAME, task), streaming(
+                                        send_partial, self.dvm_config.PARTIAL_RESULT_CHARS,
+                                        self.dvm_config.PARTIAL_RESULT_SECONDS):
+                                    if cache_key is not None:
+                                        # identical requests that are already being processed wait for that result
+                                        result = self.in_flight.do(cache_key, process)
+                                    else:
+                                        result = process()
+                            finally:
+                                unwatch()
+                            # the task might not have noticed the cancellation, the result is not sent anyway
+                            current_cancel_token().check()
                             if dvm_config.USE_OWN_VENV:
-                                python_location = "/bin/python"
-                                if platform == "win32":
-                                    python_location = "/Scripts/python"
-                                python_bin = (r'cache/venvs/' + os.path.basename(dvm_config.SCRIPT).split(".py")[0]
-                                              + python_location)
-                                retcode = subprocess.call([python_bin, dvm_config.SCRIPT,
-                                                           '--request', json.dumps(request_form),
-                                                           '--identifier', dvm_config.IDENTIFIER,
-                                                           '--output', 'output.txt'])
-                                print("Finished processing, loading data..")
-
-                                with open(os.path.abspath('output.txt')) as f:
-                                    resultall = f.readlines()
-                                    for line in resultall:
-                                        if line != '\n':
-                                            result += line
-                                os.remove(os.path.abspath('output.txt'))
-                                assert not result.startswith("Error:")
-                                print(result)
-
-                            else:  # Some components might have issues with running code in otuside venv.
-                                # We install locally in these cases for now
-                                result = dvm.process(request_form)
+                                assert not str(result).startswith("Error:")
                             try:
-                                post_processed = dvm.post_process(result, job_event)
+                                with timed("post_process", self.dvm_config.NIP89.NAME, task):
+                                    post_processed = dvm.post_process(result, job_event)
                                 send_nostr_reply_event(post_processed, job_event.as_json())
+                                record_job(job_event, "finished")
+                                count("jobs_finished", self.dvm_config.NIP89.NAME, task)
+                                if cache_key is not None:
+                                    self.result_cache.put(cache_key, post_processed, dvm.CACHE_TTL)
                             except Exception as e:
                                 print(e)
                                 send_job_status_reaction(job_event, "error", content=str(e),
                                                          dvm_config=self.dvm_config)
+                                record_job(job_event, "error")
+                                count("jobs_failed", self.dvm_config.NIP89.NAME, task)
                     except Exception as e:
+                        if isinstance(e, JobCancelled) or current_cancel_token().cancelled():
+                            job_cancelled(job_event, amount, started=True, task=task)
+                            return
                         print(e)
+                        record_job(job_event, "error")
+                        count("jobs_failed", self.dvm_config.NIP89.NAME, task)
                         # we could send the exception here to the user, but maybe that's not a good idea after all.
                         send_job_status_reaction(job_event, "error", content=result,
                                                  dvm_config=self.dvm_config)
                         # Zapping back the user on error
-                        if amount > 0 and self.dvm_config.LNBITS_ADMIN_KEY != "":
-                            user = get_or_add_user(self.dvm_config.DB, job_event.author().to_hex(),
-                                                   client=self.client, config=self.dvm_config)
-                            print(user.lud16 + " " + str(amount))
-                            bolt11 = zaprequest(user.lud16, amount, "Couldn't finish job, returning sats", job_event,
-                                                PublicKey.parse(user.npub),
-                                                self.keys, self.dvm_config.RELAY_LIST, zaptype="private")
-                            if bolt11 is None:
-                                print("Receiver has no Lightning address, can't zap back.")
-                                return
-                            try:
-                                payment_hash = pay_bolt11_ln_bits(bolt11, self.dvm_config)
-                            except Exception as e:
-                                print(e)
-
+                        zap_back(job_event, amount)
                         return
 
-        self.client.handle_notifications(NotificationHandler())
-        while True:
-
+        def run_job(job_event, amount):
+            token = self.job_registry.cancel_token(job_event)
+            try:
+                if token.cancelled():
+                    job_cancelled(job_event, amount, started=False)
+                    return
+                with job_span(job_id(job_event), "do_work"), cancel_scope(token):
+                    do_work(job_event, amount)
+            finally:
+                self.job_registry.discard_cancel_token(job_event)
+
+        def run_process(dvm, job_event):
+            request_form = dvm.create_request_from_nostr_event(job_event, self.client, self.dvm_config)
+
+            if dvm_config.USE_OWN_VENV and self.venv_workers is not None:
+                return self.venv_workers.process(request_form)
+
+            elif dvm_config.USE_OWN_VENV:
+                python_bin = venv_python(dvm_config.SCRIPT)
+                # jobs run in parallel, so every job gets its own output file
+                output_file = os.path.abspath('outputs/' + job_event.id().to_hex() + '.txt')
+                # partial results of streamed results are forwarded while the process runs
+                retcode = run_venv_process([python_bin, dvm_config.SCRIPT,
+                                            '--request', json.dumps(request_form),
+                                            '--identifier', dvm_config.IDENTIFIER,
+                                            '--output', output_file])
+                current_cancel_token().check()
+                print("Finished processing, loading data..")
+
+                result = ""
+                with open(output_file) as f:
+                    resultall = f.readlines()
+                    for line in resultall:
+                        if line != '\n':
+                            result += line
+                os.remove(output_file)
+                print(result)
+                return result
+
+            elif dvm_config.WORKER_MODE == "process":
+                return run_process_in_pool(dvm, request_form, dvm_config.IDENTIFIER, dvm_config.MAX_WORKERS)
+            else:  # Some components might have issues with running code in otuside venv.
+                # We install locally in these cases for now
+                return call_process(dvm, request_form)
+
+        def submit_work(job_event, amount, task=None, priority=PRIORITY_PAID):
+            # Hand the job over to the worker pool, so the notification handler stays responsive
+            if task is None:
+                task = get_task(job_event, client=self.client, dvm_config=self.dvm_config)
+            if self.dvm_config.JOB_CANCELLATION:
+                # the job can be cancelled from now on, run_job discards the token when it is done
+                self.job_registry.cancel_token(job_event)
+            if not self.executor.submit(task, run_job, job_event, amount, user=job_event.author().to_hex(),
+                                        priority=priority):
+                print("[" + self.dvm_config.NIP89.NAME + "] Job queue is full, rejecting job " +
+                      job_event.id().to_hex())
+                self.job_registry.discard_cancel_token(job_event)
+                reject_busy(job_event, amount)
+                return False
+            record_job(job_event, "queued", amount=amount, is_paid=True)
+            return True
+
+        def reject_busy(job_event, amount):
+            send_job_status_reaction(job_event, "busy", True, 0, client=self.client,
+                                     dvm_config=self.dvm_config)
+            record_job(job_event, "busy")
+            zap_back(job_event, amount)
+
+        def evict_work(queued_job):
+            # a job with a higher priority took the place of this one in the full queue
+            job_event, amount = queued_job.args
+            print("[" + self.dvm_config.NIP89.NAME + "] Job queue is full, evicting job " + job_event.id().to_hex())
+            self.job_registry.discard_cancel_token(job_event)
+            reject_busy(job_event, amount)
+
+        def record_job(job_event, status, **kwargs):
+            if self.job_store is not None:
+                self.job_store.record(job_event, status, **kwargs)
+
+        def resume_stored_jobs():
+            # Pick up jobs from the last run: paid work is queued again, open invoices are watched again
+            for stored in self.job_store.load_pending():
+                try:
+                    job_event = Event.from_json(stored.event)
+                    if stored.status == "paid" or stored.status == "queued":
+                        print("[" + self.dvm_config.NIP89.NAME + "] Resuming stored job " + stored.id)
+                        submit_work(job_event, stored.amount,
+                                    priority=PRIORITY_PAID if stored.amount > 0 else PRIORITY_FREE)
+                    elif stored.expires > Timestamp.now().as_secs():
+                        job = self.job_registry.add(
+                            JobToWatch(event=job_event, timestamp=job_event.created_at().as_secs(),
+                                       amount=stored.amount, is_paid=False, status=stored.status, result="",
+                                       is_processed=False, bolt11=stored.bolt11, payment_hash=stored.payment_hash,
+                                       expires=stored.expires))
+                        if self.invoice_poller is not None:
+                            self.invoice_poller.watch(job.payment_hash)
+                    else:
+                        record_job(job_event, "expired")
+                except Exception as e:
+                    print("[" + self.dvm_config.NIP89.NAME + "] Error resuming stored job: " + str(e))
+
+        def zap_back(job_event, amount):
+            if amount > 0 and self.dvm_config.LNBITS_ADMIN_KEY != "":
+                user = get_or_add_user(self.dvm_config.DB, job_event.author().to_hex(),
+                                       client=self.client, config=self.dvm_config)
+                print(user.lud16 + " " + str(amount))
+                bolt11 = zaprequest(user.lud16, amount, "Couldn't finish job, returning sats", job_event,
+                                    PublicKey.parse(user.npub),
+                                    self.keys, self.dvm_config.RELAY_LIST, zaptype="private")
+                if bolt11 is None:
+                    print("Receiver has no Lightning address, can't zap back.")
+                    return
+                try:
+                    payment_hash = pay_bolt11_ln_bits(bolt11, self.dvm_config)
+                except Exception as e:
+                    print(e)
+
+        def handle_invoice_settled(payment_hash, ispaid):
+            job = self.job_registry.get_by_payment_hash(payment_hash)
+            if job is None:
+                return
+            if ispaid and job.is_paid is False:
+                with job_span(job_id(job.event), "invoice_settled", payment_hash=payment_hash):
+                    print("is paid")
+                    self.job_registry.set_paid(job)
+                    amount = parse_amount_from_bolt11_invoice(job.bolt11)
+                    record_job(job.event, "paid", amount=amount, is_paid=True)
+
+                    send_job_status_reaction(job.event, "processing", True, 0,
+                                             client=self.client,
+                                             dvm_config=self.dvm_config)
+                    print("[" + self.dvm_config.NIP89.NAME + "] doing work from joblist")
+                    submit_work(job.event, amount, priority=PRIORITY_PAID)
+            elif ispaid is None:  # invoice expired
+                self.job_registry.remove(job.event)
+                record_job(job.event, "expired")
+
+        self.executor.on_evicted = evict_work
+        prices = [dvm.FIX_COST for dvm in self.dvm_config.SUPPORTED_DVMS if dvm.PER_UNIT_COST == 0]
+        self.invoice_provisioner = InvoiceProvisioner(self.dvm_config, prices,
+                                                      pool_size=self.dvm_config.INVOICE_POOL_SIZE,
+                                                      max_age=self.dvm_config.INVOICE_POOL_MAX_AGE)
+        if self.dvm_config.LNBITS_INVOICE_KEY != "" and self.dvm_config.LNBITS_URL:
+            # without the payment stream, polling is what starts paid jobs, so invoices are checked every few seconds
+            max_interval = self.dvm_config.LNBITS_POLL_MAX_INTERVAL
+            if self.dvm_config.LNBITS_PAYMENT_STREAM:
+                max_interval = self.dvm_config.LNBITS_STREAM_POLL_MAX_INTERVAL
+            self.invoice_poller = InvoiceSettlementPoller(self.dvm_config, handle_invoice_settled,
+                                                          concurrency=self.dvm_config.LNBITS_POLL_CONCURRENCY,
+                                                          max_interval=max_interval,
+                                                          use_stream=self.dvm_config.LNBITS_PAYMENT_STREAM,
+                                                          stream_url=self.dvm_config.LNBITS_PAYMENT_STREAM_URL)
+
+        if self.job_store is not None:
+            resume_stored_jobs()
+
+        def tick():
             for dvm in self.dvm_config.SUPPORTED_DVMS:
                 scheduled_result = dvm.schedule(self.dvm_config)
 
-            for job in self.job_list:
-                if job.bolt11 != "" and job.payment_hash != "" and not job.payment_hash is None and not job.is_paid:
-                    ispaid = check_bolt11_ln_bits_is_paid(job.payment_hash, self.dvm_config)
-                    if ispaid and job.is_paid is False:
-                        print("is paid")
-                        job.is_paid = True
-                        amount = parse_amount_from_bolt11_invoice(job.bolt11)
-
-                        job.is_paid = True
-                        send_job_status_reaction(job.event, "processing", True, 0,
-                                                 client=self.client,
-                                                 dvm_config=self.dvm_config)
-                        print("[" + self.dvm_config.NIP89.NAME + "] doing work from joblist")
-                        do_work(job.event, amount)
-                    elif ispaid is None:  # invoice expired
-                        self.job_list.remove(job)
-
-                if Timestamp.now().as_secs() > job.expires:
-                    self.job_list.remove(job)
-
-            for job in self.jobs_on_hold_list:
-                if check_event_has_not_unfinished_job_input(job.event, False, client=self.client,
-                                                            dvmconfig=self.dvm_config):
-                    handle_nip90_job_event(nip90_event=job.event)
-                    try:
-                        self.jobs_on_hold_list.remove(job)
-                    except:
-                        print("[" + self.dvm_config.NIP89.NAME + "] Error removing Job on Hold from List after expiry")
+            for job in self.job_registry.pop_expired(Timestamp.now().as_secs()):
+                if self.invoice_poller is not None:
+                    self.invoice_poller.unwatch(job.payment_hash)
+                if not job.is_paid:
+                    record_job(job.event, "expired")
+
+            # remove jobs to look for after 20 minutes..
+            expired_holds, abandoned_inputs = self.jobs_on_hold.pop_expired(Timestamp.now().as_secs() - 60 * 20)
+            for awaited in abandoned_inputs:
+                unsubscribe_job_input(awaited)
+
+            close_idle_relays(self.client)
+            self.invoice_provisioner.refill()
 
-                if Timestamp.now().as_secs() > job.timestamp + 60 * 20:  # remove jobs to look for after 20 minutes..
-                    self.jobs_on_hold_list.remove(job)
+        self.client.handle_notifications(NotificationHandler())
+        if self.dvm_config.ASYNC_RUNTIME:
+            # the shared runtime calls tick(), so this thread is done after the setup
+            get_runtime().call_every(1.0, tick)
+            return
 
+        while True:
+            tick()
             time.sleep(1.0)
+
+
+def venv_python(script):
+    python_location = "/bin/python"
+    if platform == "win32":
+        python_location = "/Scripts/python"
+    return r'cache/venvs/' + os.path.basename(script).split(".py")[0] + python_location
@@ -1,5 +1,6 @@
 import json
 import os
+import signal
 import subprocess
 import time
 from subprocess import run
@@ -10,10 +11,14 @@ from venv import create
 from nostr_sdk import Keys, Kind
 from nostr_dvm.dvm import DVM
 from nostr_dvm.utils.admin_utils import AdminConfig
+from nostr_dvm.utils.cancel_utils import CancelToken, cancel_scope
 from nostr_dvm.utils.dvmconfig import DVMConfig, build_default_config
 from nostr_dvm.utils.nip88_utils import NIP88Config
 from nostr_dvm.utils.nip89_utils import NIP89Config, check_and_set_d_tag
 from nostr_dvm.utils.output_utils import post_process_result
+from nostr_dvm.utils.runtime_utils import call_process
+from nostr_dvm.utils.stream_utils import partial_sink
+from nostr_dvm.utils.worker_utils import read_frame, write_frame, open_partials_pipe
 
 
 class DVMTaskInterface:
@@ -27,6 +32,9 @@ class DVMTaskInterface:
     DVM = DVM
     SUPPORTS_ENCRYPTION = True  # DVMs build with this framework support encryption, but others might not.
     ACCEPTS_CASHU = True  # DVMs build with this framework support encryption, but others might not.
+    CACHE_TTL = 0  # Seconds to answer identical requests from cache. Only set this if the result doesn't depend on the user
+    # Tasks with a CACHE_TTL also process identical requests that arrive at the same time only once
+    TIMEOUT_SECONDS = 0  # Wall-clock budget for process(), stuck jobs are abandoned and refunded. 0 = JOB_TIMEOUT_SECONDS
     dvm_config: DVMConfig
     admin_config: AdminConfig
     dependencies = []
@@ -116,7 +124,8 @@ class DVMTaskInterface:
         pass
 
     def process(self, request_form):
-        "Process the data and return the result"
+        """Process the data and return the result, can also be implemented as async def process. To stream the result,
+        return a generator that yields it in chunks, these are sent as partial results while the job runs"""
         pass
 
     def post_process(self, result, event):
@@ -139,6 +148,7 @@ class DVMTaskInterface:
         parser.add_argument('--request', dest='request')
         parser.add_argument('--identifier', dest='identifier')
         parser.add_argument('--output', dest='output')
+        parser.add_argument('--worker', dest='worker', action='store_true')
         args = parser.parse_args()
         return args
 
@@ -153,8 +163,58 @@ def process_venv(identifier):
     args = DVMTaskInterface.process_args()
     dvm_config = build_default_config(args.identifier)
     dvm = identifier(name="", dvm_config=dvm_config, nip89config=NIP89Config(), admin_config=None)
+    if args.worker:
+        process_venv_worker(dvm)
+        return
+    partials = open_partials_pipe()
+    sink = None if partials is None else lambda chunk: write_frame(partials, {"partial": chunk})
     try:
-        result = dvm.process(json.loads(args.request))
+        with partial_sink(sink):
+            result = call_process(dvm, json.loads(args.request))
         DVMTaskInterface.write_output(result, args.output)
     except Exception as e:
         DVMTaskInterface.write_output("Error: " + str(e), args.output)
+
+
+def process_venv_worker(dvm):
+    # stdout is our channel to the DVM, so everything the task prints goes to stderr instead
+    channel = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    requests = sys.stdin.buffer
+    running = {"token": None}
+
+    def interrupt(signum, frame):
+        # The DVM cancelled the job we are working on. The job learns about it through its cancel token, nothing is
+        # raised here, so a frame that is being written stays intact and we keep running for the next job.
+        token = running["token"]
+        if token is not None:
+            token.cancel("Job was cancelled")
+
+    signal.signal(signal.SIGINT, interrupt)
+    while True:
+        message = read_frame(requests)
+        if message is None:
+            break
+        token = CancelToken()
+        outcome = {}
+
+        def run_job(request, token=token, outcome=outcome):
+            # the job runs in its own thread, so the signal handler can run in this one while we wait
+            try:
+                with cancel_scope(token), partial_sink(lambda chunk: write_frame(channel, {"partial": chunk})):
+                    outcome["result"] = call_process(dvm, request)
+            except Exception as e:
+                outcome["error"] = "Error: " + str(e)
+
+        running["token"] = token
+        job = Thread(target=run_job, args=[message["request"]], daemon=True)
+        job.start()
+        job.join()
+        running["token"] = None
+        # only this thread writes the final frame, after the job's partial frames
+        if token.cancelled():
+            write_frame(channel, {"cancelled": True})
+        elif "error" in outcome:
+            write_frame(channel, {"error": outcome["error"]})
+        else:
+            write_frame(channel, {"result": outcome["result"]})
@@ -8,12 +8,14 @@ from datetime import timedelta
 from nostr_sdk import (Keys, Client, Timestamp, Filter, nip04_decrypt, HandleNotification, EventBuilder, PublicKey,
                        Options, Tag, Event, nip04_encrypt, NostrSigner, EventId, Nip19Event, nip44_decrypt, Kind)
 
+from nostr_dvm.utils.dedup_utils import SeenEvents
 from nostr_dvm.utils.database_utils import fetch_user_metadata
 from nostr_dvm.utils.definitions import EventDefinitions
 from nostr_dvm.utils.dvmconfig import DVMConfig
 from nostr_dvm.utils.nip88_utils import nip88_has_active_subscription
 from nostr_dvm.utils.nip89_utils import NIP89Config
 from nostr_dvm.utils.nostr_utils import send_event
+from nostr_dvm.utils.runtime_utils import get_runtime
 from nostr_dvm.utils.nwc_tools import nwc_zap
 from nostr_dvm.utils.subscription_utils import create_subscription_sql_table, add_to_subscription_sql_table, \
     get_from_subscription_sql_table, update_subscription_sql_table, get_all_subscriptions_from_sql_table, \
@@ -44,6 +46,8 @@ class Subscription:
         pk = self.keys.public_key()
 
         self.job_list = []
+        self.seen_events = SeenEvents(max_size=self.dvm_config.DEDUP_MAX_EVENTS,
+                                      window_seconds=self.dvm_config.DEDUP_WINDOW_SECONDS)
 
         print("Nostr Subscription Handler public key: " + str(pk.to_bech32()) + " Hex: " + str(
             pk.to_hex()) + "\n")
@@ -69,8 +73,13 @@ class Subscription:
             client = self.client
             dvm_config = self.dvm_config
             keys = self.keys
+            seen_events = self.seen_events
 
             def handle(self, relay_url, subscription_id, nostr_event: Event):
+                # the same event arrives from several relays, only handle it once
+                if self.seen_events.is_duplicate(nostr_event.id().to_hex()):
+                    return
+
                 if nostr_event.kind().as_u64() == 5906:  # TODO add to list of events
                     handle_nwc_request(nostr_event)
                 elif nostr_event.kind().as_u64() == EventDefinitions.KIND_NIP88_STOP_SUBSCRIPTION_EVENT.as_u64():
@@ -338,81 +347,87 @@ class Subscription:
             except Exception as e:
                 print("Error in Subscriber " + str(e))
 
-        self.client.handle_notifications(NotificationHandler())
+        def check_subscriptions():
+            subscriptions = get_all_subscriptions_from_sql_table(dvm_config.DB)
+
+            for subscription in subscriptions:
+                if subscription.active:
+                    if subscription.end < Timestamp.now().as_secs():
+                        # We could directly zap, but let's make another check if our subscription expired
+                        subscription_status = nip88_has_active_subscription(
+                            PublicKey.parse(subscription.subscriber),
+                            subscription.tier_dtag, self.client, subscription.recipent)
+
+                        if subscription_status["expires"]:
+                            update_subscription_sql_table(dvm_config.DB, subscription_status["subscriptionId"],
+                                                          subscription.recipent,
+                                                          subscription.subscriber, subscription.nwc,
+                                                          subscription.cadence, subscription.amount, subscription.unit,
+                                                          subscription.begin, subscription.end,
+                                                          subscription.tier_dtag, subscription.zaps,
+                                                          subscription.recipe,
+                                                          False,
+                                                          Timestamp.now().as_secs(), subscription.tier)
+                        else:
+                            zaps = json.loads(subscription.zaps)
+                            success = pay_zap_split(subscription.nwc, subscription.amount, zaps, subscription.tier, subscription.unit)
+                            if success:
+                                end = infer_subscription_end_time(Timestamp.now().as_secs(), subscription.cadence)
+                                recipe = make_subscription_zap_recipe(subscription.id, subscription.recipent,
+                                                                      subscription.subscriber, subscription.begin,
+                                                                      end, subscription.tier_dtag)
+                            else:
+                                end = Timestamp.now().as_secs()
+                                recipe = subscription.recipe
+
+                            update_subscription_sql_table(dvm_config.DB, subscription.id,
+                                                          subscription.recipent,
+                                                          subscription.subscriber, subscription.nwc,
+                                                          subscription.cadence, subscription.amount, subscription.unit,
+                                                          subscription.begin, end,
+                                                          subscription.tier_dtag, subscription.zaps, recipe,
+                                                          success,
+                                                          Timestamp.now().as_secs(), subscription.tier)
 
-        try:
-            while True:
-                time.sleep(60.0)
-                subscriptions = get_all_subscriptions_from_sql_table(dvm_config.DB)
+                            print("updated subscription entry")
 
-                for subscription in subscriptions:
-                    if subscription.active:
-                        if subscription.end < Timestamp.now().as_secs():
-                            # We could directly zap, but let's make another check if our subscription expired
-                            subscription_status = nip88_has_active_subscription(
-                                PublicKey.parse(subscription.subscriber),
-                                subscription.tier_dtag, self.client, subscription.recipent)
-
-                            if subscription_status["expires"]:
-                                update_subscription_sql_table(dvm_config.DB, subscription_status["subscriptionId"],
-                                                              subscription.recipent,
-                                                              subscription.subscriber, subscription.nwc,
-                                                              subscription.cadence, subscription.amount, subscription.unit,
-                                                              subscription.begin, subscription.end,
-                                                              subscription.tier_dtag, subscription.zaps,
-                                                              subscription.recipe,
-                                                              False,
-                                                              Timestamp.now().as_secs(), subscription.tier)
-                            else:
-                                zaps = json.loads(subscription.zaps)
-                                success = pay_zap_split(subscription.nwc, subscription.amount, zaps, subscription.tier, subscription.unit)
-                                if success:
-                                    end = infer_subscription_end_time(Timestamp.now().as_secs(), subscription.cadence)
-                                    recipe = make_subscription_zap_recipe(subscription.id, subscription.recipent,
-                                                                          subscription.subscriber, subscription.begin,
-                                                                          end, subscription.tier_dtag)
-                                else:
-                                    end = Timestamp.now().as_secs()
-                                    recipe = subscription.recipe
-
-                                update_subscription_sql_table(dvm_config.DB, subscription.id,
-                                                              subscription.recipent,
-                                                              subscription.subscriber, subscription.nwc,
-                                                              subscription.cadence, subscription.amount, subscription.unit,
-                                                              subscription.begin, end,
-                                                              subscription.tier_dtag, subscription.zaps, recipe,
-                                                              success,
-                                                              Timestamp.now().as_secs(), subscription.tier)
-
-                                print("updated subscription entry")
-
-
-                                keys = Keys.parse(dvm_config.PRIVATE_KEY)
-                                message = ("Renewed Subscription to DVM " + subscription.tier + ". Next renewal: " + str(
-                                    Timestamp.from_secs(end).to_human_datetime().replace("Z", " ").replace( "T", " ")))
-                                evt = EventBuilder.encrypted_direct_msg(keys, PublicKey.parse(subscription.subscriber), message,
-                                                                        None).to_event(keys)
-                                send_event(evt, client=self.client, dvm_config=dvm_config)
 
+                            keys = Keys.parse(dvm_config.PRIVATE_KEY)
+                            message = ("Renewed Subscription to DVM " + subscription.tier + ". Next renewal: " + str(
+                                Timestamp.from_secs(end).to_human_datetime().replace("Z", " ").replace( "T", " ")))
+                            evt = EventBuilder.encrypted_direct_msg(keys, PublicKey.parse(subscription.subscriber), message,
+                                                                    None).to_event(keys)
+                            send_event(evt, client=self.client, dvm_config=dvm_config)
 
 
-                    else:
-                        delete_threshold = 60 * 60 * 24 * 365
-                        if subscription.cadence == "daily":
-                            delete_threshold = 60 * 60 * 24 * 3  # After 3 days, delete the subscription, user can make a new one
-                        elif subscription.cadence == "weekly":
-                            delete_threshold = 60 * 60 * 24 * 21  # After 21 days, delete the subscription, user can make a new one
-                        elif subscription.cadence == "monthly":
-                            delete_threshold = 60 * 60 * 24 * 60  # After 60 days, delete the subscription, user can make a new one
-                        elif subscription.cadence == "yearly":
-                            delete_threshold = 60 * 60 * 24 * 500  # After 500 days, delete the subscription, user can make a new one
-
-                        if subscription.end < (Timestamp.now().as_secs() - delete_threshold):
-                            delete_from_subscription_sql_table(dvm_config.DB, subscription.id)
-                            print("Delete expired subscription")
-
-                print(str(Timestamp.now().as_secs()) + ": Checking " + str(
-                    len(subscriptions)) + " Subscription entries..")
+
+                else:
+                    delete_threshold = 60 * 60 * 24 * 365
+                    if subscription.cadence == "daily":
+                        delete_threshold = 60 * 60 * 24 * 3  # After 3 days, delete the subscription, user can make a new one
+                    elif subscription.cadence == "weekly":
+                        delete_threshold = 60 * 60 * 24 * 21  # After 21 days, delete the subscription, user can make a new one
+                    elif subscription.cadence == "monthly":
+                        delete_threshold = 60 * 60 * 24 * 60  # After 60 days, delete the subscription, user can make a new one
+                    elif subscription.cadence == "yearly":
+                        delete_threshold = 60 * 60 * 24 * 500  # After 500 days, delete the subscription, user can make a new one
+
+                    if subscription.end < (Timestamp.now().as_secs() - delete_threshold):
+                        delete_from_subscription_sql_table(dvm_config.DB, subscription.id)
+                        print("Delete expired subscription")
+
+            print(str(Timestamp.now().as_secs()) + ": Checking " + str(
+                len(subscriptions)) + " Subscription entries..")
+
+        self.client.handle_notifications(NotificationHandler())
+        if self.dvm_config.ASYNC_RUNTIME:
+            get_runtime().call_every(60.0, check_subscriptions)
+            return
+
+        try:
+            while True:
+                time.sleep(60.0)
+                check_subscriptions()
 
         except KeyboardInterrupt:
             print('Stay weird!')
@@ -25,6 +25,7 @@ class AdvancedSearchWine(DVMTaskInterface):
     KIND: Kind = EventDefinitions.KIND_NIP90_CONTENT_SEARCH
     TASK: str = "search-content"
     FIX_COST: float = 0
+    CACHE_TTL = 300
     dvm_config: DVMConfig
 
     def __init__(self, name, dvm_config: DVMConfig, nip89config: NIP89Config, nip88config: NIP88Config = None,
@@ -25,6 +25,7 @@ class DicoverContentCurrentlyPopular(DVMTaskInterface):
     KIND: Kind = EventDefinitions.KIND_NIP90_CONTENT_DISCOVERY
     TASK: str = "discover-content"
     FIX_COST: float = 0
+    CACHE_TTL = 60
     dvm_config: DVMConfig
     last_schedule: int
 
@@ -1,4 +1,5 @@
 import json
+from contextvars import copy_context
 from multiprocessing.pool import ThreadPool
 
 from nostr_sdk import Kind
@@ -178,7 +179,8 @@ class ImageGenerationSDXLIMG2IMG(DVMTaskInterface):
                 print("Job " + request_form['jobID'] + " sent to server")
 
             pool = ThreadPool(processes=1)
-            thread = pool.apply_async(check_server_status, (request_form['jobID'], self.options['server']))
+            thread = pool.apply_async(copy_context().run, (check_server_status, request_form['jobID'],
+                                                           self.options['server']))
             print("Wait for results of server...")
             result = thread.get()
             return result
@@ -24,6 +24,7 @@ class SearchUser(DVMTaskInterface):
     KIND: Kind = EventDefinitions.KIND_NIP90_USER_SEARCH
     TASK: str = "search-user"
     FIX_COST: float = 0
+    CACHE_TTL = 300
     dvm_config: DVMConfig
     last_schedule: int = 0
 
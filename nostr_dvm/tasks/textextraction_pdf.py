@@ -25,6 +25,7 @@ class TextExtractionPDF(DVMTaskInterface):
     KIND: Kind = EventDefinitions.KIND_NIP90_EXTRACT_TEXT
     TASK: str = "pdf-to-text"
     FIX_COST: float = 0
+    CACHE_TTL = 60 * 60 * 24
     dependencies = [("nostr-dvm", "nostr-dvm"),
                     ("pypdf", "pypdf==3.17.1")]
 
@@ -62,7 +62,8 @@ class TextGenerationLLMLite(DVMTaskInterface):
         options = {
             "prompt": prompt,
             "model": model,
-            "server": server
+            "server": server,
+            "stream": bool(self.options.get("stream", False))
         }
         request_form['options'] = json.dumps(options)
 
@@ -79,22 +80,35 @@ class TextGenerationLLMLite(DVMTaskInterface):
                     model=options["model"],
                     messages=[{"content": options["prompt"], "role": "user"}],
                     api_base=options["server"],
-                    stream=False
+                    stream=options.get("stream", False)
                 )
-                print(response.choices[0].message.content)
-                return response.choices[0].message.content
             else:
                 response = completion(
                     model=options["model"],
                     messages=[{"content": options["prompt"], "role": "user"}],
+                    stream=options.get("stream", False)
                 )
-                print(response.choices[0].message.content)
-                return response.choices[0].message.content
+            if options.get("stream", False):
+                # the DVM sends the tokens as partial results while they come in and the joined text as result
+                return self.stream_tokens(response)
+            print(response.choices[0].message.content)
+            return response.choices[0].message.content
 
         except Exception as e:
             print("Error in Module: " + str(e))
             raise Exception(e)
 
+    @staticmethod
+    def stream_tokens(response):
+        try:
+            for chunk in response:
+                token = chunk.choices[0].delta.content
+                if token is not None:
+                    yield token
+        except Exception as e:
+            print("Error in Module: " + str(e))
+            raise Exception(e)
+
 
 # We build an example here that we can call by either calling this file directly from the main directory,
 # or by adding it to our playground. You can call the example and adjust it to your needs or redefine it in the
@@ -103,7 +117,7 @@ def build_example(name, identifier, admin_config):
     dvm_config = build_default_config(identifier)
     admin_config.LUD16 = dvm_config.LN_ADDRESS
 
-    options = {'default_model': "ollama/llama2-uncensored", 'server': "http://localhost:11434"}
+    options = {'default_model': "ollama/llama2-uncensored", 'server': "http://localhost:11434", 'stream': True}
 
     nip89info = {
         "name": name,
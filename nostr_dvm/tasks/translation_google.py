@@ -24,6 +24,7 @@ class TranslationGoogle(DVMTaskInterface):
     KIND: Kind = EventDefinitions.KIND_NIP90_TRANSLATE_TEXT
     TASK: str = "translation"
     FIX_COST: float = 0
+    CACHE_TTL = 60 * 60 * 24
     dependencies = [("nostr-dvm", "nostr-dvm"),
                     ("translatepy", "translatepy==2.3")]
 
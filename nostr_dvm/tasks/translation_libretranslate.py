@@ -26,6 +26,7 @@ class TranslationLibre(DVMTaskInterface):
     KIND: Kind = EventDefinitions.KIND_NIP90_TRANSLATE_TEXT
     TASK: str = "translation"
     FIX_COST: float = 0
+    CACHE_TTL = 60 * 60 * 24
 
     def __init__(self, name, dvm_config: DVMConfig, nip89config: NIP89Config, nip88config: NIP88Config = None,
                  admin_config: AdminConfig = None, options=None):
@@ -2,11 +2,10 @@ import os
 import signal
 import time
 
-import requests
 from nostr_sdk import Event
 
 from nostr_dvm.utils.definitions import EventDefinitions
-from nostr_dvm.utils.mediasource_utils import check_source_type, media_source
+from nostr_dvm.utils.mediasource_utils import check_source_type, media_source, probe_content_type
 from nostr_dvm.utils.nostr_utils import get_event_by_id, get_referenced_event_by_id
 
 
@@ -158,8 +157,7 @@ def check_url_is_readable(url):
 
     if type == "url":
         # If link is comaptible with one of these file formats, move on.
-        req = requests.get(url)
-        content_type = req.headers['content-type']
+        content_type = probe_content_type(url)
         if content_type == 'audio/x-wav' or str(url).endswith(".wav") or content_type == 'audio/mpeg' or str(
                 url).endswith(
                 ".mp3") or content_type == 'audio/ogg' or str(url).endswith(".ogg"):
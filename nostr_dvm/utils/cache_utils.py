@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from sqlite3 import Error
+
+from nostr_dvm.utils.cancel_utils import JobCancelled, current_cancel_token
+
+"""
+Result cache for tasks that answer identical requests with identical results (search, discovery, translation..).
+Tasks opt in by setting CACHE_TTL on their DVMTaskInterface. Results are kept in a size bounded in-memory LRU and,
+optionally, in a SQLite file so they survive restarts.
+"""
+
+# Tags that change the result of a job. Everything else (relays, bid, encryption, alt..) is ignored for the key.
+CACHE_KEY_TAGS = ("i", "param", "output")
+
+
+def build_cache_key(task, event) -> str:
+    """Normalizes the job request: inputs keep their order, params are sorted, whitespace does not matter."""
+    inputs = []
+    params = []
+    output = ""
+    for tag in event.tags():
+        values = [str(value).strip() for value in tag.as_vec()]
+        if values[0] == "i":
+            inputs.append(values[1:3])
+        elif values[0] == "param":
+            params.append(values[1:])
+        elif values[0] == "output" and len(values) > 1:
+            output = values[1]
+    normalized = json.dumps([task, event.kind().as_u64(), inputs, sorted(params), output])
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, max_entries=1000, db=None):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.db = db
+        if self.db is not None:
+            try:
+                if not os.path.exists(r'db'):
+                    os.makedirs(r'db')
+                con = sqlite3.connect(self.db)
+                con.execute(""" CREATE TABLE IF NOT EXISTS results (
+                                                    key text PRIMARY KEY,
+                                                    result text NOT NULL,
+                                                    expires integer
+                                                ); """)
+                con.execute("DELETE FROM results WHERE expires < ?", (int(time.time()),))
+                con.commit()
+                con.close()
+            except Error as e:
+                print("Error creating result cache: " + str(e))
+                self.db = None
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                result, expires = entry
+                if expires > now:
+                    self.entries.move_to_end(key)
+                    return result
+                del self.entries[key]
+
+        result, expires = self._get_from_disk(key, now)
+        with self.lock:
+            if result is None:
+                return None
+            self._put_in_memory(key, result, expires)
+            return result
+
+    def put(self, key, result, ttl):
+        if ttl <= 0 or not isinstance(result, str):
+            return
+        expires = time.time() + ttl
+        with self.lock:
+            self._put_in_memory(key, result, expires)
+        if self.db is not None:
+            try:
+                con = sqlite3.connect(self.db)
+                con.execute("INSERT OR REPLACE INTO results VALUES(?, ?, ?)", (key, result, int(expires)))
+                con.commit()
+                con.close()
+            except Error as e:
+                print("Error writing to result cache: " + str(e))
+
+    def _put_in_memory(self, key, result, expires):
+        self.entries[key] = (result, expires)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _get_from_disk(self, key, now):
+        if self.db is None:
+            return None, 0
+        try:
+            con = sqlite3.connect(self.db)
+            cur = con.cursor()
+            cur.execute("SELECT result, expires FROM results WHERE key=? AND expires > ?", (key, int(now)))
+            row = cur.fetchone()
+            con.close()
+            if row is None:
+                return None, 0
+            return row[0], row[1]
+        except Error as e:
+            print("Error reading from result cache: " + str(e))
+            return None, 0
+
+
+class InFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Identical requests that arrive while one of them is processed wait for that result instead of running again.
+    The cancellation of a job belongs to its customer only: if the job that processes the request is cancelled or
+    times out, one of the waiting jobs takes over and processes it itself. A waiting job that is cancelled stops
+    waiting."""
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, function):
+        while True:
+            with self.lock:
+                call = self.calls.get(key)
+                leader = call is None
+                if leader:
+                    call = InFlightCall()
+                    self.calls[key] = call
+            if leader:
+                break
+
+            token = current_cancel_token()
+            while not call.done.wait(1.0):
+                token.check()
+            if isinstance(call.error, JobCancelled):
+                # the job we waited for was cancelled, not ours, the next waiting job runs it
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
@@ -0,0 +1,182 @@
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import CancelledError, Future, InvalidStateError
+from contextlib import contextmanager
+
+"""
+Cancellation of running jobs. Every job that is handed to the workers gets a CancelToken, the DVM cancels it when the
+customer deletes the request (kind 5). The token of the running job is available through a context variable, so
+process() and backend helpers can stop early with current_cancel_token().check() or wait with cancellable_sleep()
+instead of time.sleep(). Work that runs elsewhere (venv workers, subprocesses, coroutines on the shared runtime)
+registers a callback with on_cancel() that stops it. Outside of a job the current token is never cancelled.
+Jobs can also have a wall-clock budget, the Watchdog cancels the token of a job that runs longer. Work of such jobs
+that doesn't stop when it is cancelled is abandoned, run_abandonable() stops waiting for it, so it doesn't keep a worker
+slot.
+"""
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class CancelToken:
+    def __init__(self, owner=""):
+        self.owner = owner
+        self.reason = ""
+        self.timed_out = False
+        self.event = threading.Event()
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    def cancel(self, reason="", timed_out=False) -> bool:
+        """Cancels the token and calls the registered callbacks, returns False if it was cancelled already."""
+        with self.lock:
+            if self.event.is_set():
+                return False
+            self.reason = reason
+            self.timed_out = timed_out
+            self.event.set()
+            callbacks = self.callbacks
+            self.callbacks = []
+        for callback in callbacks:
+            _call(callback)
+        return True
+
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def check(self):
+        if self.event.is_set():
+            raise JobCancelled(self.reason or "Job was cancelled")
+
+    def wait(self, seconds) -> bool:
+        """Waits up to seconds, returns True as soon as the token is cancelled."""
+        return self.event.wait(seconds)
+
+    def on_cancel(self, callback):
+        """Calls callback() when the token is cancelled, right away if it is cancelled already. Returns a function
+        that removes the callback again."""
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return lambda: self._remove(callback)
+        _call(callback)
+        return lambda: None
+
+    def _remove(self, callback):
+        with self.lock:
+            if callback in self.callbacks:
+                self.callbacks.remove(callback)
+
+
+def _call(callback):
+    try:
+        callback()
+    except Exception as e:
+        print("Error cancelling job: " + str(e))
+
+
+_current_token = contextvars.ContextVar("cancel_token", default=None)
+
+
+@contextmanager
+def cancel_scope(token: CancelToken):
+    token_reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(token_reset)
+
+
+def current_cancel_token() -> CancelToken:
+    token = _current_token.get()
+    # outside of a job a fresh token is returned, nobody will ever cancel it
+    return token if token is not None else CancelToken()
+
+
+def cancellable_sleep(seconds):
+    """time.sleep() that raises JobCancelled as soon as the current job is cancelled."""
+    token = current_cancel_token()
+    token.wait(seconds)
+    token.check()
+
+
+def wait_cancellable(future):
+    """Waits for a concurrent future, e.g. of a coroutine on the shared runtime. The future is cancelled when the
+    current job is."""
+    token = current_cancel_token()
+    remove = token.on_cancel(future.cancel)
+    try:
+        return future.result()
+    except CancelledError:
+        raise JobCancelled(token.reason or "Job was cancelled")
+    finally:
+        remove()
+
+
+def run_abandonable(function, name="job"):
+    """Runs function in its own thread and waits for the result. If the current job is cancelled before function
+    returns, we stop waiting and raise JobCancelled; the thread is abandoned and finishes on its own (or never)."""
+    future = Future()
+    context = contextvars.copy_context()
+
+    def run():
+        try:
+            result = context.run(function)
+        except BaseException as e:
+            _resolve(future.set_exception, e)
+        else:
+            _resolve(future.set_result, result)
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+    return wait_cancellable(future)
+
+
+def _resolve(setter, value):
+    try:
+        setter(value)
+    except InvalidStateError:
+        # nobody waits for an abandoned job anymore
+        pass
+
+
+class Watchdog:
+    """Cancels the token of a job when its budget is used up. One thread watches all jobs of a DVM."""
+
+    def __init__(self, name=""):
+        self.name = name
+        self.deadlines = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        threading.Thread(target=self._run, name=name + "-watchdog", daemon=True).start()
+
+    def watch(self, token: CancelToken, seconds):
+        """Cancels token after seconds, returns a function that stops watching it. seconds <= 0 means no limit."""
+        if seconds is None or seconds <= 0:
+            return lambda: None
+        entry = [time.monotonic() + seconds, next(self.sequence), token, seconds]
+        with self.condition:
+            heapq.heappush(self.deadlines, entry)
+            self.condition.notify()
+
+        def unwatch():
+            # the entry is dropped lazily when its deadline comes
+            entry[2] = None
+        return unwatch
+
+    def _run(self):
+        while True:
+            with self.condition:
+                now = time.monotonic()
+                expired = []
+                while len(self.deadlines) > 0 and self.deadlines[0][0] <= now:
+                    expired.append(heapq.heappop(self.deadlines))
+                if len(expired) == 0:
+                    self.condition.wait(self.deadlines[0][0] - now if len(self.deadlines) > 0 else None)
+                    continue
+            for deadline, sequence, token, seconds in expired:
+                if token is not None:
+                    token.cancel("Job timed out after " + str(seconds) + " seconds", timed_out=True)
@@ -2,7 +2,7 @@ import base64
 import json
 import requests
 from nostr_dvm.utils.database_utils import get_or_add_user
-from nostr_dvm.utils.zap_utils import create_bolt11_ln_bits, create_bolt11_lud16
+from nostr_dvm.utils.zap_utils import create_bolt11_ln_bits, create_bolt11_lud16, REQUEST_TIMEOUT, PAYMENT_TIMEOUT
 
 
 async def get_cashu_balance(url):
@@ -132,9 +132,13 @@ def redeem_cashu(cashu, config, client, required_amount=0, update_self=False) ->
     json_object = {"pr": invoice}
     headers = {"Content-Type": "application/json; charset=utf-8"}
     request_body = json.dumps(json_object).encode('utf-8')
-    request = requests.post(url, data=request_body, headers=headers)
-    tree = json.loads(request.text)
-    fees = tree["fee"]
+    try:
+        request = requests.post(url, data=request_body, headers=headers, timeout=REQUEST_TIMEOUT)
+        tree = json.loads(request.text)
+        fees = tree["fee"]
+    except Exception as e:
+        print(e)
+        return False, "couldn't get fees from mint", 0, 0
     print("Fees on this mint are " + str(fees) + " Sats")
     redeem_invoice_amount = total_amount -fees
     if redeem_invoice_amount < required_amount:
@@ -158,7 +162,8 @@ def redeem_cashu(cashu, config, client, required_amount=0, update_self=False) ->
         json_object = {"proofs": proofs, "pr": invoice}
         headers = {"Content-Type": "application/json; charset=utf-8"}
         request_body = json.dumps(json_object).encode('utf-8')
-        request = requests.post(url, data=request_body, headers=headers)
+        # the mint pays our invoice before it answers
+        request = requests.post(url, data=request_body, headers=headers, timeout=PAYMENT_TIMEOUT)
         tree = json.loads(request.text)
         print(request.text)
         is_paid = tree["paid"] if tree.get("paid") else False
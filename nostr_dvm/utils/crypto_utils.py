@@ -0,0 +1,70 @@
+import base64
+import os
+import threading
+from collections import OrderedDict
+
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad, unpad
+from nostr_sdk import Keys, PublicKey, generate_shared_key
+
+"""
+NIP-04 encryption with cached keys. nip04_encrypt/nip04_decrypt derive the shared secret (ECDH) on every call, and the
+DVM parsed its private key again for every encrypted request, reaction and result. A CryptoContext holds the parsed
+keys of a DVM and the shared secrets with the pubkeys it talked to recently, so an encrypted job needs one ECDH for
+the request, its reactions and its result, and none at all for a repeat customer. The AES part is done with
+pycryptodome, the output is the same NIP-04 format (base64 ciphertext ?iv= base64 iv).
+"""
+
+_contexts = {}
+_contexts_lock = threading.Lock()
+
+
+class CryptoContext:
+    def __init__(self, private_key, max_secrets=1000):
+        self.keys = Keys.parse(private_key)
+        self.secret_key = self.keys.secret_key()
+        self.public_key = self.keys.public_key()
+        self.max_secrets = max_secrets
+        self.secrets = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def shared_secret(self, public_key: PublicKey) -> bytes:
+        pubkey = public_key.to_hex()
+        with self.lock:
+            secret = self.secrets.get(pubkey)
+            if secret is not None:
+                self.secrets.move_to_end(pubkey)
+                self.hits += 1
+                return secret
+        secret = bytes(generate_shared_key(self.secret_key, public_key))
+        with self.lock:
+            self.misses += 1
+            self.secrets[pubkey] = secret
+            while len(self.secrets) > self.max_secrets:
+                self.secrets.popitem(last=False)
+        return secret
+
+    def encrypt(self, public_key: PublicKey, content: str) -> str:
+        iv = os.urandom(16)
+        cipher = AES.new(self.shared_secret(public_key), AES.MODE_CBC, iv)
+        encrypted = cipher.encrypt(pad(content.encode("utf-8"), AES.block_size))
+        return base64.b64encode(encrypted).decode("ascii") + "?iv=" + base64.b64encode(iv).decode("ascii")
+
+    def decrypt(self, public_key: PublicKey, content: str) -> str:
+        encrypted, _, iv = content.partition("?iv=")
+        if iv == "":
+            raise ValueError("Invalid NIP-04 content, iv is missing")
+        cipher = AES.new(self.shared_secret(public_key), AES.MODE_CBC, base64.b64decode(iv))
+        return unpad(cipher.decrypt(base64.b64decode(encrypted)), AES.block_size).decode("utf-8")
+
+
+def get_crypto_context(private_key) -> CryptoContext:
+    """Returns the crypto context for a private key, it is created once per key and process."""
+    with _contexts_lock:
+        context = _contexts.get(private_key)
+        if context is None:
+            context = CryptoContext(private_key)
+            _contexts[private_key] = context
+        return context
@@ -0,0 +1,30 @@
+import threading
+import time
+from collections import OrderedDict
+
+"""
+We subscribe to the same filters on all relays of the relay list, so the same job request or zap usually arrives
+several times. SeenEvents remembers the ids of events we already handled for a limited time window (and up to a
+maximum number of ids), so duplicates can be dropped before any decryption, database or network work is done.
+"""
+
+
+class SeenEvents:
+    def __init__(self, max_size=10000, window_seconds=600):
+        self.max_size = max_size
+        self.window_seconds = window_seconds
+        self.seen = OrderedDict()
+        self.lock = threading.Lock()
+
+    def is_duplicate(self, event_id: str) -> bool:
+        """Returns True if the event id was seen within the window, otherwise remembers it and returns False."""
+        now = time.monotonic()
+        with self.lock:
+            # ids are stored in the order they were first seen, so the oldest ones are always in front
+            while len(self.seen) > 0 and (len(self.seen) >= self.max_size or
+                                          next(iter(self.seen.values())) < now - self.window_seconds):
+                self.seen.popitem(last=False)
+            if event_id in self.seen:
+                return True
+            self.seen[event_id] = now
+            return False
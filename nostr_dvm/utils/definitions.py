@@ -1,5 +1,5 @@
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 from nostr_sdk import Event, Kind
 
@@ -7,6 +7,7 @@ from nostr_sdk import Event, Kind
 class EventDefinitions:
     KIND_NOTE = Kind(1)
     KIND_DM = Kind(4)
+    KIND_DELETE = Kind(5)
     KIND_REACTION = Kind(7)
     KIND_ZAP = Kind(9735)
     KIND_ANNOUNCEMENT = Kind(31990)
@@ -76,3 +77,4 @@ class JobToWatch:
 class RequiredJobToWatch:
     event: Event
     timestamp: int
+    awaiting: set = field(default_factory=set)
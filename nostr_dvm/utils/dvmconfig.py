@@ -22,21 +22,62 @@ class DVMConfig:
                   "wss://relay.snort.social", "wss://offchain.pub/"]
 
     RELAY_TIMEOUT = 5
+    EXTRA_RELAY_MAX = 20  # Connections kept to relays outside the relay list that customers asked for in requests
+    EXTRA_RELAY_IDLE_SECONDS = 300  # Such a relay is disconnected when it wasn't used for this long
     EXTERNAL_POST_PROCESS_TYPE = PostProcessFunctionType.NONE  # Leave this on None, except the DVM is external
     LNBITS_INVOICE_KEY = ''  # Will all automatically generated by default, or read from .env
     LNBITS_ADMIN_KEY = ''  # In order to pay invoices, e.g. from the bot to DVMs, or reimburse users.
     LNBITS_URL = 'https://lnbits.com'
     LN_ADDRESS = ''
+    LNBITS_POLL_CONCURRENCY = 8  # Parallel invoice status requests to LNbits
+    LNBITS_POLL_MAX_INTERVAL = 2  # Unpaid invoices are checked less often over time, up to this many seconds
+    LNBITS_PAYMENT_STREAM = False  # Listen to the LNbits payment stream to start paid jobs right away
+    LNBITS_STREAM_POLL_MAX_INTERVAL = 30  # Replaces LNBITS_POLL_MAX_INTERVAL with the stream, polling is only the fallback
+    LNBITS_PAYMENT_STREAM_URL = ''  # Defaults to LNBITS_URL + /api/v1/payments/sse
+    INVOICE_POOL_SIZE = 0  # Unused invoices kept ready for each fixed price, so payment requests don't wait (0 = off)
+    INVOICE_POOL_MAX_AGE = 600  # Pooled invoices older than this are not handed out anymore
     SCRIPT = ''
     IDENTIFIER = ''
     USE_OWN_VENV = True  # Make an own venv for each dvm's process function.Disable if you want to install packages into main venv. Only recommended if you dont want to run dvms with different dependency versions
+    VENV_WORKERS = 0  # Long running worker processes per venv that keep the task loaded (0 = a new process per job).
+    # Needs the venv to run a nostr-dvm version that knows --worker, recreate venvs made with older versions
     DB: str
     NEW_USER_BALANCE: int = 0  # Free credits for new users
     NIP88: NIP88Config
     NIP89: NIP89Config
     SEND_FEEDBACK_EVENTS = True
+    FEEDBACK_COALESCE_SECONDS = 0.25  # Progress updates of a job within this window are merged, only the last is sent (0 = off)
+    FEEDBACK_MIN_INTERVAL = 1.0  # Seconds between two progress updates of the same job
+    PARTIAL_RESULT_CHARS = 200  # Streamed results are sent as partial feedback once this many characters came in..
+    PARTIAL_RESULT_SECONDS = 1.0  # ..or this many seconds passed since the last partial feedback
     SHOW_RESULT_BEFORE_PAYMENT: bool = False  # if this is true show results even when not paid right after autoprocess
     SCHEDULE_UPDATES_SECONDS = 0
+    DEDUP_MAX_EVENTS = 10000  # Remember this many event ids to drop events we receive from more than one relay
+    DEDUP_WINDOW_SECONDS = 600  # How long we remember an event id
+    MAX_WORKERS = 4  # Number of jobs a DVM processes in parallel
+    MAX_QUEUED_JOBS = 50  # Jobs waiting for a free worker. If the queue is full, new jobs get a busy reaction
+    TASK_CONCURRENCY_LIMITS = {}  # Optional max parallel jobs per task, e.g. {"text-to-image": 1}
+    RATE_LIMIT_PER_USER = 0  # Requests per second a pubkey can send on average, e.g. 0.2 (0 = no limit).
+    # Bots forward the jobs of all their users with their own key, so they share one bucket
+    RATE_LIMIT_USER_BURST = 5  # Requests a pubkey can send at once
+    RATE_LIMIT_GLOBAL = 0  # Requests per second for all users together (0 = no limit)
+    RATE_LIMIT_GLOBAL_BURST = 50
+    USER_WEIGHTS = {}  # Optional share of the workers per user (hex pubkey), users not listed have weight 1
+    RESULT_CACHE_SIZE = 1000  # Results kept in memory for tasks that define a CACHE_TTL
+    RESULT_CACHE_ON_DISK = False  # Also keep cached results in db/<name>_cache.db, so they survive a restart
+    JOB_STORE = False  # Keep jobs and issued invoices in db/<name>_jobs.db, so they are resumed after a restart
+    JOB_CANCELLATION = True  # Stop queued and running jobs when the customer deletes the request (kind 5)
+    JOB_TIMEOUT_SECONDS = 0  # Default budget for processing a job, tasks can set their own TIMEOUT_SECONDS (0 = none)
+    WORKER_MODE = "thread"  # "thread" or "process". In process mode process() runs in a process pool (if not USE_OWN_VENV)
+    METRICS_PORT = 0  # Serve Prometheus metrics on http://127.0.0.1:<port>/metrics (0 = off)
+    METRICS_LOG_SECONDS = 0  # Print a summary of the metrics every x seconds (0 = off)
+    TRACE_SAMPLE_RATE = 0.0  # Share of jobs that are traced (0.0 - 1.0)
+    TRACE_FILE = ""  # File the traces are appended to as OTLP json, e.g. "traces/traces.jsonl"
+    TRACE_COLLECTOR_URL = ""  # OTLP http collector, e.g. "http://localhost:4318/v1/traces"
+    SHARED_RELAY_HUB = False  # Share one relay connection per relay with all DVMs/Bots in this process that enable it
+    ASYNC_RUNTIME = False  # Run the tick of DVMs/Bots on one shared event loop instead of a sleeping thread each
+    # Only the tick moves to the loop and it still makes blocking calls, relay, http and database access are not async.
+    # Job workers, watchdog, feedback sender, invoice poller and job store writer keep their threads per DVM
 
 
 def build_default_config(identifier):
@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+"""
+Outgoing job feedback (kind 7000). A job can go through several informational statuses in a row, e.g. a NIP-88 job
+sends up to four subscription-required updates while the subscription is checked. Such updates are held back for a
+short window, and a newer one replaces a queued one of the same job, so only the latest is signed and sent. Per job at
+most one informational update is sent every min_interval seconds. Statuses the customer has to act on or that end a
+job (payment-required, error, success, partial results..) are never dropped or delayed, updates queued before them are
+sent along so the order is kept. Events are signed when they are sent, updates that are replaced are never signed.
+"""
+
+# Statuses that only inform about progress and can be replaced by a later status of the same job
+COALESCABLE_STATUSES = {"processing", "subscription-required", "chain-scheduled"}
+
+
+@dataclass
+class PendingFeedback:
+    job_id: str
+    status: str
+    deliver: object
+    due: float
+    replaceable: bool
+
+
+class FeedbackPublisher:
+    def __init__(self, name="", window=0.25, min_interval=1.0, max_jobs=10000):
+        """window 0 sends every update right away, like before."""
+        self.name = name
+        self.window = window
+        self.min_interval = min_interval
+        self.max_jobs = max_jobs
+        self.pending = {}
+        self.last_sent = OrderedDict()
+        self.condition = threading.Condition()
+        # jobs of the updates the sender thread is delivering right now
+        self.delivering = set()
+        if self.window > 0:
+            threading.Thread(target=self._run, name=name + "-feedback", daemon=True).start()
+
+    def publish(self, job_id, status, deliver, has_invoice=False):
+        """Queues a status update of a job. deliver() signs and sends the event, it is called from the sender thread.
+        Updates with an invoice are never replaced, whatever their status."""
+        if self.window <= 0:
+            self._deliver(deliver)
+            return
+        now = time.monotonic()
+        with self.condition:
+            queue = self.pending.setdefault(job_id, [])
+            if status in COALESCABLE_STATUSES and not has_invoice:
+                if len(queue) > 0 and queue[-1].replaceable:
+                    queue[-1].status = status
+                    queue[-1].deliver = deliver
+                else:
+                    due = max(now + self.window, self.last_sent.get(job_id, 0.0) + self.min_interval)
+                    queue.append(PendingFeedback(job_id, status, deliver, due, True))
+            else:
+                for item in queue:
+                    item.due = now
+                queue.append(PendingFeedback(job_id, status, deliver, now, False))
+            self.condition.notify_all()
+
+    def drop_pending(self, job_id):
+        """Drops queued informational updates of a job, e.g. because its result is sent now."""
+        with self.condition:
+            queue = self.pending.get(job_id)
+            if queue is None:
+                return
+            kept = [item for item in queue if not item.replaceable]
+            if len(kept) > 0:
+                self.pending[job_id] = kept
+            else:
+                del self.pending[job_id]
+
+    def flush(self, job_id):
+        """Drops queued informational updates of a job and sends the rest right away, in this thread. Called before the
+        result of the job is sent, so no feedback of the job arrives after it."""
+        self.drop_pending(job_id)
+        with self.condition:
+            # updates of the job the sender thread took already are sent before ours
+            self.condition.wait_for(lambda: job_id not in self.delivering)
+            queue = self.pending.pop(job_id, [])
+            if len(queue) > 0:
+                self.last_sent[job_id] = time.monotonic()
+                self.last_sent.move_to_end(job_id)
+        for item in queue:
+            self._deliver(item.deliver)
+
+    def _due(self, now):
+        batch = []
+        next_due = None
+        for job_id in list(self.pending):
+            queue = self.pending[job_id]
+            while len(queue) > 0 and queue[0].due <= now:
+                batch.append(queue.pop(0))
+            if len(queue) > 0:
+                next_due = queue[0].due if next_due is None else min(next_due, queue[0].due)
+            else:
+                del self.pending[job_id]
+        return batch, next_due
+
+    def _run(self):
+        while True:
+            with self.condition:
+                now = time.monotonic()
+                batch, next_due = self._due(now)
+                if len(batch) == 0:
+                    self.condition.wait(None if next_due is None else next_due - now)
+                    continue
+                for item in batch:
+                    self.last_sent[item.job_id] = now
+                    self.last_sent.move_to_end(item.job_id)
+                while len(self.last_sent) > self.max_jobs:
+                    self.last_sent.popitem(last=False)
+                self.delivering = {item.job_id for item in batch}
+            # everything that is due is sent in one go, the lock is not held while we talk to relays
+            for item in batch:
+                self._deliver(item.deliver)
+            with self.condition:
+                self.delivering = set()
+                self.condition.notify_all()
+
+    def _deliver(self, deliver):
+        try:
+            deliver()
+        except Exception as e:
+            print("[" + self.name + "] Error sending feedback: " + str(e))
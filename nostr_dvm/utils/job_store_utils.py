@@ -0,0 +1,110 @@
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from sqlite3 import Error
+
+"""
+Optional durable job store. Job lifecycle transitions (invoice issued, paid, queued, finished..) are written to a
+SQLite database in WAL mode, so a DVM can resume paid but unprocessed jobs and still watch issued invoices after a
+restart. Writes are collected and flushed in bulk by a background thread, so the hot path never waits for disk.
+"""
+
+# Jobs in these states are picked up again when the DVM starts
+RESUMABLE_STATES = ("payment-required", "paid", "queued")
+FINISHED_STATES = ("finished", "error", "expired", "busy", "cancelled", "timeout")
+
+
+@dataclass
+class StoredJob:
+    id: str
+    event: str
+    status: str
+    amount: int
+    is_paid: bool
+    bolt11: str
+    payment_hash: str
+    expires: int
+    lastupdate: int
+
+
+class JobStore:
+    def __init__(self, db, flush_interval=0.5, keep_finished_seconds=60 * 60 * 24):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.lock = threading.Lock()
+
+        if not os.path.exists(r'db'):
+            os.makedirs(r'db')
+        con = sqlite3.connect(db)
+        try:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute(""" CREATE TABLE IF NOT EXISTS jobs (
+                                                id text PRIMARY KEY,
+                                                event text NOT NULL,
+                                                status text,
+                                                amount integer,
+                                                is_paid boolean,
+                                                bolt11 text,
+                                                payment_hash text,
+                                                expires integer,
+                                                lastupdate integer
+                                            ); """)
+            con.execute("DELETE FROM jobs WHERE status IN (" + ",".join("?" * len(FINISHED_STATES)) +
+                        ") AND lastupdate < ?", FINISHED_STATES + (int(time.time()) - keep_finished_seconds,))
+            con.commit()
+        except Error as e:
+            print("Error creating job store: " + str(e))
+        finally:
+            con.close()
+
+        threading.Thread(target=self._writer, daemon=True).start()
+
+    def record(self, event, status, amount=None, is_paid=None, bolt11=None, payment_hash=None, expires=None):
+        """Queue a state transition of a job, it is written with the next batch."""
+        row = (event.id().to_hex(), event.as_json(), status, amount, is_paid, bolt11, payment_hash, expires,
+               int(time.time()))
+        with self.lock:
+            self.pending.append(row)
+
+    def load_pending(self) -> list:
+        try:
+            con = sqlite3.connect(self.db)
+            cur = con.cursor()
+            cur.execute("SELECT * FROM jobs WHERE status IN (" + ",".join("?" * len(RESUMABLE_STATES)) +
+                        ") ORDER BY lastupdate", RESUMABLE_STATES)
+            rows = cur.fetchall()
+            con.close()
+            return [StoredJob(id=row[0], event=row[1], status=row[2], amount=int(row[3] or 0),
+                              is_paid=bool(row[4]), bolt11=row[5] or "", payment_hash=row[6] or "",
+                              expires=int(row[7] or 0), lastupdate=int(row[8] or 0)) for row in rows]
+        except Error as e:
+            print("Error loading jobs from store: " + str(e))
+            return []
+
+    def _writer(self):
+        con = sqlite3.connect(self.db)
+        con.execute("PRAGMA synchronous=NORMAL")
+        while True:
+            time.sleep(self.flush_interval)
+            with self.lock:
+                batch = self.pending
+                self.pending = []
+            if len(batch) == 0:
+                continue
+            try:
+                # Optional values that are not given keep what we stored before
+                con.executemany(""" INSERT INTO jobs VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                    ON CONFLICT(id) DO UPDATE SET
+                                        status = excluded.status,
+                                        amount = COALESCE(excluded.amount, amount),
+                                        is_paid = COALESCE(excluded.is_paid, is_paid),
+                                        bolt11 = COALESCE(excluded.bolt11, bolt11),
+                                        payment_hash = COALESCE(excluded.payment_hash, payment_hash),
+                                        expires = COALESCE(excluded.expires, expires),
+                                        lastupdate = excluded.lastupdate""", batch)
+                con.commit()
+            except Error as e:
+                print("Error writing jobs to store: " + str(e))
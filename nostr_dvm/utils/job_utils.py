@@ -0,0 +1,179 @@
+import heapq
+import threading
+
+from nostr_dvm.utils.cancel_utils import CancelToken
+from nostr_dvm.utils.definitions import JobToWatch, RequiredJobToWatch
+
+"""
+Registry for the jobs a DVM is watching. Jobs are indexed by their event id, unpaid jobs with an invoice are
+additionally indexed by payment hash, and a min-heap on the expiry time lets us evict old jobs without scanning all
+of them. Jobs that are queued or running have a cancel token, so they can be stopped when the customer deletes the
+request. The registry is shared between the notification handler, the worker threads and the main loop, so all
+access goes through a lock.
+"""
+
+
+def job_id(event) -> str:
+    return event.id().to_hex()
+
+
+class JobRegistry:
+    def __init__(self):
+        self.jobs = {}
+        self.unpaid = {}
+        self.expiry_heap = []
+        self.cancel_tokens = {}
+        self.lock = threading.RLock()
+
+    def __contains__(self, event):
+        with self.lock:
+            return job_id(event) in self.jobs
+
+    def add(self, job: JobToWatch) -> JobToWatch:
+        """Adds a job if there is none for the event yet and returns the registered job."""
+        with self.lock:
+            key = job_id(job.event)
+            if key in self.jobs:
+                return self.jobs[key]
+            self.jobs[key] = job
+            heapq.heappush(self.expiry_heap, (job.expires, key))
+            self._index_payment(job)
+            return job
+
+    def get(self, event) -> JobToWatch | None:
+        with self.lock:
+            return self.jobs.get(job_id(event))
+
+    def set_invoice(self, job: JobToWatch, bolt11, payment_hash) -> bool:
+        """Sets the invoice of a job that has none yet. Returns True if the job now waits for this invoice to be
+        paid."""
+        with self.lock:
+            if job.bolt11 or not bolt11:
+                return False
+            job.bolt11 = bolt11
+            job.payment_hash = payment_hash
+            self._index_payment(job)
+            return payment_hash != "" and self.unpaid.get(payment_hash) is job
+
+    def get_by_payment_hash(self, payment_hash) -> JobToWatch | None:
+        with self.lock:
+            return self.unpaid.get(payment_hash)
+
+    def remove(self, event) -> JobToWatch | None:
+        with self.lock:
+            job = self.jobs.pop(job_id(event), None)
+            if job is not None and job.payment_hash:
+                self.unpaid.pop(job.payment_hash, None)
+            return job
+
+    def set_paid(self, job: JobToWatch):
+        with self.lock:
+            job.is_paid = True
+            if job.payment_hash:
+                self.unpaid.pop(job.payment_hash, None)
+
+    def pop_expired(self, now) -> list:
+        """Removes and returns all jobs that expired before now."""
+        expired = []
+        with self.lock:
+            while self.expiry_heap and self.expiry_heap[0][0] < now:
+                expires, key = heapq.heappop(self.expiry_heap)
+                job = self.jobs.get(key)
+                # entries of jobs that were removed in the meantime are dropped lazily here
+                if job is not None and job.expires == expires:
+                    self.remove(job.event)
+                    expired.append(job)
+        return expired
+
+    def cancel_token(self, event) -> CancelToken:
+        """Cancel token of a queued or running job, created on first use."""
+        with self.lock:
+            key = job_id(event)
+            token = self.cancel_tokens.get(key)
+            if token is None:
+                token = CancelToken(owner=event.author().to_hex())
+                self.cancel_tokens[key] = token
+            return token
+
+    def discard_cancel_token(self, event):
+        with self.lock:
+            self.cancel_tokens.pop(job_id(event), None)
+
+    def cancel(self, event_id, author, reason="") -> tuple:
+        """Cancels the job with the given event id if author is the one who requested it. A queued or running job is
+        cancelled through its token, a job that waits for payment is removed. Returns the token and the removed job,
+        None for what there was not."""
+        with self.lock:
+            token = self.cancel_tokens.get(event_id)
+            if token is not None and token.owner != author:
+                token = None
+            job = self.jobs.get(event_id)
+            if job is not None and (job.is_paid or job.event.author().to_hex() != author):
+                job = None
+            if job is not None:
+                self.remove(job.event)
+        if token is not None and not token.cancel(reason):
+            token = None
+        return token, job
+
+    def _index_payment(self, job):
+        if job.payment_hash and not job.is_paid and job.bolt11:
+            self.unpaid[job.payment_hash] = job
+
+
+class HeldJobs:
+    """
+    Chained jobs that are on hold until the jobs they take as input have a result. Held jobs are indexed by the job
+    ids they are waiting for, so an incoming result releases its dependent jobs without looking at any other job.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self.waiting_for = {}
+        self.lock = threading.Lock()
+
+    def hold(self, job: RequiredJobToWatch) -> list:
+        """Puts a job on hold and returns the awaited job ids nobody was waiting for before."""
+        new_awaited = []
+        with self.lock:
+            key = job_id(job.event)
+            if key in self.jobs:
+                return new_awaited
+            self.jobs[key] = job
+            for awaited in job.awaiting:
+                if awaited not in self.waiting_for:
+                    self.waiting_for[awaited] = set()
+                    new_awaited.append(awaited)
+                self.waiting_for[awaited].add(key)
+        return new_awaited
+
+    def release(self, awaited) -> list:
+        """Marks the awaited job as finished and returns the held jobs that have all their inputs now."""
+        ready = []
+        with self.lock:
+            for key in self.waiting_for.pop(awaited, set()):
+                job = self.jobs.get(key)
+                if job is None:
+                    continue
+                job.awaiting.discard(awaited)
+                if len(job.awaiting) == 0:
+                    ready.append(self.jobs.pop(key))
+        return ready
+
+    def pop_expired(self, before) -> tuple:
+        """Removes jobs held since before, returns them and the job ids nobody is waiting for anymore."""
+        expired = []
+        abandoned = []
+        with self.lock:
+            for key, job in list(self.jobs.items()):
+                if job.timestamp < before:
+                    expired.append(self.jobs.pop(key))
+                    for awaited in job.awaiting:
+                        waiting = self.waiting_for.get(awaited)
+                        if waiting is None:
+                            continue
+                        waiting.discard(key)
+                        if len(waiting) == 0:
+                            del self.waiting_for[awaited]
+                            abandoned.append(awaited)
+        return expired, abandoned
@@ -1,6 +1,9 @@
 import os
+import tempfile
+import threading
 import urllib
 from datetime import time
+from time import monotonic
 from urllib.parse import urlparse
 import ffmpegio
 from decord import AudioReader, cpu
@@ -98,8 +101,7 @@ def organize_input_media_data(input_value, input_type, start, end, dvm_config, c
         # for now, we cut and convert all files to mp3
         if process:
             # for now we cut and convert all files to mp3
-            file = r'processed.' + str(media_format.split('/')[1])
-            final_filename = os.path.abspath(os.curdir + r'/outputs/' + file)
+            final_filename = job_file("processed", str(media_format.split('/')[1]))
             if media_format.split('/')[0] == "audio":
                 print("Converting Audio from " + str(start_time) + " until " + str(end_time))
                 fs, x = ffmpegio.audio.read(filename, ss=start_time, to=end_time, sample_fmt='dbl', ac=1)
@@ -113,6 +115,9 @@ def organize_input_media_data(input_value, input_type, start, end, dvm_config, c
                 videoClip = VideoFileClip(filename)
                 videoClip.write_gif(final_filename, program="ffmpeg")
             print(final_filename)
+            if source_type == "url":
+                # the download is only needed for the conversion
+                os.remove(filename)
             return final_filename
         else:
             return filename
@@ -291,52 +296,92 @@ def get_youtube(input_value, start, end, audioonly=True):
     return filename, start, end
 
 
+# Content types of urls we looked at, so routing a job (get_task), checking its input and downloading it later only
+# asks the server once. Values are (content_type, expires).
+CONTENT_TYPE_TTL = 60 * 10
+CONTENT_TYPE_CACHE_SIZE = 1000
+_content_types = {}
+_content_types_lock = threading.Lock()
+
+
+def probe_content_type(url, timeout=10) -> str:
+    """Returns the content type of a url without downloading it, or "" if the server doesn't tell us."""
+    now = monotonic()
+    with _content_types_lock:
+        cached = _content_types.get(url)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+
+    content_type = ""
+    try:
+        response = requests.head(url, allow_redirects=True, timeout=timeout)
+        if response.ok:
+            content_type = response.headers.get('content-type', "")
+        if content_type == "":
+            # Some servers don't answer HEAD requests, ask for the first byte only
+            with requests.get(url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=timeout) as response:
+                if response.ok:
+                    content_type = response.headers.get('content-type', "")
+    except Exception as e:
+        # not cached, the server might answer next time
+        print("Could not probe " + str(url) + ": " + str(e))
+        return ""
+    content_type = content_type.split(";")[0].strip().lower()
+
+    with _content_types_lock:
+        if len(_content_types) >= CONTENT_TYPE_CACHE_SIZE:
+            for key in [key for key, value in _content_types.items() if value[1] <= now] or list(_content_types)[:1]:
+                del _content_types[key]
+        _content_types[url] = (content_type, now + CONTENT_TYPE_TTL)
+    return content_type
+
+
+def job_file(prefix, ext) -> str:
+    """Creates a file with a unique name in outputs, so jobs running at the same time don't overwrite each other's
+    files."""
+    fd, filename = tempfile.mkstemp(prefix=prefix + "-", suffix="." + ext, dir=os.path.abspath(os.curdir + r'/outputs/'))
+    os.close(fd)
+    return filename
+
+
 def get_media_link(url) -> (str, str):
-    req = requests.get(url)
-    content_type = req.headers['content-type']
+    content_type = probe_content_type(url)
     print(content_type)
     if content_type == 'audio/x-wav' or str(url).lower().endswith(".wav"):
         ext = "wav"
         file_type = "audio"
-        with open(os.path.abspath(os.curdir + r'/outputs/' + 'file.' + ext), 'wb') as fd:
-            fd.write(req.content)
-        return os.path.abspath(os.curdir + r'/outputs/' + 'file.' + ext), file_type
     elif content_type == 'audio/mpeg' or str(url).lower().endswith(".mp3"):
         ext = "mp3"
         file_type = "audio"
-        with open(os.path.abspath(os.curdir + r'/outputs/' + 'file.' + ext), 'wb') as fd:
-            fd.write(req.content)
-        return os.path.abspath(os.curdir + r'/outputs/' + 'file.' + ext), file_type
     elif content_type == 'audio/ogg' or str(url).lower().endswith(".ogg"):
         ext = "ogg"
         file_type = "audio"
-        with open(os.path.abspath(os.curdir + r'/outputs/' + 'file.' + ext), 'wb') as fd:
-            fd.write(req.content)
-        return os.path.abspath(os.curdir + r'/outputs/' + 'file.' + ext), file_type
     elif content_type == 'video/mp4' or str(url).lower().endswith(".mp4"):
         ext = "mp4"
         file_type = "video"
-
-        with open(os.path.abspath(os.curdir + r'/outputs/' + 'file.' + ext), 'wb') as fd:
-            fd.write(req.content)
-        return os.path.abspath(os.curdir + r'/outputs/' + 'file.' + ext), file_type
     elif content_type == 'video/avi' or str(url).lower().endswith(".avi"):
         ext = "avi"
         file_type = "video"
-        with open(os.path.abspath(os.curdir + r'/outputs/' + 'file.' + ext), 'wb') as fd:
-            fd.write(req.content)
-        return os.path.abspath(os.curdir + r'/outputs/' + 'file.' + ext), file_type
     elif content_type == 'video/quicktime' or str(url).lower().endswith(".mov"):
         ext = "mov"
         file_type = "video"
-        with open(os.path.abspath(os.curdir + r'/outputs/' + 'file.' + ext), 'wb') as fd:
-            fd.write(req.content)
-        return os.path.abspath(os.curdir + r'/outputs/' + 'file.' + ext), file_type
-
     else:
         print(str(url).lower())
         return None, None
 
+    # only files we can work with are downloaded, and they are streamed to disk instead of held in memory
+    filename = job_file("file", ext)
+    try:
+        with requests.get(url, stream=True, timeout=(10, 300)) as req:
+            req.raise_for_status()
+            with open(filename, 'wb') as fd:
+                for chunk in req.iter_content(chunk_size=1024 * 1024):
+                    fd.write(chunk)
+    except Exception:
+        os.remove(filename)
+        raise
+    return filename, file_type
+
 
 def download_overcast(source_url, target_location):
     result = OvercastDownload(source_url, target_location)
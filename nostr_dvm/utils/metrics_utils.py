@@ -0,0 +1,169 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+Metrics for the job pipeline. Every stage of a job (decrypt, task detection, user lookup, pricing, invoice, process,
+post_process, publish) and relay queries are timed and counted, labelled by DVM name and task. Metrics are shared by
+all DVMs in the process and can be scraped in Prometheus text format from METRICS_PORT and/or are printed as a short
+summary every METRICS_LOG_SECONDS.
+"""
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        # upper bound of the bucket the quantile falls into
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                return BUCKETS[index] if index < len(BUCKETS) else self.max
+        return 0.0
+
+
+class Metrics:
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def observe(self, stage, seconds, dvm="", task=""):
+        key = (stage, dvm, task)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = Histogram()
+                self.histograms[key] = histogram
+            histogram.observe(seconds)
+
+    def count(self, name, dvm="", task="", value=1):
+        key = (name, dvm, task)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def prometheus(self) -> str:
+        lines = ["# TYPE dvm_stage_seconds histogram"]
+        with self.lock:
+            for (stage, dvm, task), histogram in sorted(self.histograms.items()):
+                labels = 'stage="' + _escape(stage) + '",dvm="' + _escape(dvm) + '",task="' + _escape(task) + '"'
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append("dvm_stage_seconds_bucket{" + labels + ',le="' + str(bound) + '"} ' +
+                                 str(cumulative))
+                lines.append("dvm_stage_seconds_bucket{" + labels + ',le="+Inf"} ' + str(histogram.count))
+                lines.append("dvm_stage_seconds_sum{" + labels + "} " + str(histogram.sum))
+                lines.append("dvm_stage_seconds_count{" + labels + "} " + str(histogram.count))
+            names = sorted({key[0] for key in self.counters})
+            for name in names:
+                lines.append("# TYPE dvm_" + name + "_total counter")
+                for (counter, dvm, task), value in sorted(self.counters.items()):
+                    if counter == name:
+                        lines.append("dvm_" + name + '_total{dvm="' + _escape(dvm) + '",task="' + _escape(task) +
+                                     '"} ' + str(value))
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        lines = []
+        with self.lock:
+            for (stage, dvm, task), histogram in sorted(self.histograms.items()):
+                lines.append("[" + dvm + "] " + stage + (" " + task if task != "" else "") + ": " +
+                             str(histogram.count) + "x avg " + format(histogram.sum / histogram.count, ".3f") +
+                             "s p95 <= " + str(histogram.quantile(0.95)) + "s max " + format(histogram.max, ".3f") +
+                             "s")
+            for (name, dvm, task), value in sorted(self.counters.items()):
+                lines.append("[" + dvm + "] " + name + (" " + task if task != "" else "") + ": " + str(value))
+        return "\n".join(lines)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics()
+
+
+def observe(stage, seconds, dvm="", task=""):
+    metrics.observe(stage, seconds, dvm, task)
+
+
+def count(name, dvm="", task="", value=1):
+    metrics.count(name, dvm, task, value)
+
+
+def metrics_name(dvm_config) -> str:
+    """DVM name used as label, for helpers that only get the config."""
+    nip89 = getattr(dvm_config, "NIP89", None)
+    return getattr(nip89, "NAME", "") or ""
+
+
+@contextmanager
+def timed(stage, dvm="", task=""):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe(stage, time.perf_counter() - start, dvm, task)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = metrics.prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+_started = set()
+_started_lock = threading.Lock()
+
+
+def start_metrics(port=0, log_seconds=0):
+    """Starts the metrics endpoint on localhost and the log summary, once per process."""
+    with _started_lock:
+        if port > 0 and "server" not in _started:
+            _started.add("server")
+            try:
+                server = ThreadingHTTPServer(("127.0.0.1", port), MetricsRequestHandler)
+                threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+                print("Metrics available on http://127.0.0.1:" + str(port) + "/metrics")
+            except OSError as e:
+                print("Could not start metrics endpoint: " + str(e))
+        if log_seconds > 0 and "log" not in _started:
+            _started.add("log")
+            threading.Thread(target=_log_summary, args=[log_seconds], name="metrics-log", daemon=True).start()
+
+
+def _log_summary(log_seconds):
+    while True:
+        time.sleep(log_seconds)
+        summary = metrics.summary()
+        if summary != "":
+            print("Metrics:\n" + summary)
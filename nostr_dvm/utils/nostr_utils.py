@@ -1,12 +1,24 @@
 import json
 import os
+import threading
+import time
+from collections import OrderedDict
 from datetime import timedelta
 from pathlib import Path
 from typing import List
 
 import dotenv
-from nostr_sdk import Filter, Client, Alphabet, EventId, Event, PublicKey, Tag, Keys, nip04_decrypt, Metadata, Options, \
-    Nip19Event, SingleLetterTag
+from nostr_sdk import Filter, Client, Alphabet, EventId, Event, PublicKey, Tag, Keys, Metadata, Options, \
+    Nip19Event, SingleLetterTag, EventBuilder, Kind
+
+from nostr_dvm.utils.crypto_utils import get_crypto_context
+from nostr_dvm.utils.metrics_utils import timed, metrics_name
+
+
+def query_events(client: Client, filters, config) -> list[Event]:
+    # every relay query goes through here, so we can see how much time a DVM spends waiting on relays
+    with timed("relay_query", metrics_name(config)):
+        return client.get_events_of(filters, timedelta(seconds=config.RELAY_TIMEOUT))
 
 
 def get_event_by_id(event_id: str, client: Client, config=None) -> Event | None:
@@ -14,7 +26,7 @@ def get_event_by_id(event_id: str, client: Client, config=None) -> Event | None:
     if len(split) == 3:
         pk = PublicKey.from_hex(split[1])
         id_filter = Filter().author(pk).custom_tag(SingleLetterTag.lowercase(Alphabet.D), [split[2]])
-        events = client.get_events_of([id_filter], timedelta(seconds=config.RELAY_TIMEOUT))
+        events = query_events(client, [id_filter], config)
     else:
         if str(event_id).startswith('note'):
             event_id = EventId.from_bech32(event_id)
@@ -29,7 +41,7 @@ def get_event_by_id(event_id: str, client: Client, config=None) -> Event | None:
             event_id = EventId.from_hex(event_id)
 
         id_filter = Filter().id(event_id).limit(1)
-        events = client.get_events_of([id_filter], timedelta(seconds=config.RELAY_TIMEOUT))
+        events = query_events(client, [id_filter], config)
     if len(events) > 0:
 
         return events[0]
@@ -44,7 +56,7 @@ def get_events_by_ids(event_ids, client: Client, config=None) -> List | None:
         if len(split) == 3:
             pk = PublicKey.from_hex(split[1])
             id_filter = Filter().author(pk).custom_tag(SingleLetterTag.lowercase(Alphabet.D), [split[2]])
-            events = client.get_events_of([id_filter], timedelta(seconds=config.RELAY_TIMEOUT))
+            events = query_events(client, [id_filter], config)
         else:
             if str(event_id).startswith('note'):
                 event_id = EventId.from_bech32(event_id)
@@ -60,7 +72,7 @@ def get_events_by_ids(event_ids, client: Client, config=None) -> List | None:
         search_ids.append(event_id)
 
     id_filter = Filter().ids(search_ids)
-    events = client.get_events_of([id_filter], timedelta(seconds=config.RELAY_TIMEOUT))
+    events = query_events(client, [id_filter], config)
     if len(events) > 0:
 
         return events
@@ -70,33 +82,37 @@ def get_events_by_ids(event_ids, client: Client, config=None) -> List | None:
 
 def get_events_by_id(event_ids: list, client: Client, config=None) -> list[Event] | None:
     id_filter = Filter().ids(event_ids)
-    events = client.get_events_of([id_filter], timedelta(seconds=config.RELAY_TIMEOUT))
+    events = query_events(client, [id_filter], config)
     if len(events) > 0:
         return events
     else:
         return None
 
 
-def get_referenced_event_by_id(event_id, client, dvm_config, kinds) -> Event | None:
-    if kinds is None:
-        kinds = []
+def parse_event_id(event_id) -> EventId:
     if str(event_id).startswith('note'):
-        event_id = EventId.from_bech32(event_id)
+        return EventId.from_bech32(event_id)
     elif str(event_id).startswith("nevent"):
-        event_id = Nip19Event.from_bech32(event_id).event_id()
+        return Nip19Event.from_bech32(event_id).event_id()
     elif str(event_id).startswith('nostr:note'):
-        event_id = EventId.from_nostr_uri(event_id)
+        return EventId.from_nostr_uri(event_id)
     elif str(event_id).startswith("nostr:nevent"):
-        event_id = Nip19Event.from_nostr_uri(event_id).event_id()
+        return Nip19Event.from_nostr_uri(event_id).event_id()
     else:
-        event_id = EventId.from_hex(event_id)
+        return EventId.from_hex(event_id)
+
+
+def get_referenced_event_by_id(event_id, client, dvm_config, kinds) -> Event | None:
+    if kinds is None:
+        kinds = []
+    event_id = parse_event_id(event_id)
 
     if len(kinds) > 0:
         job_id_filter = Filter().kinds(kinds).event(event_id).limit(1)
     else:
         job_id_filter = Filter().event(event_id).limit(1)
 
-    events = client.get_events_of([job_id_filter], timedelta(seconds=dvm_config.RELAY_TIMEOUT))
+    events = query_events(client, [job_id_filter], dvm_config)
 
     if len(events) > 0:
         return events[0]
@@ -104,25 +120,117 @@ def get_referenced_event_by_id(event_id, client, dvm_config, kinds) -> Event | N
         return None
 
 
-def send_event(event: Event, client: Client, dvm_config) -> EventId:
+class ExtraRelayPool:
+    """Relays we send to on top of the relay list, e.g. the relays a customer asked for in a request. Every relay gets
+    its own client without subscriptions, so it only receives the events that are meant for it, and nothing of it ends
+    up in the subscriptions of the DVM. Connections are kept after sending, so the reactions and the result of a job,
+    and later jobs of the same customer, reuse them instead of connecting and disconnecting for every event. Relays
+    that weren't used for idle_seconds are disconnected, and at most max_relays are kept, the least recently used one
+    goes first."""
+
+    def __init__(self, max_relays=20, idle_seconds=300, timeout=5):
+        self.max_relays = max_relays
+        self.idle_seconds = idle_seconds
+        # events sent before the relay is connected are queued until it is
+        self.opts = (Options().wait_for_send(False).send_timeout(timedelta(seconds=timeout))
+                     .skip_disconnected_relays(False))
+        self.relays = OrderedDict()
+        # add and remove happen under the lock, so a relay is never disconnected while another send just picked it
+        self.lock = threading.Lock()
+
+    def send(self, event: Event, urls):
+        if len(urls) > self.max_relays:
+            print("Sending to the first " + str(self.max_relays) + " of " + str(len(urls)) + " requested relays")
+            urls = urls[:self.max_relays]
+        now = time.monotonic()
+        clients = []
+        with self.lock:
+            for url in urls:
+                if url not in self.relays:
+                    try:
+                        client = Client.with_opts(None, self.opts)
+                        client.add_relay(url)
+                        client.connect()
+                    except Exception as e:
+                        print("Could not connect to relay " + url + ": " + str(e))
+                        continue
+                    self.relays[url] = [client, now]
+                self.relays[url][1] = now
+                self.relays.move_to_end(url)
+                clients.append(self.relays[url][0])
+            self._evict(now, keep=urls)
+        for client in clients:
+            try:
+                client.send_event(event)
+            except Exception as e:
+                print("Could not send event to extra relay: " + str(e))
+
+    def close_idle(self):
+        with self.lock:
+            self._evict(time.monotonic())
+
+    def _evict(self, now, keep=()):
+        for url, (client, last_used) in list(self.relays.items()):
+            if url in keep:
+                continue
+            if len(self.relays) <= self.max_relays and now - last_used < self.idle_seconds:
+                # the rest were used more recently
+                break
+            del self.relays[url]
+            try:
+                client.disconnect()
+            except Exception as e:
+                print("Could not disconnect from relay " + url + ": " + str(e))
+
+
+_extra_relay_pools = {}
+_extra_relay_pools_lock = threading.Lock()
+
+
+def get_extra_relay_pool(client, dvm_config) -> ExtraRelayPool:
+    with _extra_relay_pools_lock:
+        entry = _extra_relay_pools.get(id(client))
+        if entry is None or entry[0] is not client:
+            entry = (client, ExtraRelayPool(max_relays=getattr(dvm_config, "EXTRA_RELAY_MAX", 20),
+                                            idle_seconds=getattr(dvm_config, "EXTRA_RELAY_IDLE_SECONDS", 300),
+                                            timeout=dvm_config.RELAY_TIMEOUT))
+            _extra_relay_pools[id(client)] = entry
+        return entry[1]
+
+
+def close_idle_relays(client):
+    """Disconnects extra relays of the client that weren't used for a while."""
+    with _extra_relay_pools_lock:
+        entry = _extra_relay_pools.get(id(client))
+    if entry is not None and entry[0] is client:
+        entry[1].close_idle()
+
+
+def request_relays(event) -> list:
+    """Relays listed in the relays tag of a request, responses should be sent there too."""
+    relays = []
+    for tag in event.tags():
+        if tag.as_vec()[0] == 'relays':
+            for index, param in enumerate(tag.as_vec()):
+                if index != 0:
+                    relays.append(tag.as_vec()[index])
+    return relays
+
+
+def send_event(event: Event, client: Client, dvm_config, relays=None) -> EventId:
+    """Sends an event to the relay list, the relays in its relays tag and the given extra relays."""
     try:
-        relays = []
-
-        for tag in event.tags():
-            if tag.as_vec()[0] == 'relays':
-                for index, param in enumerate(tag.as_vec()):
-                    if index != 0:
-                        relays.append(tag.as_vec()[index])
-
-        for relay in relays:
-            if relay not in dvm_config.RELAY_LIST:
-                client.add_relay(relay)
-
-        event_id = client.send_event(event)
-
-        for relay in relays:
-            if relay not in dvm_config.RELAY_LIST:
-                client.remove_relay(relay)
+        extra_relays = []
+        relay_list = {relay.rstrip("/") for relay in dvm_config.RELAY_LIST}
+        for relay in request_relays(event) + (relays or []):
+            if ((relay.startswith("wss://") or relay.startswith("ws://")) and relay.rstrip("/") not in relay_list
+                    and relay not in extra_relays):
+                extra_relays.append(relay)
+
+        with timed("publish", metrics_name(dvm_config)):
+            event_id = client.send_event(event)
+            if len(extra_relays) > 0:
+                get_extra_relay_pool(client, dvm_config).send(event, extra_relays)
 
         return event_id
     except Exception as e:
@@ -147,8 +255,7 @@ def check_and_decrypt_tags(event, dvm_config):
                 return None
 
             elif p == dvm_config.PUBLIC_KEY:
-                tags_str = nip04_decrypt(Keys.parse(dvm_config.PRIVATE_KEY).secret_key(),
-                                         event.author(), event.content())
+                tags_str = get_crypto_context(dvm_config.PRIVATE_KEY).decrypt(event.author(), event.content())
                 params = json.loads(tags_str)
                 params.append(Tag.parse(["p", p]).as_vec())
                 params.append(Tag.parse(["encrypted"]).as_vec())
@@ -179,8 +286,8 @@ def check_and_decrypt_own_tags(event, dvm_config):
                 return None
 
             elif event.author().to_hex() == dvm_config.PUBLIC_KEY:
-                tags_str = nip04_decrypt(Keys.parse(dvm_config.PRIVATE_KEY).secret_key(),
-                                         PublicKey.from_hex(p), event.content())
+                tags_str = get_crypto_context(dvm_config.PRIVATE_KEY).decrypt(PublicKey.from_hex(p),
+                                                                              event.content())
                 params = json.loads(tags_str)
                 params.append(Tag.parse(["p", p]).as_vec())
                 params.append(Tag.parse(["encrypted"]).as_vec())
@@ -214,7 +321,9 @@ def update_profile(dvm_config, client, lud16=""):
 
         print(f"Setting profile metadata for {keys.public_key().to_bech32()}...")
         print(metadata.as_json())
-        client.set_metadata(metadata)
+        # signed with our keys and not by the client, the client might be shared with other DVMs
+        metadata_event = EventBuilder(Kind(0), metadata.as_json(), []).to_event(keys)
+        client.send_event(metadata_event)
 
 
 def check_and_set_private_key(identifier):
@@ -10,6 +10,8 @@ from pyupload.uploader import CatboxUploader
 
 import pandas
 
+from nostr_dvm.utils.trace_utils import traced
+
 '''
 Post process results to either given output format or a Nostr readable plain text.
 '''
@@ -138,6 +140,9 @@ def replace_broken_words(text):
     return result
 
 
+# connect and read timeout of uploads, so a hoster that doesn't answer makes us try the next one
+UPLOAD_TIMEOUT = (10, 120)
+
 '''
 Function to upload to Nostr.build and if it fails to Nostrfiles.dev
 Larger files than these hosters allow and fallback is catbox currently.
@@ -145,6 +150,7 @@ Will probably need to switch to another system in the future.
 '''
 
 
+@traced("upload_media_to_hoster")
 def upload_media_to_hoster(filepath: str):
     print("Uploading image: " + filepath)
     try:
@@ -158,7 +164,7 @@ def upload_media_to_hoster(filepath: str):
             return result
         else:
             url = 'https://nostr.build/api/v2/upload/files'
-            response = requests.post(url, files=files)
+            response = requests.post(url, files=files, timeout=UPLOAD_TIMEOUT)
             json_object = json.loads(response.text)
             result = json_object["data"][0]["url"]
             return result
@@ -166,7 +172,7 @@ def upload_media_to_hoster(filepath: str):
         try:
             file = {'file': open(filepath, 'rb')}
             url = 'https://nostrfiles.dev/upload_image'
-            response = requests.post(url, files=file)
+            response = requests.post(url, files=file, timeout=UPLOAD_TIMEOUT)
             json_object = json.loads(response.text)
             print(json_object["url"])
             return json_object["url"]
@@ -195,6 +201,10 @@ def build_status_reaction(status, task, amount, content, dvm_config):
     elif status == "success":
         alt_description = "NIP90 DVM AI task " + task + " finished successfully. "
         reaction = alt_description + emoji.emojize(":call_me_hand:")
+    elif status == "partial":
+        # streamed results, the content is the text since the previous partial result
+        alt_description = "NIP90 DVM AI task " + task + " partial result. "
+        reaction = content if content is not None else ""
     elif status == "chain-scheduled":
         alt_description = "NIP90 DVM AI task " + task + " Chain Task scheduled"
         reaction = alt_description + emoji.emojize(":thumbs_up:")
@@ -225,6 +235,12 @@ def build_status_reaction(status, task, amount, content, dvm_config):
         alt_description = "NIP90 DVM AI task " + task + " payment is below required amount of " + str(
             amount) + " Sats. "
         reaction = alt_description + emoji.emojize(":thumbs_down:")
+    elif status == "busy":
+        alt_description = "NIP90 DVM AI task " + task + " can't be accepted right now, all workers are busy. "
+        reaction = alt_description + "Please try again later " + emoji.emojize(":hourglass_not_done:")
+    elif status == "rate-limited":
+        alt_description = "NIP90 DVM AI task " + task + " was not accepted, too many requests. "
+        reaction = alt_description + "Please slow down " + emoji.emojize(":hourglass_not_done:")
     elif status == "user-blocked-from-service":
         alt_description = "NIP90 DVM AI task " + task + " can't be performed. User has been blocked from Service. "
         reaction = alt_description + emoji.emojize(":thumbs_down:")
@@ -0,0 +1,231 @@
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from dataclasses import dataclass
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from nostr_dvm.utils.zap_utils import check_bolt11_ln_bits_is_paid, create_bolt11_ln_bits, create_bolt11_lud16
+
+"""
+Watches LNbits invoices of jobs that require payment. Invoices are checked in batches on a pooled HTTP session with a
+limited number of parallel requests, and invoices that stay unpaid are checked less often (exponential backoff).
+Optionally the LNbits payment stream (server sent events) is consumed, so payments are picked up right away and
+polling only is the fallback.
+Invoices for the fixed prices of a DVM are created ahead of time by the InvoiceProvisioner, so a payment-required
+reaction doesn't wait for LNbits. Invoices for other amounts are created in the background.
+"""
+
+
+@dataclass
+class WatchedInvoice:
+    payment_hash: str
+    next_check: float
+    interval: float
+
+
+class InvoiceSettlementPoller:
+    def __init__(self, dvm_config, on_settled, concurrency=8, min_interval=1.0, max_interval=2.0,
+                 use_stream=False, stream_url=None):
+        self.dvm_config = dvm_config
+        self.on_settled = on_settled
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.watched = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.pool = ThreadPoolExecutor(max_workers=concurrency,
+                                       thread_name_prefix=dvm_config.NIP89.NAME + "-invoices")
+
+        threading.Thread(target=self._poll_loop, daemon=True).start()
+        if use_stream:
+            if stream_url is None or stream_url == "":
+                stream_url = dvm_config.LNBITS_URL + "/api/v1/payments/sse"
+            threading.Thread(target=self._stream_loop, args=[stream_url], daemon=True).start()
+
+    def watch(self, payment_hash):
+        if payment_hash is None or payment_hash == "":
+            return
+        with self.lock:
+            if payment_hash not in self.watched:
+                self.watched[payment_hash] = WatchedInvoice(payment_hash=payment_hash,
+                                                            next_check=time.monotonic() + self.min_interval,
+                                                            interval=self.min_interval)
+        self.wakeup.set()
+
+    def unwatch(self, payment_hash):
+        with self.lock:
+            return self.watched.pop(payment_hash, None) is not None
+
+    def check(self, payment_hash):
+        return check_bolt11_ln_bits_is_paid(payment_hash, self.dvm_config, session=self.session)
+
+    def _settle(self, payment_hash, is_paid):
+        # Only the first one to unwatch an invoice reports it, so stream and poller never both start a job
+        if self.unwatch(payment_hash):
+            try:
+                self.on_settled(payment_hash, is_paid)
+            except Exception as e:
+                print("[" + self.dvm_config.NIP89.NAME + "] Error handling settled invoice: " + str(e))
+
+    def _due_invoices(self, now):
+        with self.lock:
+            return [invoice for invoice in self.watched.values() if invoice.next_check <= now]
+
+    def _poll_loop(self):
+        while True:
+            now = time.monotonic()
+            due = self._due_invoices(now)
+            if len(due) > 0:
+                results = self.pool.map(lambda invoice: (invoice, self.check(invoice.payment_hash)), due)
+                for invoice, is_paid in results:
+                    if is_paid or is_paid is None:  # paid, or invoice expired
+                        self._settle(invoice.payment_hash, is_paid)
+                    else:
+                        invoice.interval = min(invoice.interval * 2, self.max_interval)
+                        invoice.next_check = time.monotonic() + invoice.interval
+
+            with self.lock:
+                next_check = min((invoice.next_check for invoice in self.watched.values()), default=None)
+            timeout = self.max_interval if next_check is None else max(0.0, next_check - time.monotonic())
+            self.wakeup.wait(timeout)
+            self.wakeup.clear()
+
+    def _stream_loop(self, stream_url):
+        headers = {'X-API-Key': self.dvm_config.LNBITS_INVOICE_KEY}
+        retry = 1.0
+        while True:
+            try:
+                with self.session.get(stream_url, headers=headers, stream=True, timeout=(10, 300)) as response:
+                    response.raise_for_status()
+                    retry = 1.0
+                    for line in response.iter_lines(decode_unicode=True):
+                        if line is not None and line.startswith("data:"):
+                            self._handle_stream_data(line[5:].strip())
+            except Exception as e:
+                print("[" + self.dvm_config.NIP89.NAME + "] LNbits payment stream: " + str(e))
+            time.sleep(retry)
+            retry = min(retry * 2, self.max_interval)
+
+    def _handle_stream_data(self, data):
+        try:
+            payment = json.loads(data)
+        except ValueError:
+            return
+        if not isinstance(payment, dict):
+            return
+        payment_hash = payment.get("payment_hash") or payment.get("checking_id")
+        with self.lock:
+            watched = payment_hash in self.watched
+        # The stream only tells us something happened, we confirm with LNbits before starting paid work
+        if watched and self.check(payment_hash):
+            self._settle(payment_hash, True)
+
+
+def create_invoice(amount, dvm_config) -> (str, str):
+    """Creates an invoice on LNbits, or with the lightning address if there is no LNbits wallet. Returns (bolt11,
+    payment_hash), payment_hash is empty for lightning address invoices, bolt11 is None if it failed."""
+    bolt11, payment_hash = None, None
+    if dvm_config.LNBITS_INVOICE_KEY != "":
+        try:
+            bolt11, payment_hash = create_bolt11_ln_bits(amount, dvm_config)
+        except Exception as e:
+            print(e)
+    if bolt11 is None and dvm_config.LN_ADDRESS != "":
+        try:
+            bolt11, payment_hash = create_bolt11_lud16(dvm_config.LN_ADDRESS, amount), ""
+        except Exception as e:
+            print(e)
+    return bolt11, payment_hash
+
+
+@dataclass
+class PooledInvoice:
+    bolt11: str
+    payment_hash: str
+    created: float
+
+
+class InvoiceProvisioner:
+    def __init__(self, dvm_config, amounts, pool_size=0, max_age=600, workers=2):
+        """Keeps pool_size unused invoices for each amount. Invoices older than max_age are not handed out anymore,
+        so customers don't get one that is about to expire."""
+        self.dvm_config = dvm_config
+        self.pool_size = pool_size
+        self.max_age = max_age
+        self.pools = {}
+        self.creating = {}
+        self.retry_after = 0.0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix=dvm_config.NIP89.NAME + "-new-invoices")
+        # only LNbits invoices can be pooled, we need their payment hash to see when they are paid
+        if pool_size > 0 and dvm_config.LNBITS_INVOICE_KEY != "" and dvm_config.LNBITS_URL:
+            for amount in amounts:
+                if amount > 0 and amount == int(amount):
+                    self.pools[int(amount)] = deque()
+                    self.creating[int(amount)] = 0
+        self.refill()
+
+    def invoice(self, amount) -> Future:
+        """Future of (bolt11, payment_hash) for the amount. It is done right away if a pooled invoice was available."""
+        invoice = self._take(amount)
+        if invoice is not None:
+            future = Future()
+            future.set_result((invoice.bolt11, invoice.payment_hash))
+            return future
+        return self.executor.submit(create_invoice, amount, self.dvm_config)
+
+    def refill(self):
+        """Drops pooled invoices that are too old and creates the missing ones in the background."""
+        now = time.monotonic()
+        missing = []
+        with self.lock:
+            if now < self.retry_after:
+                return
+            for amount, pool in self.pools.items():
+                while len(pool) > 0 and now - pool[0].created > self.max_age:
+                    pool.popleft()
+                count = self.pool_size - len(pool) - self.creating[amount]
+                if count > 0:
+                    self.creating[amount] += count
+                    missing.extend([amount] * count)
+        for amount in missing:
+            self.executor.submit(self._create_pooled, amount)
+
+    def _take(self, amount):
+        if amount != int(amount) or int(amount) not in self.pools:
+            return None
+        now = time.monotonic()
+        invoice = None
+        with self.lock:
+            pool = self.pools[int(amount)]
+            while len(pool) > 0:
+                candidate = pool.popleft()
+                if now - candidate.created <= self.max_age:
+                    invoice = candidate
+                    break
+        self.refill()
+        return invoice
+
+    def _create_pooled(self, amount):
+        try:
+            bolt11, payment_hash = create_invoice(amount, self.dvm_config)
+        finally:
+            with self.lock:
+                self.creating[amount] -= 1
+        with self.lock:
+            if bolt11 is not None and payment_hash:
+                self.pools[amount].append(PooledInvoice(bolt11=bolt11, payment_hash=payment_hash,
+                                                        created=time.monotonic()))
+            else:
+                # LNbits is not answering, jobs get their invoices created one by one until we try again
+                self.retry_after = time.monotonic() + 30
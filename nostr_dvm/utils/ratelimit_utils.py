@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import OrderedDict
+
+"""
+Token bucket rate limiting for job requests. Every pubkey has a bucket that holds up to burst requests and refills at
+rate requests per second, and a global bucket limits all requests together. The check is done before any expensive
+work (decryption, task detection, user lookups, media downloads) is done for a request.
+"""
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, now=None):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic() if now is None else now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now) -> bool:
+        self.refill(now)
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+    def is_full(self, now) -> bool:
+        self.refill(now)
+        return self.tokens >= self.burst
+
+
+class RateLimiter:
+    def __init__(self, user_rate=0, user_burst=5, global_rate=0, global_burst=50, max_users=10000):
+        """A rate of 0 disables the limit."""
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_users = max_users
+        self.buckets = OrderedDict()
+        self.notified = set()
+        self.global_bucket = TokenBucket(global_rate, global_burst) if global_rate > 0 else None
+        self.lock = threading.Lock()
+
+    def check(self, pubkey) -> tuple:
+        """Returns (allowed, notify). notify is True for the first rejected request of a pubkey in a row, so spammers
+        get one rate-limited reaction and not one per request."""
+        now = time.monotonic()
+        with self.lock:
+            allowed = True
+            if self.user_rate > 0:
+                bucket = self.buckets.get(pubkey)
+                if bucket is None:
+                    bucket = TokenBucket(self.user_rate, self.user_burst, now)
+                    self.buckets[pubkey] = bucket
+                    self._evict(now)
+                self.buckets.move_to_end(pubkey)
+                allowed = bucket.take(now)
+            if allowed and self.global_bucket is not None:
+                allowed = self.global_bucket.take(now)
+                if not allowed and self.user_rate > 0:
+                    # the request is not done, so it doesn't count against the user
+                    self.buckets[pubkey].tokens += 1.0
+
+            if allowed:
+                self.notified.discard(pubkey)
+                return True, False
+            notify = pubkey not in self.notified
+            self.notified.add(pubkey)
+            return False, notify
+
+    def _evict(self, now):
+        # Buckets of pubkeys that were quiet long enough to be full again are the same as new ones
+        while len(self.buckets) > self.max_users:
+            pubkey, bucket = next(iter(self.buckets.items()))
+            if not bucket.is_full(now) and len(self.buckets) <= 2 * self.max_users:
+                break
+            self.buckets.popitem(last=False)
+            self.notified.discard(pubkey)
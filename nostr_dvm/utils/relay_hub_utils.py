@@ -0,0 +1,151 @@
+import queue
+import threading
+
+from nostr_sdk import Client, HandleNotification
+
+from nostr_dvm.utils.dedup_utils import SeenEvents
+
+"""
+Process wide relay hub. With SHARED_RELAY_HUB enabled, all DVMs and Bots in a process share one nostr client, so there
+is one connection per relay instead of one per relay and DVM. Every DVM gets a SharedClient that behaves like a Client
+(subscribe, get_events_of, send_event..), while incoming events are received once and routed to the DVMs they are for
+by kind and p tag. Every DVM handles its events in its own thread, so a slow handler doesn't hold up the others.
+Events are signed with the keys of each DVM before they are sent, the shared client itself has no signer.
+"""
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_relay_hub(opts):
+    """Returns the relay hub of this process, the options of the first caller are used for the shared client."""
+    global _hub
+    with _hub_lock:
+        if _hub is None:
+            _hub = RelayHub(opts)
+        return _hub
+
+
+class HubRoute:
+    def __init__(self, name, handler, public_key, kinds, any_p_kinds):
+        self.name = name
+        self.handler = handler
+        self.public_key = public_key
+        self.kinds = kinds
+        self.any_p_kinds = any_p_kinds
+        self.events = queue.Queue()
+        threading.Thread(target=self._dispatch, name=name + "-events", daemon=True).start()
+
+    def accepts(self, kind, p_tags) -> bool:
+        if kind in self.any_p_kinds:
+            return True
+        if self.kinds is not None and kind not in self.kinds:
+            return False
+        if len(p_tags) > 0:
+            return self.public_key in p_tags
+        # events without p tag are public requests, only routes that list the kind get them
+        return self.kinds is not None
+
+    def _dispatch(self):
+        while True:
+            relay_url, subscription_id, event = self.events.get()
+            try:
+                self.handler.handle(relay_url, subscription_id, event)
+            except Exception as e:
+                print("[" + self.name + "] Error handling event: " + str(e))
+
+
+class RelayHub:
+    def __init__(self, opts):
+        self.client = Client.with_opts(None, opts)
+        self.relays = {}
+        self.routes = []
+        self.seen_events = SeenEvents()
+        self.lock = threading.Lock()
+        self.handling = False
+
+    def client_for(self, name, public_key) -> 'SharedClient':
+        return SharedClient(self, name, public_key)
+
+    def add_relay(self, url):
+        with self.lock:
+            self.relays[url] = self.relays.get(url, 0) + 1
+            if self.relays[url] > 1:
+                return
+        self.client.add_relay(url)
+
+    def remove_relay(self, url):
+        # a relay is only disconnected when no DVM uses it anymore
+        with self.lock:
+            if url not in self.relays:
+                return
+            self.relays[url] -= 1
+            if self.relays[url] > 0:
+                return
+            del self.relays[url]
+        self.client.remove_relay(url)
+
+    def register(self, route: HubRoute):
+        with self.lock:
+            self.routes.append(route)
+            start = not self.handling
+            self.handling = True
+        if start:
+            self.client.handle_notifications(HubNotificationHandler(self))
+
+    def route(self, relay_url, subscription_id, event):
+        # every relay sends us the event, it is routed once
+        if self.seen_events.is_duplicate(event.id().to_hex()):
+            return
+        kind = event.kind().as_u64()
+        p_tags = set()
+        for tag in event.tags():
+            values = tag.as_vec()
+            if values[0] == "p" and len(values) > 1:
+                p_tags.add(values[1])
+        with self.lock:
+            routes = list(self.routes)
+        for route in routes:
+            if route.accepts(kind, p_tags):
+                route.events.put((relay_url, subscription_id, event))
+
+
+class HubNotificationHandler(HandleNotification):
+    def __init__(self, hub):
+        super().__init__()
+        self.hub = hub
+
+    def handle(self, relay_url, subscription_id, event):
+        self.hub.route(relay_url, subscription_id, event)
+
+    def handle_msg(self, relay_url, msg):
+        return
+
+
+class SharedClient:
+    """Client of one DVM on the relay hub, everything but relays and notifications goes to the shared client."""
+
+    def __init__(self, hub, name, public_key):
+        self.hub = hub
+        self.name = name
+        self.public_key = public_key
+        self.kinds = None
+        self.any_p_kinds = set()
+
+    def route(self, kinds=None, any_p_kinds=None):
+        """Events of kinds are handled if they are addressed to us or to nobody (kinds None: any kind addressed to
+        us), events of any_p_kinds are handled whoever they are addressed to."""
+        self.kinds = None if kinds is None else {kind.as_u64() for kind in kinds}
+        self.any_p_kinds = set() if any_p_kinds is None else {kind.as_u64() for kind in any_p_kinds}
+
+    def add_relay(self, url):
+        self.hub.add_relay(url)
+
+    def remove_relay(self, url):
+        self.hub.remove_relay(url)
+
+    def handle_notifications(self, handler):
+        self.hub.register(HubRoute(self.name, handler, self.public_key, self.kinds, self.any_p_kinds))
+
+    def __getattr__(self, name):
+        return getattr(self.hub.client, name)
@@ -0,0 +1,71 @@
+import asyncio
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from nostr_dvm.utils.cancel_utils import wait_cancellable
+from nostr_dvm.utils.stream_utils import collect_stream
+
+"""
+Shared event loop for periodic work. With ASYNC_RUNTIME enabled, DVMs, Bots and Subscriptions don't keep a thread
+sleeping in a loop each; their tick is scheduled on one event loop that runs in a single thread for the whole process.
+Tasks can implement process() as a coroutine (async def process) or an async generator, these run on the same loop.
+This is not an asyncio DVM. The nostr-sdk client, LNbits, uploads, the nova server and the databases are still called
+with blocking calls, so a tick is handed to a small thread pool and only awaited on the loop. A job waits for an async
+process() in a worker thread of its DVM, like for any other process(), so async tasks save threads only for the work
+they start themselves. The job workers, the watchdog, the feedback sender, the invoice poller and provisioner and the
+job store writer of a DVM keep their own threads, and so does the event dispatch of the relay hub.
+"""
+
+_runtime = None
+_runtime_lock = threading.Lock()
+
+
+class DVMRuntime:
+    def __init__(self, max_blocking_workers=8):
+        self.loop = asyncio.new_event_loop()
+        self.blocking = ThreadPoolExecutor(max_workers=max_blocking_workers, thread_name_prefix="runtime-blocking")
+        self.thread = threading.Thread(target=self._run, name="dvm-runtime", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coroutine):
+        """Runs a coroutine on the runtime, returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def call_every(self, interval, function, *args):
+        """Calls a blocking function every interval seconds, a call never overlaps with the previous one."""
+        return self.submit(self._every(interval, function, args))
+
+    async def run_blocking(self, function, *args):
+        return await self.loop.run_in_executor(self.blocking, function, *args)
+
+    async def _every(self, interval, function, args):
+        while True:
+            try:
+                await self.run_blocking(function, *args)
+            except Exception as e:
+                print("Error in scheduled " + getattr(function, "__name__", str(function)) + ": " + str(e))
+            await asyncio.sleep(interval)
+
+
+def get_runtime() -> DVMRuntime:
+    global _runtime
+    with _runtime_lock:
+        if _runtime is None:
+            _runtime = DVMRuntime()
+        return _runtime
+
+
+def call_process(task, request_form):
+    """Calls process() of a task, coroutines are run on the shared runtime and waited for. Streamed results
+    (generators) are joined, their chunks are emitted as partial results."""
+    if inspect.iscoroutinefunction(task.process):
+        return wait_cancellable(get_runtime().submit(task.process(request_form)))
+    result = task.process(request_form)
+    if inspect.isasyncgen(result):
+        return collect_stream(result, get_runtime())
+    return collect_stream(result)
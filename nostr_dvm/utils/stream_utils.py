@@ -0,0 +1,129 @@
+import contextvars
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+
+from nostr_dvm.utils.cancel_utils import current_cancel_token, wait_cancellable
+
+"""
+Streaming of partial results. A task can return a generator (or an async generator) from process() that yields the
+result in chunks, e.g. the tokens of a LLM. The chunks are joined to the final result as before, but while the job
+runs they are handed to the partial sink of the job, which the DVM sets up to publish kind 7000 "partial" feedback.
+Chunks are batched, a partial event is sent when PARTIAL_RESULT_CHARS characters came in or PARTIAL_RESULT_SECONDS
+passed since the last one, the first chunk is sent right away. Every partial event contains the text since the
+previous one. Outside of a job (or in process pool workers) chunks are only joined. A stream stops when its job is
+cancelled.
+"""
+
+_partial_sink = contextvars.ContextVar("partial_sink", default=None)
+
+
+class PartialBatcher:
+    def __init__(self, send, min_chars=200, interval=1.0):
+        self.send = send
+        self.min_chars = min_chars
+        self.interval = interval
+        self.buffer = []
+        self.buffered = 0
+        self.last_sent = None
+        self.lock = threading.Lock()
+
+    def add(self, chunk):
+        with self.lock:
+            self.buffer.append(chunk)
+            self.buffered += len(chunk)
+            now = time.monotonic()
+            if (self.last_sent is not None and self.buffered < self.min_chars
+                    and now - self.last_sent < self.interval):
+                return
+            text = self._take(now)
+        self._send(text)
+
+    def flush(self):
+        with self.lock:
+            text = self._take(time.monotonic())
+        self._send(text)
+
+    def _take(self, now):
+        text = "".join(self.buffer)
+        self.buffer = []
+        self.buffered = 0
+        self.last_sent = now
+        return text
+
+    def _send(self, text):
+        if text == "":
+            return
+        try:
+            self.send(text)
+        except Exception as e:
+            print("Error sending partial result: " + str(e))
+
+
+@contextmanager
+def streaming(send, min_chars=200, interval=1.0):
+    """Sends the chunks of streamed results in this context in batches with send(text). Text still buffered when
+    the context is left is sent as well."""
+    batcher = PartialBatcher(send, min_chars, interval)
+    token = _partial_sink.set(batcher.add)
+    try:
+        yield batcher
+    finally:
+        _partial_sink.reset(token)
+        batcher.flush()
+
+
+@contextmanager
+def partial_sink(sink):
+    """Hands every chunk of streamed results in this context to sink(chunk) without batching, used by venv workers to
+    forward chunks to the DVM."""
+    token = _partial_sink.set(sink)
+    try:
+        yield
+    finally:
+        _partial_sink.reset(token)
+
+
+def emit_partial(chunk):
+    sink = _partial_sink.get()
+    if sink is not None and chunk is not None and chunk != "":
+        sink(str(chunk))
+
+
+def collect_stream(result, runtime=None):
+    """Joins the chunks of a streamed result and emits them as partial results on the way. Other results are returned
+    as they are."""
+    if inspect.isasyncgen(result):
+        return wait_cancellable(runtime.submit(_collect_async(result, _partial_sink.get())))
+    if not inspect.isgenerator(result):
+        return result
+    token = current_cancel_token()
+    chunks = []
+    try:
+        for chunk in result:
+            token.check()
+            if chunk is None:
+                continue
+            chunks.append(str(chunk))
+            emit_partial(chunk)
+    finally:
+        # stops the generator (and e.g. the http stream it reads from) if we leave early
+        result.close()
+    return "".join(chunks)
+
+
+async def _collect_async(result, sink):
+    # runs on the runtime loop, so the sink of the job is passed in instead of taken from the context
+    token = _partial_sink.set(sink)
+    try:
+        chunks = []
+        async for chunk in result:
+            if chunk is None:
+                continue
+            chunks.append(str(chunk))
+            emit_partial(chunk)
+        return "".join(chunks)
+    finally:
+        _partial_sink.reset(token)
+        await result.aclose()
@@ -0,0 +1,192 @@
+import contextvars
+import functools
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import requests
+
+"""
+Lightweight per-job tracing. A trace is keyed by the job's event id, so all spans of a job end up in the same trace,
+no matter which thread (notification handler, worker, invoice poller) they were recorded in. Spans are propagated to
+task process() methods and backend helpers through a context variable; span() outside of a job does nothing.
+Finished spans are written in batches as OTLP JSON (one export request per line) to a file and/or posted to an OTLP
+HTTP collector (e.g. http://localhost:4318/v1/traces). Only a share of jobs (TRACE_SAMPLE_RATE) is traced, the
+decision is made from the job id, so it is the same for every span of a job.
+"""
+
+
+@dataclass
+class Span:
+    trace_id: str
+    span_id: str
+    parent_id: str
+    name: str
+    start: int
+    end: int = 0
+    attributes: dict = field(default_factory=dict)
+    error: str = ""
+
+
+class Tracer:
+    def __init__(self, sample_rate=0.0, file="", collector_url="", service_name="nostr-dvm", flush_interval=2.0):
+        self.sample_rate = sample_rate
+        self.file = file
+        self.collector_url = collector_url
+        self.service_name = service_name
+        self.flush_interval = flush_interval
+        self.finished = []
+        self.roots = {}
+        self.lock = threading.Lock()
+        if self.enabled():
+            threading.Thread(target=self._exporter, name="trace-export", daemon=True).start()
+
+    def enabled(self):
+        return self.sample_rate > 0 and (self.file != "" or self.collector_url != "")
+
+    def sampled(self, trace_id):
+        return int(trace_id[:8], 16) / 0xFFFFFFFF < self.sample_rate
+
+    def start(self, trace_id, name, parent_id, attributes):
+        span = Span(trace_id=trace_id, span_id=secrets.token_hex(8), parent_id=parent_id, name=name,
+                    start=time.time_ns(), attributes=attributes)
+        if parent_id == "":
+            # spans of this job that are started without a parent (other thread) hang below the first one
+            with self.lock:
+                span.parent_id = self.roots.setdefault(trace_id, span.span_id)
+                if span.parent_id == span.span_id:
+                    span.parent_id = ""
+        return span
+
+    def finish(self, span):
+        span.end = time.time_ns()
+        with self.lock:
+            self.finished.append(span)
+            if span.parent_id == "":
+                self.roots.pop(span.trace_id, None)
+
+    def _exporter(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            batch = self.finished
+            self.finished = []
+        if len(batch) == 0:
+            return
+        export = self._otlp(batch)
+        if self.file != "":
+            try:
+                directory = os.path.dirname(self.file)
+                if directory != "" and not os.path.exists(directory):
+                    os.makedirs(directory)
+                with open(self.file, "a") as f:
+                    f.write(json.dumps(export) + "\n")
+            except OSError as e:
+                print("Could not write traces: " + str(e))
+        if self.collector_url != "":
+            try:
+                requests.post(self.collector_url, json=export, timeout=5)
+            except Exception as e:
+                print("Could not send traces: " + str(e))
+
+    def _otlp(self, spans):
+        return {"resourceSpans": [{
+            "resource": {"attributes": [_attribute("service.name", self.service_name)]},
+            "scopeSpans": [{"scope": {"name": "nostr_dvm"}, "spans": [{
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "parentSpanId": span.parent_id,
+                "name": span.name,
+                "kind": 1,
+                "startTimeUnixNano": str(span.start),
+                "endTimeUnixNano": str(span.end),
+                "attributes": [_attribute(key, value) for key, value in span.attributes.items()],
+                "status": {"code": 2, "message": span.error} if span.error != "" else {"code": 1}
+            } for span in spans]}]
+        }]}
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+tracer = Tracer()
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def configure_tracing(sample_rate, file="", collector_url="", service_name="nostr-dvm"):
+    """Sets up tracing for the process, the first DVM that enables it configures it."""
+    global tracer
+    if not tracer.enabled() and sample_rate > 0:
+        tracer = Tracer(sample_rate, file, collector_url, service_name)
+
+
+def trace_id_for_job(job_id) -> str:
+    job_id = str(job_id)
+    if len(job_id) >= 32:
+        return job_id[:32]
+    return hashlib.sha256(job_id.encode("utf-8")).hexdigest()[:32]
+
+
+@contextmanager
+def _record(span):
+    token = _current_span.set(span)
+    try:
+        yield span
+    except Exception as e:
+        span.error = str(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        tracer.finish(span)
+
+
+@contextmanager
+def job_span(job_id, name, **attributes):
+    """Span of the job with the given event id, continues the job's trace if one is running in this context."""
+    if not tracer.enabled():
+        yield None
+        return
+    trace_id = trace_id_for_job(job_id)
+    if not tracer.sampled(trace_id):
+        yield None
+        return
+    current = _current_span.get()
+    parent_id = current.span_id if current is not None and current.trace_id == trace_id else ""
+    attributes["job.id"] = str(job_id)
+    with _record(tracer.start(trace_id, name, parent_id, attributes)) as span:
+        yield span
+
+
+@contextmanager
+def span(name, **attributes):
+    """Child span of the current job span, does nothing outside of a traced job."""
+    current = _current_span.get()
+    if current is None:
+        yield None
+        return
+    with _record(tracer.start(current.trace_id, name, current.span_id, attributes)) as child:
+        yield child
+
+
+def traced(name):
+    """Decorator that records calls of a function as spans of the current job."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
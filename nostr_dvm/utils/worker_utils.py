@@ -0,0 +1,332 @@
+import importlib
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import struct
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from sys import platform
+
+from nostr_dvm.utils.cancel_utils import current_cancel_token, wait_cancellable, JobCancelled
+from nostr_dvm.utils.stream_utils import emit_partial
+
+"""
+Worker pool for DVM jobs. Jobs are handed to a fixed number of worker threads through a bounded queue, so the
+notification handler never blocks on a slow process() call. Tasks can be limited to a maximum number of jobs running
+at the same time (e.g. to not run two SDXL renders on the same GPU).
+Queued jobs are scheduled by priority class first (subscribers, then paying users, whitelisted users and free jobs).
+Within a class users are served fairly: every user has a virtual finish time, so one user sending many jobs doesn't
+delay the jobs of everybody else. If the queue is full, a job of a lower class is evicted to make room.
+"""
+
+PRIORITY_SUBSCRIBER = 0
+PRIORITY_PAID = 1
+PRIORITY_WHITELISTED = 2
+PRIORITY_FREE = 3
+
+
+@dataclass
+class QueuedJob:
+    task: str
+    function: object
+    args: tuple = field(default_factory=tuple)
+    user: str = ""
+    priority: int = PRIORITY_FREE
+    finish: float = 0.0
+    sequence: int = 0
+
+
+class JobExecutor:
+    def __init__(self, name, max_workers=4, max_queue=50, task_limits=None, user_weights=None, on_evicted=None):
+        self.name = name
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue = max(0, int(max_queue))
+        self.task_limits = dict(task_limits) if task_limits is not None else {}
+        self.user_weights = dict(user_weights) if user_weights is not None else {}
+        self.on_evicted = on_evicted
+        self.pending = []
+        self.running = {}
+        self.virtual_time = {}
+        self.user_finish = {}
+        self.sequence = 0
+        self.condition = threading.Condition()
+
+        for index in range(self.max_workers):
+            worker = threading.Thread(target=self._worker, name=name + "-worker-" + str(index), daemon=True)
+            worker.start()
+
+    def submit(self, task, function, *args, user="", priority=PRIORITY_FREE) -> bool:
+        """Queue a job, returns False if the queue is full and the job was rejected."""
+        evicted = None
+        with self.condition:
+            if len(self.pending) >= self.max_queue + self._idle_workers():
+                evicted = self._lowest_priority_job()
+                if evicted is None or evicted.priority <= priority:
+                    return False
+                self.pending.remove(evicted)
+            self.pending.append(self._schedule(QueuedJob(task=task, function=function, args=args, user=user,
+                                                         priority=priority)))
+            self.condition.notify()
+
+        if evicted is not None and self.on_evicted is not None:
+            try:
+                self.on_evicted(evicted)
+            except Exception as e:
+                print("[" + self.name + "] Error evicting job: " + str(e))
+        return True
+
+    def _idle_workers(self):
+        return max(0, self.max_workers - sum(self.running.values()))
+
+    def _schedule(self, job):
+        # Weighted fair queuing: a job finishes (virtually) one unit of work divided by the user's weight after the
+        # later of the class' current virtual time and the user's previous job in that class
+        key = (job.priority, job.user)
+        start = max(self.virtual_time.get(job.priority, 0.0), self.user_finish.get(key, 0.0))
+        job.finish = start + 1.0 / self.user_weights.get(job.user, 1.0)
+        self.user_finish[key] = job.finish
+        self.sequence += 1
+        job.sequence = self.sequence
+        return job
+
+    def _lowest_priority_job(self):
+        return max(self.pending, key=lambda job: (job.priority, job.finish, job.sequence), default=None)
+
+    def _next_job(self):
+        # Take the job of the highest class with the earliest virtual finish time whose task is not at its limit
+        best = None
+        for job in self.pending:
+            limit = self.task_limits.get(job.task)
+            if limit is not None and self.running.get(job.task, 0) >= limit:
+                continue
+            if best is None or (job.priority, job.finish, job.sequence) < (best.priority, best.finish, best.sequence):
+                best = job
+        if best is not None:
+            self.pending.remove(best)
+            self.virtual_time[best.priority] = max(self.virtual_time.get(best.priority, 0.0), best.finish - 1.0 /
+                                                   self.user_weights.get(best.user, 1.0))
+            self._forget_idle_users()
+        return best
+
+    def _forget_idle_users(self):
+        # Users without queued jobs are forgotten, they start at the current virtual time with their next job
+        if len(self.user_finish) > 2 * len(self.pending) + 100:
+            queued = {(job.priority, job.user) for job in self.pending}
+            self.user_finish = {key: finish for key, finish in self.user_finish.items() if key in queued}
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                job = self._next_job()
+                while job is None:
+                    self.condition.wait()
+                    job = self._next_job()
+                self.running[job.task] = self.running.get(job.task, 0) + 1
+            try:
+                job.function(*job.args)
+            except Exception as e:
+                print("[" + self.name + "] Error in worker: " + str(e))
+            finally:
+                with self.condition:
+                    self.running[job.task] -= 1
+                    self.condition.notify_all()
+
+
+# Process pool for WORKER_MODE "process". Tasks are rebuilt inside the worker process the same way process_venv does,
+# and kept alive so models only have to be loaded once per worker.
+_process_pools = {}
+_process_pools_lock = threading.Lock()
+_worker_tasks = {}
+
+
+def get_process_pool(identifier, max_workers):
+    with _process_pools_lock:
+        if identifier not in _process_pools:
+            _process_pools[identifier] = ProcessPoolExecutor(max_workers=max_workers,
+                                                             mp_context=multiprocessing.get_context("spawn"))
+        return _process_pools[identifier]
+
+
+def run_process_in_pool(dvm, request_form, identifier, max_workers):
+    pool = get_process_pool(identifier, max_workers)
+    future = pool.submit(_process_in_worker, type(dvm).__module__, type(dvm).__name__, identifier, request_form)
+    # a job that is cancelled before a worker picked it up is dropped, a running one can't be stopped
+    return wait_cancellable(future)
+
+
+def _process_in_worker(module_name, class_name, identifier, request_form):
+    from nostr_dvm.utils.dvmconfig import build_default_config
+    from nostr_dvm.utils.nip89_utils import NIP89Config
+    from nostr_dvm.utils.runtime_utils import call_process
+
+    key = module_name + ":" + class_name + ":" + identifier
+    if key not in _worker_tasks:
+        task_class = getattr(importlib.import_module(module_name), class_name)
+        dvm_config = build_default_config(identifier)
+        dvm_config.USE_OWN_VENV = False
+        _worker_tasks[key] = task_class(name="", dvm_config=dvm_config, nip89config=NIP89Config(),
+                                        admin_config=None)
+    return call_process(_worker_tasks[key], request_form)
+
+
+# Persistent workers for USE_OWN_VENV. Instead of starting the task script once per job, a worker process runs
+# process_venv in a loop and receives requests as length prefixed json frames over stdin, answering on stdout.
+def write_frame(stream, message: dict):
+    data = json.dumps(message).encode("utf-8")
+    stream.write(struct.pack(">I", len(data)) + data)
+    stream.flush()
+
+
+def read_frame(stream) -> dict | None:
+    header = stream.read(4)
+    if len(header) < 4:
+        return None
+    length = struct.unpack(">I", header)[0]
+    data = stream.read(length)
+    if len(data) < length:
+        return None
+    return json.loads(data.decode("utf-8"))
+
+
+# One-shot venv processes (VENV_WORKERS = 0) write the partial frames of streamed results to a pipe, its fd is passed
+# in this variable. Scripts of older versions ignore it, the pipe is then closed without frames when they exit.
+PARTIALS_FD_ENV = "NOSTR_DVM_PARTIALS_FD"
+
+
+def run_venv_process(command) -> int:
+    """Runs a one-shot venv process until it exits and emits the partial results it sends on the way. The process is
+    killed when the current job is cancelled. Returns the exit code."""
+    token = current_cancel_token()
+    partials = None
+    if platform == "win32":
+        # no fds can be passed on windows, the result arrives in one piece
+        process = subprocess.Popen(command)
+    else:
+        read_fd, write_fd = os.pipe()
+        env = dict(os.environ)
+        env[PARTIALS_FD_ENV] = str(write_fd)
+        process = subprocess.Popen(command, pass_fds=[write_fd], env=env)
+        os.close(write_fd)
+        partials = os.fdopen(read_fd, 'rb')
+    remove = token.on_cancel(process.kill)
+    try:
+        if partials is not None:
+            with partials:
+                # ends when the process exits (or is killed) and the pipe is closed
+                message = read_frame(partials)
+                while message is not None:
+                    emit_partial(message.get("partial"))
+                    message = read_frame(partials)
+        return process.wait()
+    finally:
+        remove()
+
+
+def open_partials_pipe():
+    """In a one-shot venv process, the pipe to send partial results to the DVM, None if the DVM didn't pass one."""
+    fd = os.environ.pop(PARTIALS_FD_ENV, None)
+    if fd is None:
+        return None
+    # processes the task starts don't get it
+    os.set_inheritable(int(fd), False)
+    return os.fdopen(int(fd), 'wb')
+
+
+class VenvWorkerExited(Exception):
+    pass
+
+
+class VenvWorker:
+    # seconds a worker gets to stop a cancelled job before it is killed
+    CANCEL_GRACE_SECONDS = 10
+
+    def __init__(self, python_bin, script, identifier):
+        self.process = subprocess.Popen([python_bin, script, '--worker', '--identifier', identifier],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.busy = False
+        self.kill_timer = None
+        self.lock = threading.Lock()
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def call(self, request_form):
+        token = current_cancel_token()
+        write_frame(self.process.stdin, {"request": request_form})
+        self.busy = True
+        remove = token.on_cancel(self.interrupt)
+        try:
+            response = read_frame(self.process.stdout)
+            # streamed results arrive as partial frames before the result
+            while response is not None and "partial" in response:
+                emit_partial(response["partial"])
+                response = read_frame(self.process.stdout)
+        finally:
+            remove()
+            with self.lock:
+                self.busy = False
+                if self.kill_timer is not None:
+                    self.kill_timer.cancel()
+                    self.kill_timer = None
+        if response is None:
+            token.check()
+            raise VenvWorkerExited("Venv worker exited unexpectedly")
+        if response.get("cancelled"):
+            raise JobCancelled(token.reason or "Job was cancelled")
+        if response.get("error") is not None:
+            raise Exception(response["error"])
+        return response["result"]
+
+    def interrupt(self):
+        """Asks the worker to stop the current job, it keeps its loaded task. Workers that don't stop in time (e.g.
+        because they are stuck in native code) are killed."""
+        with self.lock:
+            if not self.busy:
+                return
+            if platform == "win32":
+                self.kill()
+                return
+            try:
+                os.kill(self.process.pid, signal.SIGINT)
+            except OSError as e:
+                print(e)
+            self.kill_timer = threading.Timer(self.CANCEL_GRACE_SECONDS, self.kill)
+            self.kill_timer.daemon = True
+            self.kill_timer.start()
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.wait(timeout=5)
+        except Exception as e:
+            print(e)
+
+
+class VenvWorkerPool:
+    def __init__(self, python_bin, script, identifier, size=1):
+        self.python_bin = python_bin
+        self.script = script
+        self.identifier = identifier
+        self.idle = queue.Queue()
+        for index in range(max(1, int(size))):
+            # workers are started on first use, so idle DVMs don't keep models in memory
+            self.idle.put(None)
+
+    def process(self, request_form):
+        worker = self.idle.get()
+        try:
+            if worker is None or not worker.is_alive():
+                worker = VenvWorker(self.python_bin, self.script, self.identifier)
+            return worker.call(request_form)
+        except (OSError, VenvWorkerExited):
+            # the worker crashed or the pipe broke, a fresh one is started for the next job
+            if worker is not None:
+                worker.kill()
+                worker = None
+            raise
+        finally:
+            self.idle.put(worker)
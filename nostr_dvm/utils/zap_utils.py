@@ -24,6 +24,10 @@ import dotenv
 
 proxies = {}
 
+# Seconds to wait for LNbits and lightning address servers. Paying an invoice can take longer, until it is routed
+REQUEST_TIMEOUT = 10
+PAYMENT_TIMEOUT = 60
+
 
 def parse_zap_event_tags(zap_event, keys, name, client, config):
     zapped_event = None
@@ -98,7 +102,7 @@ def create_bolt11_ln_bits(sats: int, config) -> (str, str):
     data = {'out': False, 'amount': sats, 'memo': "Nostr-DVM " + config.NIP89.NAME}
     headers = {'X-API-Key': config.LNBITS_INVOICE_KEY, 'Content-Type': 'application/json', 'charset': 'UTF-8'}
     try:
-        res = requests.post(url, json=data, headers=headers)
+        res = requests.post(url, json=data, headers=headers, timeout=REQUEST_TIMEOUT)
         obj = json.loads(res.text)
         if obj.get("payment_request") and obj.get("payment_hash"):
             return obj["payment_request"], obj["payment_hash"]  #
@@ -119,10 +123,10 @@ def create_bolt11_lud16(lud16, amount):
         return None
     try:
         print(url)
-        response = requests.get(url)
+        response = requests.get(url, timeout=REQUEST_TIMEOUT)
         ob = json.loads(response.content)
         callback = ob["callback"]
-        response = requests.get(callback + "?amount=" + str(int(amount) * 1000))
+        response = requests.get(callback + "?amount=" + str(int(amount) * 1000), timeout=REQUEST_TIMEOUT)
         ob = json.loads(response.content)
         return ob["pr"]
     except Exception as e:
@@ -144,7 +148,7 @@ def create_lnbits_account(name):
         url = os.getenv("LNBITS_HOST") + '/usermanager/api/v1/users'
         print(url)
         headers = {'X-API-Key': os.getenv("LNBITS_ADMIN_KEY"), 'Content-Type': 'application/json', 'charset': 'UTF-8'}
-        r = requests.post(url, data=json_object, headers=headers, proxies=proxies)
+        r = requests.post(url, data=json_object, headers=headers, proxies=proxies, timeout=REQUEST_TIMEOUT)
         walletjson = json.loads(r.text)
         print(walletjson)
         if walletjson.get("wallets"):
@@ -155,11 +159,13 @@ def create_lnbits_account(name):
         return "", "", "", "", "failed"
 
 
-def check_bolt11_ln_bits_is_paid(payment_hash: str, config):
+def check_bolt11_ln_bits_is_paid(payment_hash: str, config, session=None):
     url = config.LNBITS_URL + "/api/v1/payments/" + payment_hash
     headers = {'X-API-Key': config.LNBITS_INVOICE_KEY, 'Content-Type': 'application/json', 'charset': 'UTF-8'}
+    if session is None:
+        session = requests
     try:
-        res = requests.get(url, headers=headers, proxies=proxies)
+        res = session.get(url, headers=headers, proxies=proxies, timeout=REQUEST_TIMEOUT)
         obj = json.loads(res.text)
         if obj.get("paid"):
             return obj["paid"]
@@ -174,7 +180,7 @@ def pay_bolt11_ln_bits(bolt11: str, config):
     data = {'out': True, 'bolt11': bolt11}
     headers = {'X-API-Key': config.LNBITS_ADMIN_KEY, 'Content-Type': 'application/json', 'charset': 'UTF-8'}
     try:
-        res = requests.post(url, json=data, headers=headers)
+        res = requests.post(url, json=data, headers=headers, timeout=PAYMENT_TIMEOUT)
         obj = json.loads(res.text)
         if obj.get("payment_hash"):
             return obj["payment_hash"]
@@ -252,7 +258,7 @@ def zaprequest(lud16: str, amount: int, content, zapped_event, zapped_user, keys
     else:  # No lud16 set or format invalid
         return None
     try:
-        response = requests.get(url)
+        response = requests.get(url, timeout=REQUEST_TIMEOUT)
         ob = json.loads(response.content)
         callback = ob["callback"]
         print(ob["callback"])
@@ -296,7 +302,7 @@ def zaprequest(lud16: str, amount: int, content, zapped_event, zapped_user, keys
                                    tags).to_event(keys).as_json()
 
         response = requests.get(callback + "?amount=" + str(int(amount) * 1000) + "&nostr=" + urllib.parse.quote_plus(
-            zap_request) + "&lnurl=" + encoded_lnurl)
+            zap_request) + "&lnurl=" + encoded_lnurl, timeout=REQUEST_TIMEOUT)
         ob = json.loads(response.content)
         return ob["pr"]
 
@@ -315,7 +321,7 @@ def get_price_per_sat(currency):
 
         header = {'accept': 'application/json', 'X-API-KEY': os.getenv("COINSTATSOPENAPI_KEY")}
         try:
-            response = requests.get(url, headers=header, params=params)
+            response = requests.get(url, headers=header, params=params, timeout=REQUEST_TIMEOUT)
             response_json = response.json()
 
             bitcoin_price = response_json["price"]
@@ -341,7 +347,7 @@ def make_ln_address_nostdress(identifier, npub, pin, nostdressdomain):
 
     try:
         url = "https://" + nostdressdomain + "/api/easy/"
-        res = requests.post(url, data=data)
+        res = requests.post(url, data=data, timeout=REQUEST_TIMEOUT)
         print(res.text)
         obj = json.loads(res.text)
 
@@ -0,0 +1,810 @@
+"""
+Load test for DVMs. Boots a local relay, a fake LNbits and a number of DVMs in this process, then sends a mix of job
+requests at a fixed rate and reports throughput, latency percentiles and memory, so regressions show up before they hit
+production.
+
+The relay and LNbits are stand-ins that only implement what the DVMs use: the relay keeps events in memory and
+doesn't check signatures, LNbits marks every invoice as paid after --pay-delay seconds. By default the DVMs run an
+echo task on kind 5050 that sleeps --work-seconds, so the numbers show the overhead of the framework and not of a
+model. Real tasks can be added with --task, they are built with the build_example of the module and pointed at the
+local relay and LNbits.
+
+Request types:
+    free       request to a DVM without costs
+    paid       request to a DVM with FIX_COST, the invoice is paid by the fake LNbits
+    encrypted  request with encrypted params (NIP-04) to a DVM without costs
+    chained    request with a job input, referencing an earlier request to the same DVM
+
+Examples:
+    python tests/benchmark.py --requests 500 --rate 50 --mix free=6,paid=2,encrypted=1,chained=1 --quiet
+    python tests/benchmark.py --free-dvms 4 --shared-hub --async-runtime --quiet
+    python tests/benchmark.py --free-dvms 0 --paid-dvms 0 --task nostr_dvm.tasks.translation_google --requests 20
+
+--crypto-jobs only measures the NIP-04 work of encrypted jobs (decrypt the request, encrypt two reactions and the
+result), once with nostr-sdk's nip04 functions as the DVM did before and once with a CryptoContext:
+    python tests/benchmark.py --crypto-jobs 2000 --users 50
+"""
+import argparse
+import base64
+import hashlib
+import importlib
+import json
+import os
+import random
+import resource
+import secrets
+import shutil
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import dotenv
+from nostr_sdk import Keys, Client, Tag, EventBuilder, Filter, HandleNotification, Timestamp, nip04_encrypt, \
+    nip04_decrypt, NostrSigner, PublicKey, Kind
+
+from nostr_dvm.interfaces.dvmtaskinterface import DVMTaskInterface
+from nostr_dvm.utils.admin_utils import AdminConfig
+from nostr_dvm.utils.crypto_utils import CryptoContext
+from nostr_dvm.utils.definitions import EventDefinitions
+from nostr_dvm.utils.dvmconfig import DVMConfig
+from nostr_dvm.utils.metrics_utils import metrics
+from nostr_dvm.utils.nip89_utils import NIP89Config
+from nostr_dvm.utils.nostr_utils import get_referenced_event_by_id
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+REQUEST_TYPES = ["free", "paid", "encrypted", "chained"]
+
+
+# Local relay
+
+def filter_matches(nostr_filter, event, tags) -> bool:
+    for key, values in nostr_filter.items():
+        if key == "ids":
+            if not any(event["id"].startswith(value) for value in values):
+                return False
+        elif key == "authors":
+            if not any(event["pubkey"].startswith(value) for value in values):
+                return False
+        elif key == "kinds":
+            if event["kind"] not in values:
+                return False
+        elif key == "since":
+            if event["created_at"] < values:
+                return False
+        elif key == "until":
+            if event["created_at"] > values:
+                return False
+        elif key.startswith("#"):
+            if not any((key[1:], value) in tags for value in values):
+                return False
+    return True
+
+
+class StoredEvent:
+    def __init__(self, event):
+        self.event = event
+        self.json = json.dumps(event)
+        self.tags = {(tag[0], tag[1]) for tag in event.get("tags", []) if len(tag) > 1 and len(tag[0]) == 1}
+
+
+class RelayConnection(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.subscriptions = {}
+        self.send_lock = threading.Lock()
+        self.closed = False
+
+    def handle(self):
+        if not self.handshake():
+            return
+        relay = self.server.relay
+        relay.connected(self)
+        try:
+            while True:
+                message = self.read_message()
+                if message is None:
+                    break
+                relay.on_message(self, message)
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.closed = True
+            relay.disconnected(self)
+
+    def handshake(self) -> bool:
+        request_line = self.rfile.readline()
+        if request_line == b"":
+            return False
+        headers = {}
+        while True:
+            line = self.rfile.readline().decode("latin-1").strip()
+            if line == "":
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        key = headers.get("sec-websocket-key")
+        if key is None:
+            # Not a websocket, answer like a relay answers NIP-11 requests
+            body = json.dumps({"name": "benchmark relay", "supported_nips": [1]}).encode("utf-8")
+            self.wfile.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/nostr+json\r\nContent-Length: " +
+                             str(len(body)).encode() + b"\r\nConnection: close\r\n\r\n" + body)
+            return False
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode("utf-8")).digest()).decode()
+        self.wfile.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                          "Sec-WebSocket-Accept: " + accept + "\r\n\r\n").encode("utf-8"))
+        return True
+
+    def read_exactly(self, length):
+        data = self.rfile.read(length)
+        if len(data) < length:
+            raise ValueError("connection closed")
+        return data
+
+    def read_message(self):
+        message = b""
+        while True:
+            first, second = self.read_exactly(2)
+            fin = first & 0x80
+            opcode = first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                length = struct.unpack(">H", self.read_exactly(2))[0]
+            elif length == 127:
+                length = struct.unpack(">Q", self.read_exactly(8))[0]
+            mask = self.read_exactly(4) if second & 0x80 else None
+            payload = self.read_exactly(length)
+            if mask is not None and length > 0:
+                mask = (mask * (length // 4 + 1))[:length]
+                payload = (int.from_bytes(payload, "big") ^ int.from_bytes(mask, "big")).to_bytes(length, "big")
+
+            if opcode == 0x8:
+                self.send_frame(0x8, payload[:2])
+                return None
+            if opcode == 0x9:
+                self.send_frame(0xA, payload)
+                continue
+            if opcode == 0xA:
+                continue
+            message += payload
+            if fin:
+                return message.decode("utf-8")
+
+    def send_frame(self, opcode, payload):
+        length = len(payload)
+        if length < 126:
+            header = bytes([0x80 | opcode, length])
+        elif length < 65536:
+            header = bytes([0x80 | opcode, 126]) + struct.pack(">H", length)
+        else:
+            header = bytes([0x80 | opcode, 127]) + struct.pack(">Q", length)
+        with self.send_lock:
+            if self.closed:
+                return
+            try:
+                self.wfile.write(header + payload)
+            except OSError:
+                self.closed = True
+
+    def send(self, message):
+        self.send_frame(0x1, message.encode("utf-8"))
+
+
+class LocalRelay:
+    """NIP-01 relay on localhost for benchmarks. Events are kept in memory, signatures are not checked."""
+
+    def __init__(self, port=0, max_events=100000):
+        self.max_events = max_events
+        self.events = OrderedDict()
+        self.events_by_kind = defaultdict(OrderedDict)
+        self.connections = set()
+        self.lock = threading.Lock()
+        self.received = 0
+        self.requests = 0
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", port), RelayConnection)
+        self.server.daemon_threads = True
+        self.server.relay = self
+        self.url = "ws://127.0.0.1:" + str(self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, name="benchmark-relay", daemon=True).start()
+
+    def connected(self, connection):
+        with self.lock:
+            self.connections.add(connection)
+
+    def disconnected(self, connection):
+        with self.lock:
+            self.connections.discard(connection)
+
+    def subscription_count(self) -> int:
+        with self.lock:
+            return sum(len(connection.subscriptions) for connection in self.connections)
+
+    def on_message(self, connection, message):
+        try:
+            data = json.loads(message)
+        except ValueError:
+            data = None
+        if not isinstance(data, list) or len(data) == 0:
+            connection.send(json.dumps(["NOTICE", "invalid message"]))
+            return
+        command = data[0]
+        if command == "EVENT" and len(data) > 1:
+            self.on_event(connection, data[1])
+        elif command == "REQ" and len(data) > 1:
+            self.on_req(connection, data[1], data[2:])
+        elif command == "CLOSE" and len(data) > 1:
+            connection.subscriptions.pop(data[1], None)
+        else:
+            connection.send(json.dumps(["NOTICE", "unsupported: " + str(command)]))
+
+    def on_event(self, connection, event):
+        stored = StoredEvent(event)
+        with self.lock:
+            self.received += 1
+            duplicate = event["id"] in self.events
+            if not duplicate:
+                self.events[event["id"]] = stored
+                self.events_by_kind[event["kind"]][event["id"]] = stored
+                while len(self.events) > self.max_events:
+                    _, oldest = self.events.popitem(last=False)
+                    self.events_by_kind[oldest.event["kind"]].pop(oldest.event["id"], None)
+            connections = list(self.connections)
+        connection.send(json.dumps(["OK", event["id"], True, "duplicate:" if duplicate else ""]))
+        if duplicate:
+            return
+        for receiver in connections:
+            for subscription_id, filters in list(receiver.subscriptions.items()):
+                if any(filter_matches(nostr_filter, event, stored.tags) for nostr_filter in filters):
+                    receiver.send('["EVENT",' + json.dumps(subscription_id) + "," + stored.json + "]")
+
+    def on_req(self, connection, subscription_id, filters):
+        connection.subscriptions[subscription_id] = filters
+        self.requests += 1
+        found = {}
+        for nostr_filter in filters:
+            for stored in self.query(nostr_filter):
+                found[stored.event["id"]] = stored
+        for stored in sorted(found.values(), key=lambda s: s.event["created_at"], reverse=True):
+            connection.send('["EVENT",' + json.dumps(subscription_id) + "," + stored.json + "]")
+        connection.send(json.dumps(["EOSE", subscription_id]))
+
+    def query(self, nostr_filter) -> list:
+        with self.lock:
+            if "ids" in nostr_filter and all(len(value) == 64 for value in nostr_filter["ids"]):
+                candidates = [self.events[value] for value in nostr_filter["ids"] if value in self.events]
+            elif "kinds" in nostr_filter:
+                candidates = [stored for kind in nostr_filter["kinds"]
+                              for stored in self.events_by_kind.get(kind, {}).values()]
+            else:
+                candidates = list(self.events.values())
+        matching = [stored for stored in candidates if filter_matches(nostr_filter, stored.event, stored.tags)]
+        matching.sort(key=lambda s: s.event["created_at"], reverse=True)
+        if "limit" in nostr_filter:
+            matching = matching[:nostr_filter["limit"]]
+        return matching
+
+
+# Fake LNbits
+
+class LNbitsRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        lnbits = self.server.lnbits
+        if self.path.split("?")[0] != "/api/v1/payments":
+            self.reply(404, {"detail": "Not found"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            data = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self.reply(400, {"detail": "Invalid json"})
+            return
+        if data.get("out"):
+            self.reply(201, {"payment_hash": lnbits.pay(data.get("bolt11", ""))})
+        else:
+            bolt11, payment_hash = lnbits.create_invoice(int(data.get("amount", 0)))
+            self.reply(201, {"payment_hash": payment_hash, "payment_request": bolt11, "checking_id": payment_hash})
+
+    def do_GET(self):
+        lnbits = self.server.lnbits
+        path = self.path.split("?")[0]
+        if path == "/api/v1/payments/sse":
+            self.stream_payments()
+        elif path.startswith("/api/v1/payments/"):
+            paid = lnbits.is_paid(path.split("/")[-1])
+            if paid is None:
+                self.reply(404, {"detail": "Payment does not exist."})
+            else:
+                self.reply(200, {"paid": paid})
+        else:
+            self.reply(404, {"detail": "Not found"})
+
+    def stream_payments(self):
+        lnbits = self.server.lnbits
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        announced = set()
+        try:
+            while True:
+                for payment_hash in lnbits.paid_invoices():
+                    if payment_hash not in announced:
+                        announced.add(payment_hash)
+                        payment = {"payment_hash": payment_hash, "checking_id": payment_hash}
+                        data = ("data: " + json.dumps(payment) + "\n\n").encode("utf-8")
+                        self.wfile.write(format(len(data), "x").encode() + b"\r\n" + data + b"\r\n")
+                time.sleep(0.1)
+        except OSError:
+            return
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        return
+
+
+class FakeLNbits:
+    """Answers the LNbits endpoints the DVMs use, every invoice is paid pay_delay seconds after it was created."""
+
+    def __init__(self, port=0, pay_delay=0.5):
+        self.pay_delay = pay_delay
+        self.invoices = {}
+        self.lock = threading.Lock()
+        self.created = 0
+        self.payments_out = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), LNbitsRequestHandler)
+        self.server.lnbits = self
+        self.url = "http://127.0.0.1:" + str(self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, name="benchmark-lnbits", daemon=True).start()
+
+    def create_invoice(self, amount):
+        payment_hash = secrets.token_hex(32)
+        # lnbc<amount * 10>n parses back to amount sats with parse_amount_from_bolt11_invoice
+        bolt11 = "lnbc" + str(amount * 10) + "n1p" + payment_hash[:50]
+        with self.lock:
+            self.invoices[payment_hash] = time.monotonic() + self.pay_delay
+            self.created += 1
+        return bolt11, payment_hash
+
+    def is_paid(self, payment_hash):
+        with self.lock:
+            paid_at = self.invoices.get(payment_hash)
+        if paid_at is None:
+            return None
+        return time.monotonic() >= paid_at
+
+    def paid_invoices(self) -> list:
+        now = time.monotonic()
+        with self.lock:
+            return [payment_hash for payment_hash, paid_at in self.invoices.items() if paid_at <= now]
+
+    def pay(self, bolt11):
+        with self.lock:
+            self.payments_out += 1
+        return secrets.token_hex(32)
+
+
+# Echo task
+
+class EchoTask(DVMTaskInterface):
+    KIND: Kind = EventDefinitions.KIND_NIP90_GENERATE_TEXT
+    TASK: str = "text-generation"
+    FIX_COST: float = 0
+
+    def __init__(self, name, dvm_config: DVMConfig, nip89config: NIP89Config, admin_config: AdminConfig = None,
+                 options=None):
+        super().__init__(name=name, dvm_config=dvm_config, nip89config=nip89config, admin_config=admin_config,
+                         options=options)
+
+    def is_input_supported(self, tags, client=None, dvm_config=None):
+        for tag in tags:
+            if tag.as_vec()[0] == 'i':
+                input_type = tag.as_vec()[2]
+                if input_type != "text" and input_type != "job":
+                    return False
+        return True
+
+    def create_request_from_nostr_event(self, event, client=None, dvm_config=None):
+        request_form = {"jobID": event.id().to_hex()}
+        text = ""
+        for tag in event.tags():
+            if tag.as_vec()[0] == 'i':
+                input_type = tag.as_vec()[2]
+                if input_type == "text":
+                    text = tag.as_vec()[1]
+                elif input_type == "job":
+                    evt = get_referenced_event_by_id(event_id=tag.as_vec()[1], client=client,
+                                                     kinds=[EventDefinitions.KIND_NIP90_RESULT_GENERATE_TEXT],
+                                                     dvm_config=dvm_config)
+                    if evt is not None:
+                        text = evt.content()
+
+        options = {
+            "text": text,
+            "work_seconds": self.options.get("work_seconds", 0) if self.options is not None else 0
+        }
+        request_form['options'] = json.dumps(options)
+        return request_form
+
+    def process(self, request_form):
+        options = DVMTaskInterface.set_options(request_form)
+        time.sleep(options["work_seconds"])
+        return options["text"]
+
+
+def set_benchmark_environment(identifier, lnbits_url):
+    """Sets the keys build_default_config looks for, so nothing is created on a real LNbits or written to .env"""
+    prefix = identifier.upper()
+    os.environ["LNBITS_HOST"] = lnbits_url
+    os.environ["DVM_PRIVATE_KEY_" + prefix] = Keys.generate().secret_key().to_hex()
+    os.environ["NIP89_DTAG_" + prefix] = secrets.token_hex(8)
+    for key in ["LNBITS_INVOICE_KEY_", "LNBITS_ADMIN_KEY_", "LNBITS_USER_ID_", "LNBITS_WALLET_ID_"]:
+        os.environ[key + prefix] = secrets.token_hex(16)
+    os.environ["LNADDRESS_" + prefix] = ""
+
+
+def configure_for_benchmark(dvm_config, relay, lnbits, args, data_dir):
+    dvm_config.RELAY_LIST = [relay.url]
+    # every run has new DVMs, their databases are removed with data_dir when the run is over
+    dvm_config.DB = os.path.join(data_dir, os.path.basename(dvm_config.DB))
+    dvm_config.LNBITS_URL = lnbits.url
+    dvm_config.LNBITS_PAYMENT_STREAM = args.payment_stream
+    dvm_config.RATE_LIMIT_PER_USER = 0  # all requests come from a few keys, we measure the DVM not the limiter
+    dvm_config.RATE_LIMIT_GLOBAL = 0
+    dvm_config.SHARED_RELAY_HUB = args.shared_hub
+    dvm_config.ASYNC_RUNTIME = args.async_runtime
+    dvm_config.MAX_WORKERS = args.max_workers
+    dvm_config.MAX_QUEUED_JOBS = max(dvm_config.MAX_QUEUED_JOBS, args.requests)
+    dvm_config.RESULT_CACHE_ON_DISK = False
+
+
+def build_echo(name, identifier, admin_config, fix_cost, work_seconds):
+    dvm_config = DVMConfig()
+    dvm_config.PRIVATE_KEY = os.getenv("DVM_PRIVATE_KEY_" + identifier.upper())
+    dvm_config.IDENTIFIER = identifier
+    dvm_config.LNBITS_INVOICE_KEY = os.getenv("LNBITS_INVOICE_KEY_" + identifier.upper())
+    dvm_config.LNBITS_ADMIN_KEY = os.getenv("LNBITS_ADMIN_KEY_" + identifier.upper())
+    dvm_config.USE_OWN_VENV = False
+    dvm_config.FIX_COST = fix_cost
+
+    nip89config = NIP89Config()
+    nip89config.DTAG = os.getenv("NIP89_DTAG_" + identifier.upper())
+    nip89config.CONTENT = json.dumps({"name": name, "about": "I return the input text, for benchmarks"})
+    return EchoTask(name=name, dvm_config=dvm_config, nip89config=nip89config, admin_config=admin_config,
+                    options={"work_seconds": work_seconds})
+
+
+def start_dvms(relay, lnbits, args, data_dir) -> list:
+    admin_config = AdminConfig()
+    admin_config.REBROADCAST_NIP89 = False
+    admin_config.UPDATE_PROFILE = False
+    run_id = secrets.token_hex(3)
+    dvms = []
+
+    for index in range(args.free_dvms + args.paid_dvms):
+        paid = index >= args.free_dvms
+        identifier = "bench_" + run_id + "_" + str(index)
+        set_benchmark_environment(identifier, lnbits.url)
+        name = "Benchmark " + ("Paid " if paid else "") + "Echo " + run_id + " " + str(index)
+        dvms.append(build_echo(name, identifier, admin_config, args.price if paid else 0, args.work_seconds))
+
+    for index, module_name in enumerate(args.task):
+        module = importlib.import_module(module_name)
+        identifier = "bench_" + run_id + "_task_" + str(index)
+        set_benchmark_environment(identifier, lnbits.url)
+        dvms.append(module.build_example("Benchmark " + module_name.split(".")[-1] + " " + run_id, identifier,
+                                         admin_config))
+
+    for dvm in dvms:
+        configure_for_benchmark(dvm.dvm_config, relay, lnbits, args, data_dir)
+        dvm.run()
+    return dvms
+
+
+# Client
+
+class PendingRequest:
+    def __init__(self, request_type, dvm, sent):
+        self.request_type = request_type
+        self.dvm = dvm
+        self.sent = sent
+        self.finished = None
+        self.status = "sent"
+
+
+class BenchmarkClient:
+    def __init__(self, relay, dvms, args):
+        self.args = args
+        self.dvms = dvms
+        self.users = [Keys.generate() for _ in range(args.users)]
+        self.pending = {}
+        self.plain_requests = defaultdict(list)
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.expected = 0
+        self.finished = 0
+
+        self.client = Client(NostrSigner.keys(self.users[0]))
+        self.client.add_relay(relay.url)
+        self.client.connect()
+        kinds = EventDefinitions.ANY_RESULT + [EventDefinitions.KIND_FEEDBACK]
+        self.client.subscribe([Filter().kinds(kinds).since(Timestamp.now())], None)
+        self.client.handle_notifications(BenchmarkNotificationHandler(self))
+        self.senders = ThreadPoolExecutor(max_workers=args.senders, thread_name_prefix="benchmark-send")
+
+    def build_request(self, request_type, dvm, user):
+        i_tag = Tag.parse(["i", self.args.prompt, "text"])
+        p_tag = Tag.parse(["p", dvm.PUBLIC_KEY])
+        alt_tag = Tag.parse(["alt", "Benchmark request"])
+        if request_type == "encrypted":
+            params = json.dumps([i_tag.as_vec(), alt_tag.as_vec()])
+            content = nip04_encrypt(user.secret_key(), PublicKey.from_hex(dvm.PUBLIC_KEY), params)
+            return EventBuilder(dvm.KIND, content, [p_tag, Tag.parse(["encrypted"])]).to_event(user)
+        if request_type == "chained":
+            with self.lock:
+                earlier = self.plain_requests[dvm.PUBLIC_KEY][-1]
+            i_tag = Tag.parse(["i", earlier, "job"])
+        return EventBuilder(dvm.KIND, "Benchmark request", [i_tag, p_tag, alt_tag]).to_event(user)
+
+    def choose_dvm(self, request_type):
+        if request_type == "paid":
+            candidates = [dvm for dvm in self.dvms if dvm.FIX_COST > 0]
+        else:
+            candidates = [dvm for dvm in self.dvms if dvm.FIX_COST == 0]
+        if request_type == "chained":
+            with self.lock:
+                candidates = [dvm for dvm in candidates if len(self.plain_requests[dvm.PUBLIC_KEY]) > 0]
+        if len(candidates) == 0:
+            return None
+        return random.choice(candidates)
+
+    def send(self, request_type):
+        dvm = self.choose_dvm(request_type)
+        if dvm is None:
+            # nothing to chain to yet, or no DVM for this type
+            request_type = "free"
+            dvm = self.choose_dvm(request_type)
+            if dvm is None:
+                return
+        event = self.build_request(request_type, dvm, random.choice(self.users))
+        event_id = event.id().to_hex()
+        with self.lock:
+            self.pending[event_id] = PendingRequest(request_type, dvm, time.monotonic())
+            if request_type == "free" or request_type == "paid":
+                self.plain_requests[dvm.PUBLIC_KEY].append(event_id)
+        self.senders.submit(self.publish, event, event_id)
+
+    def publish(self, event, event_id):
+        try:
+            self.client.send_event(event)
+        except Exception as e:
+            self.finish(event_id, "send-error")
+            print("Could not send request: " + str(e))
+
+    def finish(self, event_id, status):
+        with self.lock:
+            request = self.pending.get(event_id)
+            if request is None or request.finished is not None:
+                return
+            request.finished = time.monotonic()
+            request.status = status
+            self.finished += 1
+            finished = self.finished
+        if finished >= self.expected:
+            self.done.set()
+
+    def run(self, mix):
+        self.expected = self.args.requests
+        types = [request_type for request_type, weight in mix.items() for _ in range(weight)]
+        interval = 1.0 / self.args.rate
+        start = time.monotonic()
+        for index in range(self.args.requests):
+            # requests are sent on a fixed schedule, a slow DVM doesn't slow down the load
+            delay = start + index * interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.send(random.choice(types))
+        self.done.wait(self.args.timeout)
+        return start
+
+
+class BenchmarkNotificationHandler(HandleNotification):
+    def __init__(self, benchmark):
+        super().__init__()
+        self.benchmark = benchmark
+
+    def handle(self, relay_url, subscription_id, event):
+        event_id = None
+        status = None
+        for tag in event.tags():
+            values = tag.as_vec()
+            if values[0] == "e" and len(values) > 1:
+                event_id = values[1]
+            elif values[0] == "status" and len(values) > 1:
+                status = values[1]
+        if event_id is None:
+            return
+        if event.kind().as_u64() == EventDefinitions.KIND_FEEDBACK.as_u64():
+            if status == "error":
+                self.benchmark.finish(event_id, "error")
+        else:
+            self.benchmark.finish(event_id, "success")
+
+    def handle_msg(self, relay_url, msg):
+        return
+
+
+# Report
+
+def percentile(values, q):
+    if len(values) == 0:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
+
+
+def max_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def report(benchmark, start, relay, lnbits, rss_before, out):
+    with benchmark.lock:
+        requests = list(benchmark.pending.values())
+    finished = [r for r in requests if r.status == "success"]
+    end = max((r.finished for r in finished), default=time.monotonic())
+    duration = max(end - start, 0.001)
+
+    out.write("\nSent: " + str(len(requests)) + ", succeeded: " + str(len(finished)) + ", failed: " +
+              str(sum(1 for r in requests if r.status not in ("sent", "success"))) + ", timed out: " +
+              str(sum(1 for r in requests if r.status == "sent")) + "\n")
+    out.write("Throughput: " + format(len(finished) / duration, ".2f") + " jobs/s over " + format(duration, ".1f") +
+              "s\n")
+    out.write(format("type", "<10") + format("count", ">7") + format("p50", ">10") + format("p99", ">10") +
+              format("max", ">10") + "\n")
+    for request_type in REQUEST_TYPES + ["all"]:
+        latencies = [r.finished - r.sent for r in finished if request_type == "all" or r.request_type == request_type]
+        if len(latencies) == 0:
+            continue
+        out.write(format(request_type, "<10") + format(len(latencies), ">7") +
+                  format(percentile(latencies, 0.5), ">9.3f") + "s" + format(percentile(latencies, 0.99), ">9.3f") +
+                  "s" + format(max(latencies), ">9.3f") + "s\n")
+    out.write("Max RSS: " + format(max_rss_mb(), ".1f") + " MB (" + format(max_rss_mb() - rss_before, "+.1f") +
+              " MB during the run)\n")
+    out.write("Relay: " + str(relay.received) + " events, " + str(relay.requests) + " subscriptions. LNbits: " +
+              str(lnbits.created) + " invoices, " + str(lnbits.payments_out) + " payments\n")
+    summary = metrics.summary()
+    if summary != "":
+        out.write("\nDVM stages:\n" + summary + "\n")
+    out.flush()
+
+
+def parse_mix(mix) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        request_type, _, weight = part.partition("=")
+        if request_type.strip() not in REQUEST_TYPES:
+            raise argparse.ArgumentTypeError("unknown request type " + request_type)
+        weights[request_type.strip()] = int(weight or 1)
+    return weights
+
+
+def crypto_benchmark(args):
+    """Per job crypto cost of an encrypted job, before and with a CryptoContext."""
+    dvm_private_key = Keys.generate().secret_key().to_hex()
+    dvm_public_key = Keys.parse(dvm_private_key).public_key()
+    customers = [Keys.generate() for _ in range(args.users)]
+    params = json.dumps([["i", args.prompt, "text"], ["param", "language", "en"], ["alt", "Benchmark request"]])
+    reaction = json.dumps([["status", "processing"], ["content", "NIP90 DVM AI task started processing."]])
+    result = args.prompt * max(1, 1000 // max(1, len(args.prompt)))
+    requests = [(customer.public_key(), nip04_encrypt(customer.secret_key(), dvm_public_key, params))
+                for customer in random.choices(customers, k=args.crypto_jobs)]
+
+    start = time.perf_counter()
+    for author, content in requests:
+        nip04_decrypt(Keys.parse(dvm_private_key).secret_key(), author, content)
+        for message in [reaction, reaction, result]:
+            nip04_encrypt(Keys.parse(dvm_private_key).secret_key(), author, message)
+    before = (time.perf_counter() - start) / len(requests)
+
+    crypto = CryptoContext(dvm_private_key)
+    start = time.perf_counter()
+    for author, content in requests:
+        crypto.decrypt(author, content)
+        for message in [reaction, reaction, result]:
+            crypto.encrypt(author, message)
+    after = (time.perf_counter() - start) / len(requests)
+
+    print(str(len(requests)) + " encrypted jobs from " + str(len(customers)) + " customers")
+    print("nip04 functions: " + format(before * 1000000, ".1f") + " us per job")
+    print("CryptoContext:   " + format(after * 1000000, ".1f") + " us per job (" + str(crypto.misses) +
+          " shared secrets derived, " + str(crypto.hits) + " reused)")
+
+
+def wait_for_subscriptions(relay, count, timeout=60):
+    deadline = time.monotonic() + timeout
+    while relay.subscription_count() < count and time.monotonic() < deadline:
+        time.sleep(0.1)
+    # DVMs subscribe with since=now, requests must not be from the same second
+    time.sleep(1.1)
+
+
+def benchmark(args):
+    out = sys.stdout
+    if args.quiet:
+        sys.stdout = open(os.devnull, "w")
+    rss_before = max_rss_mb()
+    data_dir = tempfile.mkdtemp(prefix="nostr-dvm-benchmark-")
+
+    try:
+        relay = LocalRelay(port=args.relay_port)
+        lnbits = FakeLNbits(port=args.lnbits_port, pay_delay=args.pay_delay)
+        out.write("Relay on " + relay.url + ", LNbits on " + lnbits.url + "\n")
+
+        dvms = start_dvms(relay, lnbits, args, data_dir)
+        wait_for_subscriptions(relay, len(dvms))
+        client = BenchmarkClient(relay, dvms, args)
+        wait_for_subscriptions(relay, len(dvms) + 1)
+
+        out.write("Sending " + str(args.requests) + " requests at " + str(args.rate) + "/s to " + str(len(dvms)) +
+                  " DVMs..\n")
+        out.flush()
+        start = client.run(parse_mix(args.mix))
+        report(client, start, relay, lnbits, rss_before, out)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    # DVM threads run forever
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test DVMs against a local relay and a fake LNbits")
+    parser.add_argument("--requests", type=int, default=200, help="number of requests to send")
+    parser.add_argument("--rate", type=float, default=20, help="requests per second")
+    parser.add_argument("--mix", default="free=6,paid=2,encrypted=1,chained=1",
+                        help="weights of the request types, " + ", ".join(REQUEST_TYPES))
+    parser.add_argument("--free-dvms", type=int, default=2, help="echo DVMs without costs")
+    parser.add_argument("--paid-dvms", type=int, default=1, help="echo DVMs with FIX_COST --price")
+    parser.add_argument("--task", action="append", default=[],
+                        help="module with a build_example to add as DVM, e.g. nostr_dvm.tasks.translation_google")
+    parser.add_argument("--price", type=int, default=10, help="sats per job of the paid DVMs")
+    parser.add_argument("--work-seconds", type=float, default=0.05, help="time the echo task takes per job")
+    parser.add_argument("--prompt", default="Hello benchmark", help="text input of the requests")
+    parser.add_argument("--users", type=int, default=20, help="number of keys requests are signed with")
+    parser.add_argument("--senders", type=int, default=4, help="threads that publish requests")
+    parser.add_argument("--max-workers", type=int, default=DVMConfig.MAX_WORKERS, help="MAX_WORKERS of every DVM")
+    parser.add_argument("--pay-delay", type=float, default=0.5, help="seconds until an invoice is paid")
+    parser.add_argument("--payment-stream", action="store_true", help="DVMs listen to the LNbits payment stream")
+    parser.add_argument("--shared-hub", action="store_true", help="DVMs share one relay connection")
+    parser.add_argument("--async-runtime", action="store_true", help="DVMs run on the shared asyncio runtime")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for results after sending")
+    parser.add_argument("--relay-port", type=int, default=0)
+    parser.add_argument("--lnbits-port", type=int, default=0)
+    parser.add_argument("--quiet", action="store_true", help="hide the output of the DVMs")
+    parser.add_argument("--crypto-jobs", type=int, default=0, help="only run the crypto micro-benchmark")
+
+    args = parser.parse_args()
+    env_path = Path('.env')
+    if env_path.is_file():
+        # tasks added with --task might need api keys
+        dotenv.load_dotenv(env_path, verbose=False, override=False)
+    if args.crypto_jobs > 0:
+        crypto_benchmark(args)
+    else:
+        benchmark(args)
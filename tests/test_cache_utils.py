@@ -0,0 +1,134 @@
+import threading
+import time
+
+import pytest
+
+from nostr_dvm.utils.cache_utils import ResultCache, SingleFlight, build_cache_key
+from nostr_dvm.utils.cancel_utils import CancelToken, JobCancelled, cancel_scope
+
+
+class Request:
+    """Just what build_cache_key reads of a nostr event."""
+
+    class Value:
+        def __init__(self, value):
+            self.value = value
+
+        def as_vec(self):
+            return self.value
+
+        def as_u64(self):
+            return self.value
+
+    def __init__(self, kind, tags):
+        self._kind = kind
+        self._tags = tags
+
+    def kind(self):
+        return Request.Value(self._kind)
+
+    def tags(self):
+        return [Request.Value(tag) for tag in self._tags]
+
+
+def test_cache_key_ignores_param_order_whitespace_and_other_tags():
+    a = Request(5002, [["i", "hello", "text"], ["param", "language", "en"], ["param", "model", "x"],
+                       ["relays", "wss://a"]])
+    b = Request(5002, [["i", " hello ", "text"], ["param", "model", "x"], ["param", "language", "en"],
+                       ["bid", "1000"]])
+    assert build_cache_key("translation", a) == build_cache_key("translation", b)
+
+
+def test_cache_key_depends_on_inputs_params_kind_and_task():
+    request = Request(5002, [["i", "hello", "text"], ["param", "language", "en"]])
+    key = build_cache_key("translation", request)
+    assert key != build_cache_key("translation", Request(5002, [["i", "bye", "text"], ["param", "language", "en"]]))
+    assert key != build_cache_key("translation", Request(5002, [["i", "hello", "text"], ["param", "language", "de"]]))
+    assert key != build_cache_key("translation", Request(5003, [["i", "hello", "text"], ["param", "language", "en"]]))
+    assert key != build_cache_key("summarization", request)
+
+
+def test_result_cache_expires_and_evicts():
+    cache = ResultCache(max_entries=2)
+    cache.put("a", "result a", ttl=60)
+    cache.put("b", "result b", ttl=0.05)
+    assert cache.get("a") == "result a"
+    time.sleep(0.1)
+    assert cache.get("b") is None
+    cache.put("c", "result c", ttl=60)
+    cache.put("d", "result d", ttl=60)
+    assert cache.get("a") is None
+    assert cache.get("d") == "result d"
+
+
+def test_result_cache_only_keeps_strings():
+    cache = ResultCache()
+    cache.put("a", None, ttl=60)
+    assert cache.get("a") is None
+
+
+def test_result_cache_on_disk_survives_a_restart(tmp_path):
+    db = str(tmp_path / "cache.db")
+    ResultCache(db=db).put("a", "result a", ttl=60)
+    assert ResultCache(db=db).get("a") == "result a"
+
+
+def test_single_flight_runs_identical_calls_once():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+    results = []
+
+    def work():
+        calls.append(1)
+        release.wait(5)
+        return "result"
+
+    threads = [threading.Thread(target=lambda: results.append(flight.do("key", work))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert calls == [1]
+    assert results == ["result"] * 3
+
+
+def test_single_flight_shares_errors():
+    flight = SingleFlight()
+    with pytest.raises(ValueError):
+        flight.do("key", lambda: (_ for _ in ()).throw(ValueError("failed")))
+    # the failed call is not remembered
+    assert flight.do("key", lambda: "result") == "result"
+
+
+def test_waiting_job_takes_over_when_the_leader_is_cancelled():
+    flight = SingleFlight()
+    leader_token = CancelToken()
+    leader_running = threading.Event()
+    outcome = {}
+
+    def leader_work():
+        leader_running.set()
+        leader_token.wait(5)
+        leader_token.check()
+
+    def leader():
+        with cancel_scope(leader_token):
+            try:
+                flight.do("key", leader_work)
+            except JobCancelled:
+                outcome["leader"] = "cancelled"
+
+    def follower():
+        outcome["follower"] = flight.do("key", lambda: "result of follower")
+
+    threading.Thread(target=leader).start()
+    assert leader_running.wait(5)
+    waiting = threading.Thread(target=follower)
+    waiting.start()
+    time.sleep(0.1)
+    leader_token.cancel()
+    waiting.join(5)
+    assert outcome == {"leader": "cancelled", "follower": "result of follower"}
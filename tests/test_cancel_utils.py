@@ -0,0 +1,67 @@
+import threading
+import time
+
+import pytest
+
+from nostr_dvm.utils.cancel_utils import CancelToken, JobCancelled, Watchdog, cancel_scope, cancellable_sleep, \
+    current_cancel_token, run_abandonable
+
+
+def test_callbacks_run_once_and_late_callbacks_right_away():
+    token = CancelToken()
+    calls = []
+    token.on_cancel(lambda: calls.append("early"))
+    remove = token.on_cancel(lambda: calls.append("removed"))
+    remove()
+    assert token.cancel("stop")
+    assert not token.cancel("again")
+    token.on_cancel(lambda: calls.append("late"))
+    assert calls == ["early", "late"]
+    assert token.reason == "stop"
+
+
+def test_current_token_outside_of_a_job_is_never_cancelled():
+    assert not current_cancel_token().cancelled()
+
+
+def test_cancellable_sleep_stops_when_the_job_is_cancelled():
+    token = CancelToken()
+    threading.Timer(0.05, token.cancel).start()
+    start = time.monotonic()
+    with cancel_scope(token), pytest.raises(JobCancelled):
+        cancellable_sleep(5)
+    assert time.monotonic() - start < 1
+
+
+def test_abandoned_work_doesnt_keep_the_caller():
+    token = CancelToken()
+    threading.Timer(0.05, token.cancel).start()
+    start = time.monotonic()
+    with cancel_scope(token), pytest.raises(JobCancelled):
+        run_abandonable(lambda: time.sleep(2))
+    assert time.monotonic() - start < 1
+
+
+def test_abandonable_work_returns_its_result_and_raises_its_error():
+    assert run_abandonable(lambda: "result") == "result"
+    with pytest.raises(ValueError):
+        run_abandonable(lambda: int("x"))
+
+
+def test_watchdog_cancels_jobs_over_their_budget():
+    watchdog = Watchdog("test")
+    slow = CancelToken()
+    fast = CancelToken()
+    watchdog.watch(slow, 0.05)
+    unwatch = watchdog.watch(fast, 0.05)
+    unwatch()
+    assert slow.wait(1)
+    assert slow.timed_out
+    time.sleep(0.1)
+    assert not fast.cancelled()
+
+
+def test_watchdog_without_budget():
+    token = CancelToken()
+    Watchdog("test").watch(token, 0)
+    assert not token.wait(0.1)
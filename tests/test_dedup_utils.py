@@ -0,0 +1,25 @@
+import time
+
+from nostr_dvm.utils.dedup_utils import SeenEvents
+
+
+def test_duplicates_are_detected():
+    seen = SeenEvents()
+    assert not seen.is_duplicate("a")
+    assert seen.is_duplicate("a")
+    assert not seen.is_duplicate("b")
+
+
+def test_oldest_ids_are_forgotten_when_full():
+    seen = SeenEvents(max_size=2)
+    for event_id in ["a", "b", "c"]:
+        seen.is_duplicate(event_id)
+    assert "a" not in seen.seen
+    assert seen.is_duplicate("c")
+
+
+def test_ids_are_forgotten_after_the_window():
+    seen = SeenEvents(window_seconds=0.05)
+    assert not seen.is_duplicate("a")
+    time.sleep(0.1)
+    assert not seen.is_duplicate("a")
@@ -0,0 +1,65 @@
+import threading
+import time
+
+from nostr_dvm.utils.feedback_utils import FeedbackPublisher
+
+
+def recorder():
+    sent = []
+    lock = threading.Lock()
+
+    def deliver(name, seconds=0.0):
+        def send():
+            time.sleep(seconds)
+            with lock:
+                sent.append(name)
+        return send
+    return sent, deliver
+
+
+def test_progress_updates_are_coalesced():
+    sent, deliver = recorder()
+    publisher = FeedbackPublisher(window=0.05, min_interval=0)
+    publisher.publish("job", "processing", deliver("processing"))
+    publisher.publish("job", "subscription-required", deliver("subscription-required"))
+    time.sleep(0.2)
+    assert sent == ["subscription-required"]
+
+
+def test_other_statuses_are_sent_right_away_in_order():
+    sent, deliver = recorder()
+    publisher = FeedbackPublisher(window=10, min_interval=0)
+    publisher.publish("job", "processing", deliver("processing"))
+    publisher.publish("job", "payment-required", deliver("payment-required"))
+    time.sleep(0.2)
+    assert sent == ["processing", "payment-required"]
+
+
+def test_updates_with_an_invoice_are_never_replaced():
+    sent, deliver = recorder()
+    publisher = FeedbackPublisher(window=0.05, min_interval=0)
+    publisher.publish("job", "processing", deliver("invoice"), has_invoice=True)
+    publisher.publish("job", "processing", deliver("processing"))
+    time.sleep(0.2)
+    assert sent == ["invoice", "processing"]
+
+
+def test_flush_sends_queued_feedback_before_it_returns():
+    sent, deliver = recorder()
+    publisher = FeedbackPublisher(window=0.25, min_interval=1.0)
+    publisher.publish("job", "partial", deliver("partial 1", 0.2))
+    # the sender thread is delivering the first partial now
+    time.sleep(0.05)
+    publisher.publish("job", "partial", deliver("partial 2"))
+    publisher.publish("job", "processing", deliver("processing"))
+    publisher.flush("job")
+    sent.append("result")
+    time.sleep(0.5)
+    assert sent == ["partial 1", "partial 2", "result"]
+
+
+def test_without_window_updates_are_sent_by_the_caller():
+    sent, deliver = recorder()
+    publisher = FeedbackPublisher(window=0)
+    publisher.publish("job", "processing", deliver("processing"))
+    assert sent == ["processing"]
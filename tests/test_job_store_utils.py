@@ -0,0 +1,58 @@
+import sqlite3
+import time
+
+from nostr_dvm.utils.job_store_utils import JobStore
+
+
+class Request:
+    """Just what the job store reads of a nostr event."""
+
+    class Id:
+        def __init__(self, value):
+            self.value = value
+
+        def to_hex(self):
+            return self.value
+
+    def __init__(self, event_id):
+        self.event_id = event_id
+
+    def id(self):
+        return Request.Id(self.event_id)
+
+    def as_json(self):
+        return '{"id": "' + self.event_id + '"}'
+
+
+def wait_for_writer(store):
+    time.sleep(store.flush_interval * 4)
+
+
+def test_resumable_jobs_are_loaded_with_their_last_state(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"), flush_interval=0.02)
+    store.record(Request("a"), "payment-required", amount=10, is_paid=False, bolt11="lnbc", payment_hash="hash",
+                 expires=123)
+    store.record(Request("a"), "paid", is_paid=True)
+    store.record(Request("b"), "queued", amount=0, is_paid=True)
+    store.record(Request("b"), "finished")
+    wait_for_writer(store)
+
+    jobs = store.load_pending()
+    assert [job.id for job in jobs] == ["a"]
+    # values that were not given again are kept
+    assert (jobs[0].status, jobs[0].amount, jobs[0].is_paid, jobs[0].bolt11, jobs[0].payment_hash,
+            jobs[0].expires) == ("paid", 10, True, "lnbc", "hash", 123)
+
+
+def test_finished_jobs_are_pruned_on_start(tmp_path):
+    db = str(tmp_path / "jobs.db")
+    store = JobStore(db, flush_interval=0.02)
+    for event_id, status in [("a", "finished"), ("b", "cancelled"), ("c", "timeout"), ("d", "queued")]:
+        store.record(Request(event_id), status)
+    wait_for_writer(store)
+
+    JobStore(db, keep_finished_seconds=-10)
+    con = sqlite3.connect(db)
+    ids = [row[0] for row in con.execute("SELECT id FROM jobs")]
+    con.close()
+    assert ids == ["d"]
@@ -0,0 +1,71 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from nostr_dvm.utils.payment_utils import InvoiceSettlementPoller
+
+
+def dvm_config():
+    return SimpleNamespace(NIP89=SimpleNamespace(NAME="test"), LNBITS_URL="http://localhost",
+                           LNBITS_INVOICE_KEY="key")
+
+
+class ScriptedPoller(InvoiceSettlementPoller):
+    """Answers checks from a dict instead of asking LNbits."""
+
+    def __init__(self, paid, **kwargs):
+        self.paid = paid
+        self.checks = []
+        self.settled = []
+        self.done = threading.Event()
+        super().__init__(dvm_config(), self.on_paid, **kwargs)
+
+    def on_paid(self, payment_hash, is_paid):
+        self.settled.append((payment_hash, is_paid))
+        self.done.set()
+
+    def check(self, payment_hash):
+        self.checks.append(payment_hash)
+        return self.paid.get(payment_hash, False)
+
+
+def test_paid_invoice_is_settled_once():
+    poller = ScriptedPoller({"a": True}, min_interval=0.01, max_interval=0.05)
+    poller.watch("a")
+    poller.watch("a")
+    assert poller.done.wait(2)
+    time.sleep(0.1)
+    assert poller.settled == [("a", True)]
+
+
+def test_expired_invoice_is_settled_as_not_paid():
+    poller = ScriptedPoller({"a": None}, min_interval=0.01, max_interval=0.05)
+    poller.watch("a")
+    assert poller.done.wait(2)
+    assert poller.settled == [("a", None)]
+
+
+def test_unpaid_invoices_back_off_up_to_max_interval():
+    poller = ScriptedPoller({}, min_interval=0.01, max_interval=0.04)
+    poller.watch("a")
+    time.sleep(0.5)
+    assert 5 <= len(poller.checks) <= 50
+    assert poller.watched["a"].interval == 0.04
+
+
+def test_unwatched_invoices_are_not_settled():
+    poller = ScriptedPoller({"a": True}, min_interval=0.2)
+    poller.watch("a")
+    assert poller.unwatch("a")
+    time.sleep(0.4)
+    assert poller.settled == []
+
+
+def test_stream_payment_is_confirmed_before_it_is_settled():
+    poller = ScriptedPoller({"a": True}, min_interval=60, max_interval=60)
+    poller.watch("a")
+    poller._handle_stream_data('{"payment_hash": "b"}')
+    poller._handle_stream_data('not json')
+    poller._handle_stream_data('{"payment_hash": "a"}')
+    assert poller.settled == [("a", True)]
+    assert poller.checks == ["a"]
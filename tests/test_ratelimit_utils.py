@@ -0,0 +1,57 @@
+import time
+
+from nostr_dvm.utils.ratelimit_utils import RateLimiter, TokenBucket
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=1, burst=2, now=0.0)
+    assert bucket.take(0.0)
+    assert bucket.take(0.0)
+    assert not bucket.take(0.0)
+    assert not bucket.take(0.5)
+    assert bucket.take(1.5)
+
+
+def test_token_bucket_never_exceeds_burst():
+    bucket = TokenBucket(rate=10, burst=2, now=0.0)
+    assert bucket.is_full(100.0)
+    assert bucket.tokens == 2
+
+
+def test_disabled_by_default():
+    limiter = RateLimiter()
+    for _ in range(100):
+        assert limiter.check("user") == (True, False)
+
+
+def test_user_limit_notifies_once():
+    limiter = RateLimiter(user_rate=0.001, user_burst=2)
+    assert limiter.check("user")[0]
+    assert limiter.check("user")[0]
+    assert limiter.check("user") == (False, True)
+    assert limiter.check("user") == (False, False)
+    # other users have their own bucket
+    assert limiter.check("other")[0]
+
+
+def test_global_limit_doesnt_use_up_the_user_bucket():
+    limiter = RateLimiter(user_rate=0.001, user_burst=2, global_rate=0.001, global_burst=1)
+    assert limiter.check("a")[0]
+    assert not limiter.check("b")[0]
+    assert limiter.buckets["b"].tokens == 2
+
+
+def test_quiet_users_are_evicted():
+    limiter = RateLimiter(user_rate=1000, user_burst=1, max_users=2)
+    for user in ["a", "b", "c", "d"]:
+        limiter.check(user)
+        # the bucket is full again
+        time.sleep(0.01)
+    assert list(limiter.buckets) == ["c", "d"]
+
+
+def test_busy_users_are_kept_up_to_twice_max_users():
+    limiter = RateLimiter(user_rate=0.001, user_burst=1, max_users=2)
+    for user in ["a", "b", "c", "d", "e"]:
+        limiter.check(user)
+    assert list(limiter.buckets) == ["b", "c", "d", "e"]
@@ -0,0 +1,49 @@
+import pytest
+
+from nostr_dvm.utils.cancel_utils import CancelToken, JobCancelled, cancel_scope
+from nostr_dvm.utils.stream_utils import PartialBatcher, collect_stream, partial_sink, streaming
+
+
+def test_batcher_sends_first_chunk_right_away_and_then_batches():
+    sent = []
+    batcher = PartialBatcher(sent.append, min_chars=5, interval=60)
+    for chunk in ["a", "b", "cd", "efg", "h"]:
+        batcher.add(chunk)
+    batcher.flush()
+    assert sent == ["a", "bcdefg", "h"]
+
+
+def test_collect_stream_joins_and_emits_chunks():
+    chunks = []
+    with partial_sink(chunks.append):
+        assert collect_stream(chunk for chunk in ["a", None, "b"]) == "ab"
+    assert chunks == ["a", "b"]
+
+
+def test_other_results_are_returned_as_they_are():
+    assert collect_stream("result") == "result"
+
+
+def test_stream_stops_when_the_job_is_cancelled():
+    token = CancelToken()
+    closed = []
+
+    def generate():
+        try:
+            yield "a"
+            token.cancel()
+            yield "b"
+            yield "c"
+        finally:
+            closed.append(True)
+
+    with cancel_scope(token), pytest.raises(JobCancelled):
+        collect_stream(generate())
+    assert closed == [True]
+
+
+def test_streaming_sends_what_is_left_at_the_end():
+    sent = []
+    with streaming(sent.append, min_chars=100, interval=60):
+        collect_stream(chunk for chunk in ["a", "b", "c"])
+    assert sent == ["a", "bc"]
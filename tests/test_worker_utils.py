@@ -0,0 +1,112 @@
+import io
+import threading
+import time
+
+from nostr_dvm.utils.worker_utils import JobExecutor, read_frame, write_frame, PRIORITY_FREE, PRIORITY_PAID, \
+    PRIORITY_SUBSCRIBER
+
+
+def blocked_executor(**kwargs):
+    """Executor with one worker that is busy until the returned event is set, so submitted jobs stay queued."""
+    executor = JobExecutor("test", max_workers=1, **kwargs)
+    release = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    executor.submit("block", block)
+    assert started.wait(5)
+    return executor, release
+
+
+def run_order(executor, release, jobs):
+    order = []
+    done = threading.Semaphore(0)
+
+    def record(name):
+        order.append(name)
+        done.release()
+
+    for name, kwargs in jobs:
+        assert executor.submit(kwargs.pop("task", "echo"), record, name, **kwargs)
+    release.set()
+    for _ in jobs:
+        assert done.acquire(timeout=5)
+    return order
+
+
+def test_higher_priority_classes_run_first():
+    executor, release = blocked_executor()
+    order = run_order(executor, release, [("free", {"priority": PRIORITY_FREE}),
+                                          ("paid", {"priority": PRIORITY_PAID}),
+                                          ("subscriber", {"priority": PRIORITY_SUBSCRIBER})])
+    assert order == ["subscriber", "paid", "free"]
+
+
+def test_users_are_served_fairly_within_a_class():
+    executor, release = blocked_executor()
+    order = run_order(executor, release, [("a1", {"user": "a"}), ("a2", {"user": "a"}), ("a3", {"user": "a"}),
+                                          ("b1", {"user": "b"})])
+    # b doesn't wait for all jobs a sent before
+    assert order.index("b1") < order.index("a3")
+
+
+def test_user_weights():
+    executor, release = blocked_executor(user_weights={"a": 2.0})
+    order = run_order(executor, release, [("a1", {"user": "a"}), ("a2", {"user": "a"}), ("b1", {"user": "b"})])
+    assert order == ["a1", "a2", "b1"]
+
+
+def test_full_queue_rejects_or_evicts_lower_priority():
+    evicted = []
+    executor, release = blocked_executor(max_queue=1, on_evicted=lambda job: evicted.append(job.args[0]))
+    assert executor.submit("echo", lambda name: None, "free", priority=PRIORITY_FREE)
+    # same class, no room
+    assert not executor.submit("echo", lambda name: None, "free2", priority=PRIORITY_FREE)
+    # a paid job takes the place of the free one
+    assert executor.submit("echo", lambda name: None, "paid", priority=PRIORITY_PAID)
+    assert evicted == ["free"]
+    release.set()
+
+
+def test_task_limits():
+    executor = JobExecutor("test", max_workers=3, task_limits={"gpu": 1})
+    running = []
+    peak = []
+    lock = threading.Lock()
+    done = threading.Semaphore(0)
+
+    def job():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.pop()
+        done.release()
+
+    for _ in range(4):
+        executor.submit("gpu", job)
+    for _ in range(4):
+        assert done.acquire(timeout=5)
+    assert max(peak) == 1
+
+
+def test_frames_round_trip():
+    stream = io.BytesIO()
+    write_frame(stream, {"partial": "a"})
+    write_frame(stream, {"result": "ab"})
+    stream.seek(0)
+    assert read_frame(stream) == {"partial": "a"}
+    assert read_frame(stream) == {"result": "ab"}
+    # end of stream
+    assert read_frame(stream) is None
+
+
+def test_truncated_frame():
+    stream = io.BytesIO()
+    write_frame(stream, {"result": "abc"})
+    stream = io.BytesIO(stream.getvalue()[:-1])
+    assert read_frame(stream) is None